@@ -0,0 +1,116 @@
+# HiveKeepers - container2 - benchmarks/bench_2d_figures.py
+#
+# headless 2d chart build time and payload size
+#
+# builds fig1 and fig2 with the app's own figure builders (no browser, no Dash
+# server) for 1 day, 1 month and 1 year windows of synthetic readings, once with
+# the webgl switch at APP_WEBGL_THRESHOLD and once forced to svg, and reports:
+#   traces    - trace type of the chart traces
+#   points    - points sent in the chart traces (after downsampling)
+#   svg draw  - points the browser draws as svg: svg traces are drawn again in
+#               the rangeslider, webgl traces are not - their rangeslider shows
+#               the coarse overview series instead
+#   build     - median fig1 + fig2 build time
+#   json      - fig1 + fig2 payload size as serialized by Dash (plotly.io.json)
+#
+# usage: python3 bench_2d_figures.py [minutes_between_readings] [repeats]
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.io.json as pio_json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dash_app'))
+
+import hivekeepers_config as hc
+
+WINDOWS = {'1 day': 1, '1 month': 30, '1 year': 365}
+
+
+def make_frame(days, minutes):
+    ## synthetic cleaned 2d readings for one apiary
+    rng = np.random.default_rng(0)
+    timestamps = pd.date_range('2021-10-01', periods=days * 1440 // minutes, freq=f'{minutes}min')
+    n_rows = len(timestamps)
+
+    frame = pd.DataFrame({'apiary_name': 'apiary_a',
+                          'timestamp': timestamps,
+                          'bme680_internal_temperature': rng.normal(34, 2, n_rows).round(2),
+                          'bme680_external_temperature': rng.normal(18, 5, n_rows).round(2)})
+    frame['temp_delta'] = frame['bme680_internal_temperature'] - frame['bme680_external_temperature']
+
+    return frame
+
+
+def count_points(figures):
+    ## returns (chart trace type, chart points, points drawn as svg) for built figures
+    trace_types = set()
+    points = 0
+    svg_points = 0
+
+    for figure in figures:
+        for trace in figure['data']:
+            n_points = len(trace['x'])
+
+            if trace.get('name') == 'overview':
+                svg_points += n_points
+                continue
+
+            trace_types.add(trace['type'])
+            points += n_points
+
+            # svg traces are drawn twice - in the chart and in the rangeslider
+            if trace['type'] == 'scatter':
+                svg_points += 2 * n_points
+
+    return '/'.join(sorted(trace_types)), points, svg_points
+
+
+def timed_build(app, frame, repeats):
+    seconds = []
+
+    for _ in range(repeats):
+        start = time.perf_counter()
+        figures = [app.build_fig1(frame).to_dict(), app.build_fig2(frame).to_dict()]
+        seconds.append(time.perf_counter() - start)
+
+    payload_size = sum(len(pio_json.to_json_plotly(figure)) for figure in figures)
+
+    return figures, float(np.median(seconds)), payload_size
+
+
+def main(minutes, repeats):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # point the app config at an empty temporary database before the app is imported
+        hc.SQLite_db_name = os.path.join(tmp_dir, 'hivekeepers.db')
+
+        import hivekeepers_helpers as hp
+        import hivekeepers_app as app
+
+        webgl_threshold = hc.APP_WEBGL_THRESHOLD
+
+        print(f'one reading per {minutes} minutes, point budget {hc.APP_MAX_POINTS}, '
+              f'webgl threshold {webgl_threshold}, overview {hc.APP_OVERVIEW_POINTS} points')
+        print(f'{"window":>8} {"rows":>7} {"mode":>5} {"traces":>10} {"points":>7} {"svg draw":>9} {"build (ms)":>11} {"json (KB)":>10}')
+
+        for window, days in WINDOWS.items():
+            frame = hp.apply_column_dtypes(make_frame(days, minutes))
+
+            for mode, threshold in [('auto', webgl_threshold), ('svg', float('inf'))]:
+                hc.APP_WEBGL_THRESHOLD = threshold
+                figures, seconds, payload_size = timed_build(app, frame, repeats)
+                trace_types, points, svg_points = count_points(figures)
+
+                print(f'{window:>8} {len(frame.index):>7} {mode:>5} {trace_types:>10} {points:>7} {svg_points:>9} '
+                      f'{seconds * 1000:>11.1f} {payload_size / 1024:>10.0f}')
+
+        hc.APP_WEBGL_THRESHOLD = webgl_threshold
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 5)
@@ -0,0 +1,104 @@
+# HiveKeepers - container2 - benchmarks/bench_build_3d_data.py
+#
+# regression check and timing for hivekeepers_helpers.build_3d_data
+#
+# compares the numpy long-format builder against the original per-element
+# loop implementation (kept below as legacy_build_3d_data) on synthetic
+# frames of 10k/100k/1M source rows.
+#
+# usage: python3 bench_build_3d_data.py [rows ...]
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dash_app'))
+
+import hivekeepers_helpers as hp
+import hivekeepers_config as hc
+
+DEFAULT_ROWS = [10_000, 100_000, 1_000_000]
+
+# legacy builder is far too slow at 1M rows - only run it up to this size
+LEGACY_MAX_ROWS = 100_000
+
+
+def make_frame(n_rows):
+    ## synthetic cleaned 2d frame shaped like get_data() output
+    rng = np.random.default_rng(0)
+    fft_bins = [col for col in hc.SQLite_default_columns if col.startswith('fft_bin')]
+
+    frame = pd.DataFrame(rng.random((n_rows, len(fft_bins))) * 100, columns=fft_bins)
+    frame.insert(0, 'id', np.arange(1, n_rows + 1))
+    frame.insert(1, 'apiary_name', np.where(np.arange(n_rows) % 2, 'apiary-a', 'apiary-b'))
+    frame.insert(2, 'timestamp', pd.date_range('2021-10-26', periods=n_rows, freq='min'))
+    frame.insert(3, 'bme680_internal_temperature', rng.normal(34, 2, n_rows))
+    frame.insert(4, 'bme680_external_temperature', rng.normal(18, 5, n_rows))
+    frame['temp_delta'] = frame['bme680_internal_temperature'] - frame['bme680_external_temperature']
+
+    # consolidate blocks like a frame freshly built from a query result
+    return frame.copy()
+
+
+def legacy_build_3d_data(dataframe):
+    ## original loop based implementation - reference output only
+    bins = hp.get_fft_bins(dataframe)
+    fft_amplitudes = dataframe[bins].values
+    internal_temps = dataframe['bme680_internal_temperature'].copy()
+
+    df_3d_1 = pd.concat([dataframe['timestamp'].copy(), dataframe['apiary_name'].copy()],
+                        axis=1, keys=['timestamp', 'apiary_name'])
+    df_3d_2 = df_3d_1.loc[df_3d_1.index.repeat(len(bins))].assign(internal_temp=internal_temps).reset_index(drop=True)
+
+    amp_list = []
+    bin_list = []
+    for i in fft_amplitudes:
+        n = 0
+        for j in i:
+            amp_list.append(j)
+            bin_list.append(bins[n])
+            n += 1
+
+    df_fft_amplitude = pd.DataFrame(amp_list, columns=['fft_amplitude'])
+    df_fft_band = pd.DataFrame(bin_list, columns=['fft_band'])
+
+    data_3d = [df_3d_2['timestamp'],
+               df_3d_2['apiary_name'],
+               df_3d_2['internal_temp'],
+               df_fft_amplitude['fft_amplitude'],
+               df_fft_band['fft_band']]
+
+    return pd.concat(data_3d, axis=1, keys=['timestamp', 'apiary_name', 'internal_temperature',
+                                            'fft_amplitude', 'fft_band'])
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main(row_counts):
+    print(f'{"rows":>10} {"legacy (s)":>12} {"numpy (s)":>12} {"speedup":>10}')
+
+    for n_rows in row_counts:
+        frame = make_frame(n_rows)
+        new_df, new_time = timed(hp.build_3d_data, frame)
+
+        if n_rows > LEGACY_MAX_ROWS:
+            print(f'{n_rows:>10} {"skipped":>12} {new_time:>12.3f} {"-":>10}')
+            continue
+
+        old_df, old_time = timed(legacy_build_3d_data, frame)
+
+        # identical values - fft_band and apiary_name are now categorical, compare as strings
+        pd.testing.assert_frame_equal(new_df.astype({'fft_band': object, 'apiary_name': object}), old_df)
+
+        print(f'{n_rows:>10} {old_time:>12.3f} {new_time:>12.3f} {old_time / new_time:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_ROWS)
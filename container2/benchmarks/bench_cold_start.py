@@ -0,0 +1,102 @@
+# HiveKeepers - container2 - benchmarks/bench_cold_start.py
+#
+# cold start load time, single query + to_sql vs partitioned parallel bulk load
+#
+# stands a SQLite database with a synthetic sync_data table in for the remote
+# MySQL server, then loads it into a fresh local SQLite database both ways:
+#   legacy: one read_sql of every row, clean_data_db, to_sql(replace), indexes
+#   bulk:   hivekeepers_helpers.bulk_load (id range partitions fetched by a
+#           worker pool, single executemany writer), indexes
+# checks both local tables hold the same rows.
+#
+# the remote ids skip every 7th id and jump by 5 partitions half way through -
+# remote ids have gaps, so some partitions come back empty
+#
+# usage: python3 bench_cold_start.py [rows] [workers] [partition_size]
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as db
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dash_app'))
+
+import hivekeepers_config as hc
+import hivekeepers_helpers as hp
+
+
+def make_source(path, n_rows, id_gap):
+    ## synthetic remote rows - 2 apiaries, one reading each 10 minutes, every 7th id missing
+    ## and id_gap ids skipped half way through
+    rng = np.random.default_rng(0)
+    readings = np.arange(1, n_rows + 1)
+    readings = readings[readings % 7 != 3]
+    ids = np.where(readings > n_rows // 2, readings + id_gap, readings)
+
+    frame = pd.DataFrame(rng.random((len(ids), len(hc.SQLite_fft_bins))) * 100, columns=hc.SQLite_fft_bins)
+    frame.insert(0, 'id', ids)
+    frame.insert(1, 'apiary_name', np.where(readings % 2, 'apiary_a', 'apiary_b'))
+    frame.insert(2, 'timestamp', 1635249781 + readings // 2 * 600)
+    frame.insert(3, 'bme680_internal_temperature', rng.normal(34, 2, len(ids)).round(2))
+    frame.insert(4, 'bme680_external_temperature', rng.normal(18, 5, len(ids)).round(2))
+
+    engine = db.create_engine(f'sqlite:///{path}')
+    with engine.begin() as conn:
+        frame[hc.SQLite_default_columns].to_sql('sync_data', conn, index=False)
+        conn.execute(db.text('CREATE UNIQUE INDEX ux_sync_data_id ON sync_data (id)'))
+
+    return engine
+
+
+def load_legacy(source_engine, sqlite_engine):
+    query = f'select {", ".join(hc.SQLite_default_columns)} from sync_data'
+
+    with source_engine.connect() as conn:
+        hivekeepers_data = hp.clean_data_db(pd.read_sql(query, conn))
+
+    with sqlite_engine.begin() as conn:
+        hivekeepers_data.to_sql(hc.SQLite_2d_table_name, conn, if_exists='replace', index=False)
+        hp.create_indexes(conn)
+
+
+def load_bulk(source_engine, sqlite_engine, workers, partition_size):
+    hp.bulk_load(source_engine, sqlite_engine, workers=workers, partition_size=partition_size)
+
+    with sqlite_engine.begin() as conn:
+        hp.create_indexes(conn)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+
+    return time.perf_counter() - start
+
+
+def main(n_rows, workers, partition_size):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source_engine = make_source(os.path.join(tmp_dir, 'source.db'), n_rows, 5 * partition_size)
+        legacy_engine = db.create_engine(f'sqlite:///{os.path.join(tmp_dir, "legacy.db")}')
+        bulk_engine = db.create_engine(f'sqlite:///{os.path.join(tmp_dir, "bulk.db")}')
+
+        legacy_seconds = timed(load_legacy, source_engine, legacy_engine)
+        bulk_seconds = timed(load_bulk, source_engine, bulk_engine, workers, partition_size)
+
+        query = f'SELECT * FROM {hc.SQLite_2d_table_name} ORDER BY id'
+        with legacy_engine.connect() as legacy_conn, bulk_engine.connect() as bulk_conn:
+            pd.testing.assert_frame_equal(pd.read_sql(query, legacy_conn), pd.read_sql(query, bulk_conn))
+
+    print(f'{"rows":>8} {"load":>7} {"time (s)":>9} {"rows/sec":>9}')
+    for name, seconds in [('legacy', legacy_seconds), ('bulk', bulk_seconds)]:
+        print(f'{n_rows:>8} {name:>7} {seconds:>9.2f} {n_rows / seconds:>9.0f}')
+    print(f'bulk load speed up: {legacy_seconds / bulk_seconds:.2f}x (workers={workers}, partition_size={partition_size}), tables match')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else hc.SYNC_WORKERS,
+         int(sys.argv[3]) if len(sys.argv) > 3 else hc.SYNC_CHUNK_SIZE)
@@ -0,0 +1,55 @@
+# HiveKeepers - container2 - benchmarks/bench_downsampling.py
+#
+# payload size and build time for a 2d temperature trace, raw vs downsampled
+#
+# builds a single go.Scatter figure from a synthetic one-sample-per-minute
+# series and reports the figure JSON size and the downsample + serialise time
+# for each hivekeepers_helpers.downsample_2d mode.
+#
+# usage: python3 bench_downsampling.py [points_budget]
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dash_app'))
+
+import hivekeepers_helpers as hp
+
+# 1 week, 1 month, 6 months of one minute samples
+ROW_COUNTS = [7 * 1440, 30 * 1440, 182 * 1440]
+
+
+def make_series(n_rows):
+    rng = np.random.default_rng(0)
+    daily_cycle = 4 * np.sin(np.arange(n_rows) * 2 * np.pi / 1440)
+
+    return pd.DataFrame({'timestamp': pd.date_range('2021-10-26', periods=n_rows, freq='min'),
+                         'bme680_internal_temperature': 34 + daily_cycle + rng.normal(0, 0.3, n_rows)})
+
+
+def build_figure_json(frame, mode, n_out):
+    start = time.perf_counter()
+    trace = hp.downsample_2d(frame, 'timestamp', 'bme680_internal_temperature', n_out=n_out, mode=mode)
+    fig_json = go.Figure(go.Scatter(x=trace['timestamp'], y=trace['bme680_internal_temperature'])).to_json()
+
+    return len(trace.index), len(fig_json), time.perf_counter() - start
+
+
+def main(n_out):
+    print(f'{"rows":>8} {"mode":>7} {"points":>8} {"json (KB)":>10} {"time (s)":>9}')
+
+    for n_rows in ROW_COUNTS:
+        frame = make_series(n_rows)
+
+        for mode in ['none', 'lttb', 'minmax']:
+            points, size, seconds = build_figure_json(frame, mode, n_out)
+            print(f'{n_rows:>8} {mode:>7} {points:>8} {size / 1024:>10.1f} {seconds:>9.3f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,114 @@
+# HiveKeepers - container2 - benchmarks/bench_figure_payload.py
+#
+# figure payload size and serialization time
+#
+# builds fig1 (2d), fig3 (3d scatter) and the fig3 heatmap spectrogram from a
+# synthetic selection with the app's own figure builders, then serializes each
+# the way Dash does (plotly.io.json.to_json_plotly) in three ways:
+#   iso/json     - timestamps as ISO date strings and fft bands as bin name
+#                  strings, stock json encoder (the old payload)
+#   epoch/json   - epoch millisecond timestamps and int8 bin numbers, stock json encoder
+#   epoch/orjson - as epoch/json, orjson encoder (the app default)
+# and reports the median serialization time, the raw size, and the size after
+# gzip and brotli at Flask-Compress' default levels (what goes over the wire
+# with APP_COMPRESS=yes).
+#
+# needs orjson, brotli for the brotli column
+#
+# usage: python3 bench_figure_payload.py [days] [minutes_between_readings] [repeats]
+
+import gzip
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.io.json as pio_json
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dash_app'))
+
+import hivekeepers_config as hc
+
+# Flask-Compress defaults
+GZIP_LEVEL = 6
+BROTLI_LEVEL = 4
+
+
+def make_frame(days, minutes):
+    ## synthetic cleaned readings for one apiary, loaded with the app's column dtypes
+    rng = np.random.default_rng(0)
+    timestamps = pd.date_range('2021-10-01', periods=days * 1440 // minutes, freq=f'{minutes}min')
+    n_rows = len(timestamps)
+
+    frame = pd.DataFrame(rng.random((n_rows, len(hc.SQLite_fft_bins))) * 100, columns=hc.SQLite_fft_bins)
+    frame.insert(0, 'apiary_name', 'apiary_a')
+    frame.insert(1, 'timestamp', timestamps)
+    frame.insert(2, 'bme680_internal_temperature', rng.normal(34, 2, n_rows).round(2))
+    frame.insert(3, 'bme680_external_temperature', rng.normal(18, 5, n_rows).round(2))
+    frame['temp_delta'] = frame['bme680_internal_temperature'] - frame['bme680_external_temperature']
+
+    return frame
+
+
+def build_figures(app, hp, frame):
+    return {'fig1 2d': app.build_fig1(frame).to_dict(),
+            'fig3 scatter': app.build_fig3(hp.build_3d_data(frame)).to_dict(),
+            'fig3 heatmap': app.build_spectrogram_fig3(hp.build_spectrogram_data(frame)).to_dict()}
+
+
+def timed_json(figure, engine, repeats):
+    seconds = []
+
+    for _ in range(repeats):
+        start = time.perf_counter()
+        payload = pio_json.to_json_plotly(figure, engine=engine)
+        seconds.append(time.perf_counter() - start)
+
+    return payload.encode('utf-8'), float(np.median(seconds))
+
+
+def main(days, minutes, repeats):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # point the app config at an empty temporary database before the app is imported
+        hc.SQLite_db_name = os.path.join(tmp_dir, 'hivekeepers.db')
+
+        import hivekeepers_helpers as hp
+        import hivekeepers_app as app
+
+        frame = hp.apply_column_dtypes(make_frame(days, minutes))
+
+        # iso variant - chart timestamps left as datetime64, which plotly writes as date
+        # strings, and fft bands left as categoricals, which plotly writes as bin names
+        get_plot_times, get_band_numbers = hp.get_plot_times, hp.get_band_numbers
+        hp.get_plot_times = hp.get_band_numbers = lambda values: values
+        iso_figures = build_figures(app, hp, frame)
+        hp.get_plot_times, hp.get_band_numbers = get_plot_times, get_band_numbers
+
+        epoch_figures = build_figures(app, hp, frame)
+
+        print(f'{len(frame.index)} rows, {days} days, one reading per {minutes} minutes')
+        print(f'{"figure":>13} {"encoding":>13} {"time (ms)":>10} {"raw (KB)":>9} {"gzip (KB)":>10} {"brotli (KB)":>12}')
+
+        for name in epoch_figures:
+            for encoding, figure, engine in [('iso/json', iso_figures[name], 'json'),
+                                             ('epoch/json', epoch_figures[name], 'json'),
+                                             ('epoch/orjson', epoch_figures[name], 'orjson')]:
+                payload, seconds = timed_json(figure, engine, repeats)
+                gzip_size = len(gzip.compress(payload, GZIP_LEVEL))
+                brotli_size = f'{len(brotli.compress(payload, quality=BROTLI_LEVEL)) / 1024:.0f}' if brotli else '-'
+
+                print(f'{name:>13} {encoding:>13} {seconds * 1000:>10.1f} {len(payload) / 1024:>9.0f} '
+                      f'{gzip_size / 1024:>10.0f} {brotli_size:>12}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 30,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 10,
+         int(sys.argv[3]) if len(sys.argv) > 3 else 3)
@@ -0,0 +1,212 @@
+# HiveKeepers - container2 - benchmarks/bench_startup.py
+#
+# app start time - import, first page load, gunicorn workers with and without preload
+#
+# writes a small and a large synthetic local database (synthetic_data.py), then
+# for each one reports:
+#   import      - median time to import hivekeepers_app in a fresh interpreter
+#   first page  - median time of the first /app/_dash-layout request after import
+#                 (the page layout, with the apiary list, is built per page load)
+# and, with gunicorn installed, starts the app under gunicorn with
+# gunicorn_config.py (APP_PRELOAD=no and yes) and reports:
+#   ready       - from launch until every worker has loaded the app
+#   respawn     - from killing one worker until its replacement has loaded the app
+#   workers PSS - proportional set size of all workers (memory shared with the
+#                 preloaded parent is split between them)
+#
+# logs, pid file and databases go to a temporary directory
+#
+# usage: python3 bench_startup.py [workers] [repeats] [large_db_days]
+
+import os
+import sys
+import time
+import signal
+import shutil
+import tempfile
+import subprocess
+
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+DASH_APP_DIR = os.path.join(BENCHMARKS_DIR, '..', 'dash_app')
+
+IMPORT_SCRIPT = '''
+import time
+start = time.perf_counter()
+import hivekeepers_app
+imported = time.perf_counter()
+hivekeepers_app.server.test_client().get('/app/_dash-layout')
+print(imported - start, time.perf_counter() - imported)
+'''
+
+# gunicorn_config.py with the pid file, logs and port moved out of the container paths,
+# and a hook recording each worker once it has loaded the app
+GUNICORN_CONFIG = '''
+import os
+from gunicorn_config import *
+
+pidfile = os.path.join({tmp_dir!r}, 'gunicorn.pid')
+accesslog = None
+errorlog = os.path.join({tmp_dir!r}, 'gunicorn-error.log')
+bind = '127.0.0.1:{port}'
+
+def post_worker_init(worker):
+    with open(os.path.join({tmp_dir!r}, 'ready'), 'a') as ready_file:
+        ready_file.write(f'{{worker.pid}}\\n')
+'''
+
+
+def get_env(tmp_dir, db_path, **extra):
+    env = dict(os.environ,
+               SQLITE_DB_NAME=db_path,
+               CACHE_DIR=os.path.join(tmp_dir, 'cache'),
+               METRICS_DIR=os.path.join(tmp_dir, 'metrics'),
+               APP_LOG_LEVEL='WARNING',
+               PYTHONPATH=DASH_APP_DIR)
+    env.update(extra)
+
+    return env
+
+
+def time_import(env, repeats):
+    ## returns median (import seconds, first page seconds) of fresh interpreters
+    timings = []
+
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], cwd=DASH_APP_DIR, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        timings.append([float(value) for value in output.split()[-2:]])
+
+    return tuple(np.median(timings, axis=0))
+
+
+def read_ready(ready_path):
+    try:
+        with open(ready_path) as ready_file:
+            return [int(line) for line in ready_file.read().split()]
+    except FileNotFoundError:
+        return []
+
+
+def wait_ready(ready_path, count, timeout=120):
+    ## waits until count workers have loaded the app - returns their pids
+    deadline = time.perf_counter() + timeout
+
+    while time.perf_counter() < deadline:
+        pids = read_ready(ready_path)
+
+        if len(pids) >= count:
+            return pids
+
+        time.sleep(0.01)
+
+    raise TimeoutError(f'{count} gunicorn workers not ready after {timeout}s')
+
+
+def get_pss(pid):
+    ## returns the proportional set size of a process in bytes (linux)
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as smaps:
+            for line in smaps:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) * 1024
+    except FileNotFoundError:
+        pass
+
+    return 0
+
+
+def time_gunicorn(gunicorn, env, tmp_dir, workers, port):
+    ## returns (ready seconds, respawn seconds, total worker PSS bytes)
+    config_path = os.path.join(tmp_dir, 'bench_gunicorn_config.py')
+    ready_path = os.path.join(tmp_dir, 'ready')
+
+    with open(config_path, 'w') as config_file:
+        config_file.write(GUNICORN_CONFIG.format(tmp_dir=tmp_dir, port=port))
+
+    if os.path.exists(ready_path):
+        os.remove(ready_path)
+
+    env = dict(env, APP_WORKERS=str(workers), APP_THREADS='2',
+               PYTHONPATH=os.pathsep.join([tmp_dir, DASH_APP_DIR]))
+
+    start = time.perf_counter()
+    process = subprocess.Popen(gunicorn + ['-c', config_path, 'hivekeepers_app:server'], cwd=DASH_APP_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    try:
+        pids = wait_ready(ready_path, workers)
+        ready_seconds = time.perf_counter() - start
+
+        # let the workers settle before reading memory
+        time.sleep(1)
+        pss_bytes = sum(get_pss(pid) for pid in pids)
+
+        start = time.perf_counter()
+        os.kill(pids[0], signal.SIGKILL)
+        wait_ready(ready_path, workers + 1)
+        respawn_seconds = time.perf_counter() - start
+    finally:
+        process.terminate()
+        process.wait(timeout=60)
+
+    return ready_seconds, respawn_seconds, pss_bytes
+
+
+def get_gunicorn():
+    ## returns the gunicorn command, or None if gunicorn is not installed
+    try:
+        import gunicorn
+        return [sys.executable, '-m', 'gunicorn']
+    except ImportError:
+        pass
+
+    for name in ('gunicorn3', 'gunicorn'):
+        path = shutil.which(name)
+
+        if path:
+            return [path]
+
+    return None
+
+
+def main(workers, repeats, large_days):
+    gunicorn = get_gunicorn()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        databases = {}
+
+        for name, apiaries, days in [('small', 1, 7), ('large', 8, large_days)]:
+            db_path = os.path.join(tmp_dir, f'{name}.db')
+            subprocess.run([sys.executable, os.path.join(BENCHMARKS_DIR, 'synthetic_data.py'),
+                            db_path, str(apiaries), str(days), '5'],
+                           env=get_env(tmp_dir, db_path), capture_output=True, check=True)
+            databases[name] = (db_path, f'{name} ({apiaries} x {days} days, {os.path.getsize(db_path) // 2 ** 20} MB)')
+
+        print(f'{"database":>26} {"import (s)":>11} {"first page (ms)":>16}')
+
+        for db_path, label in databases.values():
+            import_seconds, page_seconds = time_import(get_env(tmp_dir, db_path), repeats)
+            print(f'{label:>26} {import_seconds:>11.2f} {page_seconds * 1000:>16.1f}')
+
+        if gunicorn is None:
+            print('\ngunicorn not installed - skipping worker start times')
+            return
+
+        print(f'\n{workers} gunicorn workers')
+        print(f'{"database":>26} {"preload":>8} {"ready (s)":>10} {"respawn (s)":>12} {"workers PSS (MB)":>17}')
+
+        for db_path, label in databases.values():
+            for preload in ('no', 'yes'):
+                env = get_env(tmp_dir, db_path, APP_PRELOAD=preload)
+                ready_seconds, respawn_seconds, pss_bytes = time_gunicorn(gunicorn, env, tmp_dir, workers,
+                                                                          8900 + len(preload))
+
+                print(f'{label:>26} {preload:>8} {ready_seconds:>10.2f} {respawn_seconds:>12.2f} {pss_bytes / 2 ** 20:>17.0f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 4,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 5,
+         int(sys.argv[3]) if len(sys.argv) > 3 else 365)
@@ -0,0 +1,117 @@
+# HiveKeepers - container2 - benchmarks/bench_storage_backends.py
+#
+# raw data read latency and memory, SQLite vs parquet storage backend
+#
+# builds a temporary database (and its parquet copy) from synthetic readings,
+# then times hivekeepers_helpers.get_data for the same apiary, date ranges and
+# columns with STORAGE_BACKEND set to sqlite and to parquet. Reports the median
+# latency, the peak Python heap allocated by the read (tracemalloc - arrow's own
+# buffers are not included) and the size of the returned frame, and checks
+# both backends return the same rows.
+#
+# needs pyarrow
+#
+# usage: python3 bench_storage_backends.py [days] [minutes_between_readings] [repeats]
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dash_app'))
+
+import hivekeepers_config as hc
+
+
+def make_rows(days, minutes):
+    ## synthetic cleaned readings - 2 apiaries, one reading each per `minutes`
+    rng = np.random.default_rng(0)
+    timestamps = pd.date_range('2021-10-01', periods=days * 1440 // minutes, freq=f'{minutes}min')
+    n_rows = 2 * len(timestamps)
+
+    frame = pd.DataFrame(rng.random((n_rows, len(hc.SQLite_fft_bins))) * 100, columns=hc.SQLite_fft_bins)
+    frame.insert(0, 'id', np.arange(1, n_rows + 1))
+    frame.insert(1, 'apiary_name', np.tile(['apiary_a', 'apiary_b'], len(timestamps)))
+    frame.insert(2, 'timestamp', np.repeat(timestamps, 2))
+    frame.insert(3, 'bme680_internal_temperature', rng.normal(34, 2, n_rows).round(2))
+    frame.insert(4, 'bme680_external_temperature', rng.normal(18, 5, n_rows).round(2))
+    frame['temp_delta'] = frame['bme680_internal_temperature'] - frame['bme680_external_temperature']
+
+    return frame
+
+
+def build_database(hp, rows):
+    engine = hp.get_sqlite_engine()
+
+    with engine.begin() as conn:
+        hp.create_data_table(conn)
+        hp.insert_data(conn, rows)
+        hp.create_indexes(conn)
+        hp.create_derived_tables(conn)
+        hp.update_derived_tables(conn)
+
+    with engine.connect() as conn:
+        hp.rebuild_parquet_data(conn)
+
+
+def timed_read(hp, backend, start_date, end_date, columns, repeats):
+    hc.STORAGE_BACKEND = backend
+    seconds = []
+
+    for _ in range(repeats):
+        start = time.perf_counter()
+        frame = hp.get_data('apiary_a', start_date, end_date, columns=columns)
+        seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    hp.get_data('apiary_a', start_date, end_date, columns=columns)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return frame, float(np.median(seconds)), peak_bytes
+
+
+def main(days, minutes, repeats):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # point the app config at the temporary database before the engine is built
+        hc.SQLite_db_name = os.path.join(tmp_dir, 'hivekeepers.db')
+        hc.PARQUET_DIR = os.path.join(tmp_dir, 'parquet')
+
+        import hivekeepers_helpers as hp
+
+        rows = make_rows(days, minutes)
+        build_database(hp, rows)
+
+        last_day = rows['timestamp'].max().date()
+        ranges = {'1 day': 0, '1 week': 6, '1 month': 29, 'all': days}
+        column_sets = {'2d': hc.SQLite_2d_columns, '2d+fft': hc.SQLite_2d_columns + hc.SQLite_fft_bins}
+
+        print(f'{len(rows.index)} rows, {days} days, one reading per {minutes} minutes per apiary')
+        print(f'{"range":>8} {"columns":>7} {"rows":>7} {"backend":>8} {"time (ms)":>10} {"py peak (MB)":>13} {"frame (MB)":>11}')
+
+        for range_name, range_days in ranges.items():
+            start_date = str(last_day - pd.Timedelta(days=range_days))
+            end_date = str(last_day)
+
+            for columns_name, columns in column_sets.items():
+                frames = {}
+
+                for backend in ['sqlite', 'parquet']:
+                    frame, seconds, peak_bytes = timed_read(hp, backend, start_date, end_date, columns, repeats)
+                    frames[backend] = frame
+                    print(f'{range_name:>8} {columns_name:>7} {len(frame.index):>7} {backend:>8} {seconds * 1000:>10.1f} '
+                          f'{peak_bytes / 2**20:>13.1f} {frame.memory_usage(deep=True).sum() / 2**20:>11.1f}')
+
+                pd.testing.assert_frame_equal(frames['sqlite'], frames['parquet'])
+
+        print('backends return the same rows')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 182,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 5,
+         int(sys.argv[3]) if len(sys.argv) > 3 else 3)
@@ -0,0 +1,268 @@
+# HiveKeepers - container2 - benchmarks/bench_suite.py
+#
+# regression benchmark suite - synthetic data at production scale, results saved as JSON
+#
+# writes N apiaries x M days of synthetic readings (synthetic_data.py) into a
+# temporary SQLite database standing in for the remote MySQL server, then times
+# against a scratch local database (SQLITE_DB_NAME, CACHE_DIR and METRICS_DIR all
+# point into a temporary directory - nothing in the container is touched):
+#   sync       - cold_start (startup_update_db.py) from the stand-in server, and
+#                update (update_db.py) of the last day of readings
+#   helpers    - get_apiary_names, clean_data_db, get_data and build_3d_data for
+#                the last day, the last 30 days and the whole range of one apiary
+#   callbacks  - get_data_options, render_2d_graphs and render_3d_graphs (scatter
+#                and heatmap) through the Flask test client, so Dash's request
+#                handling and JSON serialization are included - with the chart
+#                cache off, and render_2d_graphs once more with it warm
+#
+# every benchmark runs once untimed (the sync benchmarks excepted), then `rounds`
+# times with an untimed setup before each round - its min/max/mean/median/stddev
+# are printed and saved to a JSON results file.
+# --compare reports the median change against an earlier results file and exits
+# with status 1 if any benchmark got slower by more than --threshold.
+#
+# log level from APP_LOG_LEVEL, WARNING if not set
+#
+# usage: python3 bench_suite.py [--apiaries 4] [--days 365] [--minutes 10] [--rounds 5]
+#                               [--output results.json] [--compare previous.json] [--threshold 1.2]
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+import sqlalchemy as db
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'dash_app'))
+
+
+def run(results, group, name, function, rounds, setup=None, warmup=True):
+    ## times function() over rounds - setup() runs before each round, untimed
+    ## warmup: one untimed call first (connection pool, table reflection, etc.)
+    ## adds the timings to results and prints them
+    seconds = []
+
+    if warmup:
+        if setup is not None:
+            setup()
+
+        function()
+
+    for _ in range(rounds):
+        if setup is not None:
+            setup()
+
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+
+    stats = {'min': min(seconds),
+             'max': max(seconds),
+             'mean': float(np.mean(seconds)),
+             'median': float(np.median(seconds)),
+             'stddev': float(np.std(seconds, ddof=1)) if rounds > 1 else 0.0,
+             'rounds': rounds}
+    results.append({'group': group, 'name': name, 'stats': stats})
+
+    print(f'{group:>9} {name:<42} {stats["median"] * 1000:>11.1f} {stats["min"] * 1000:>11.1f} '
+          f'{stats["max"] * 1000:>11.1f} {stats["rounds"]:>6}')
+
+
+def call_callback(client, outputs, inputs):
+    ## posts one Dash callback request through the Flask test client
+    ## outputs: list of 'component_id.property', inputs: list of (component_id, property, value)
+    def get_output(output):
+        component_id, component_property = output.split('.')
+        return {'id': component_id, 'property': component_property}
+
+    if len(outputs) > 1:
+        body = {'output': '..' + '...'.join(outputs) + '..', 'outputs': [get_output(output) for output in outputs]}
+    else:
+        body = {'output': outputs[0], 'outputs': get_output(outputs[0])}
+
+    body.update({'inputs': [{'id': component_id, 'property': component_property, 'value': value}
+                            for component_id, component_property, value in inputs],
+                 'changedPropIds': [f'{inputs[0][0]}.{inputs[0][1]}'],
+                 'state': []})
+
+    response = client.post('/app/_dash-update-component', json=body)
+
+    if response.status_code != 200:
+        raise RuntimeError(f'{outputs} callback returned status {response.status_code}')
+
+    return response
+
+
+def compare(previous_path, results, threshold):
+    ## prints the median of each benchmark against an earlier results file
+    ## returns the number of benchmarks slower than threshold x their previous median
+    with open(previous_path) as previous_file:
+        previous = {(benchmark['group'], benchmark['name']): benchmark['stats']
+                    for benchmark in json.load(previous_file)['benchmarks']}
+
+    regressions = 0
+
+    print(f'\ncompared to {previous_path} (regression over {threshold}x median)')
+    print(f'{"group":>9} {"benchmark":<42} {"before (ms)":>11} {"after (ms)":>11} {"change":>7}')
+
+    for benchmark in results:
+        before = previous.get((benchmark['group'], benchmark['name']))
+
+        if before is None:
+            continue
+
+        ratio = benchmark['stats']['median'] / max(before['median'], 1e-9)
+        regressed = ratio > threshold
+        regressions += regressed
+
+        print(f'{benchmark["group"]:>9} {benchmark["name"]:<42} {before["median"] * 1000:>11.1f} '
+              f'{benchmark["stats"]["median"] * 1000:>11.1f} {ratio:>6.2f}x{"  REGRESSION" if regressed else ""}')
+
+    return regressions
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # scratch local database, chart cache and metrics - set before the app config is imported
+        os.environ['SQLITE_DB_NAME'] = os.path.join(tmp_dir, 'hivekeepers.db')
+        os.environ['CACHE_DIR'] = os.path.join(tmp_dir, 'cache')
+        os.environ['METRICS_DIR'] = os.path.join(tmp_dir, 'metrics')
+        os.environ.setdefault('APP_LOG_LEVEL', 'WARNING')
+
+        import hivekeepers_config as hc
+        import synthetic_data as sd
+        import hivekeepers_helpers as hp
+        import hivekeepers_sync as sync
+
+        readings = sd.make_readings(args.apiaries, args.days, args.minutes)
+        n_rows = len(readings.index)
+
+        # SQLite stands in for the remote MySQL server
+        source_engine = db.create_engine(f'sqlite:///{os.path.join(tmp_dir, "remote.db")}')
+        sd.write_sync_data(source_engine, readings)
+        sync.get_mysql_engine = lambda: source_engine
+
+        print(f'{n_rows} rows: {args.apiaries} apiaries x {args.days} days, one reading per {args.minutes} minutes')
+        print(f'{"group":>9} {"benchmark":<42} {"median (ms)":>11} {"min (ms)":>11} {"max (ms)":>11} {"rounds":>6}')
+
+        results = []
+
+        ## sync - the update scripts are thin wrappers around these
+        sync_rounds = min(args.rounds, 3)
+        run(results, 'sync', 'cold_start (startup_update_db.py)', sync.cold_start, sync_rounds, warmup=False)
+
+        # rewind the local database by a day of readings before each update
+        last_day = readings['timestamp'] > readings['timestamp'].max() - 86400
+        rewind_id = int(readings.loc[~last_day, 'id'].max())
+
+        def rewind():
+            with hp.get_sqlite_engine().begin() as conn:
+                conn.execute(db.text(f'DELETE FROM {hc.SQLite_2d_table_name} WHERE id > :id'), {'id': rewind_id})
+                hp.update_derived_tables(conn)
+                hp.set_high_water_mark(conn, rewind_id)
+
+        run(results, 'sync', f'update (update_db.py), {int(last_day.sum())} rows', sync.update, sync_rounds,
+            setup=rewind, warmup=False)
+
+        ## helpers - one apiary, last day / last 30 days / whole range
+        apiary_name = sd.get_apiary_names(args.apiaries)[0]
+        end_date = (sd.START_TIME + timedelta(days=args.days)).date()
+        windows = {'1 day': 1, '30 days': 30, f'{args.days} days': args.days}
+        columns = hc.SQLite_2d_columns + hc.SQLite_fft_bins
+
+        run(results, 'helpers', 'get_apiary_names', hp.get_apiary_names, args.rounds)
+
+        month_readings = readings[readings['timestamp'] > readings['timestamp'].max() - 30 * 86400]
+        dirty = {}
+        run(results, 'helpers', f'clean_data_db [30 days, {len(month_readings.index)} rows]',
+            lambda: hp.clean_data_db(dirty['frame']), args.rounds,
+            setup=lambda: dirty.update(frame=month_readings.copy()))
+
+        for window, days in windows.items():
+            start_date = str(end_date - timedelta(days=days))
+            data = {}
+
+            def get_data():
+                data['frame'] = hp.get_data(apiary_name, start_date, str(end_date), columns=columns,
+                                            max_points=hc.APP_MAX_POINTS)
+
+            run(results, 'helpers', f'get_data [{window}]', get_data, args.rounds)
+            run(results, 'helpers', f'build_3d_data [{window}, {len(data["frame"].index)} rows]',
+                lambda: hp.build_3d_data(data['frame']), args.rounds)
+
+        ## callbacks - through the Flask test client, chart cache off
+        import hivekeepers_app as app
+
+        client = app.server.test_client()
+        cache_max_mb = hc.CACHE_MAX_MB
+        hc.CACHE_MAX_MB = 0
+
+        run(results, 'callbacks', 'get_data_options',
+            lambda: call_callback(client, ['date-picker-range.min_date_allowed', 'date-picker-range.max_date_allowed',
+                                           'date-picker-range.start_date', 'date-picker-range.end_date',
+                                           'date-picker-range.disabled_days'],
+                                  [('apiary-selector', 'value', apiary_name)]),
+            args.rounds)
+
+        for window, days in windows.items():
+            selection = {'apiary_name': apiary_name,
+                         'start_date': str(end_date - timedelta(days=days)),
+                         'end_date': str(end_date),
+                         'db_version': hp.get_db_version()}
+
+            def render_2d_graphs():
+                call_callback(client, ['graph1.figure', 'graph2.figure'],
+                              [('data-selection', 'data', selection), ('graph1', 'relayoutData', None),
+                               ('graph2', 'relayoutData', None)])
+
+            run(results, 'callbacks', f'render_2d_graphs [{window}]', render_2d_graphs, args.rounds)
+
+            for fft_mode in ('scatter', 'heatmap'):
+                run(results, 'callbacks', f'render_3d_graphs [{window}, {fft_mode}]',
+                    lambda: call_callback(client, ['fft-figures.data'],
+                                          [('data-selection', 'data', selection), ('bin-selector', 'value', 5),
+                                           ('fft-mode', 'value', fft_mode)]),
+                    args.rounds)
+
+            # chart cache warm - the figures of a selection already seen
+            hc.CACHE_MAX_MB = cache_max_mb
+            run(results, 'callbacks', f'render_2d_graphs [{window}, cached]', render_2d_graphs, args.rounds)
+            hc.CACHE_MAX_MB = 0
+
+    output = {'datetime': datetime.now().isoformat(timespec='seconds'),
+              'machine_info': {'python': platform.python_version(),
+                               'platform': platform.platform(),
+                               'processor': platform.processor(),
+                               'cpu_count': os.cpu_count()},
+              'parameters': {'apiaries': args.apiaries, 'days': args.days, 'minutes': args.minutes,
+                             'rows': n_rows, 'rounds': args.rounds},
+              'benchmarks': results}
+
+    output_path = args.output or f'bench_results_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
+    with open(output_path, 'w') as output_file:
+        json.dump(output, output_file, indent=2)
+    print(f'\nresults written to {output_path}')
+
+    if args.compare and compare(args.compare, results, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HiveKeepers regression benchmark suite')
+    parser.add_argument('--apiaries', type=int, default=4, help='synthetic apiaries (default 4)')
+    parser.add_argument('--days', type=int, default=365, help='days of readings per apiary (default 365)')
+    parser.add_argument('--minutes', type=int, default=10, help='minutes between readings (default 10)')
+    parser.add_argument('--rounds', type=int, default=5, help='timed rounds per benchmark, sync at most 3 (default 5)')
+    parser.add_argument('--output', help='results file (default bench_results_<date>_<time>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='median slowdown counted as a regression by --compare (default 1.2)')
+
+    main(parser.parse_args())
@@ -0,0 +1,95 @@
+# HiveKeepers - container2 - benchmarks/check_migration.py
+#
+# warm start update of a local database built by the old update script
+#
+# the old script appended every row above the local row count, so with gaps in
+# the remote ids it stored some ids twice, and built no indexes or derived tables.
+# builds such a database (one id duplicated), stands a SQLite database with a
+# synthetic sync_data table in for the remote MySQL server, then runs
+# hivekeepers_sync.update() on it and checks:
+#   the duplicate id is removed and the unique id index built
+#   the new remote rows are appended
+#   the rollup tables count every local row once
+#   a second update finds nothing to do
+#
+# usage: python3 check_migration.py
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as db
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dash_app'))
+
+import hivekeepers_config as hc
+
+
+def make_remote_rows(n_rows):
+    ## synthetic remote rows - 2 apiaries, one reading each 10 minutes, every 7th id missing
+    rng = np.random.default_rng(0)
+    readings = np.arange(1, n_rows + 1)
+    ids = readings[readings % 7 != 3]
+
+    frame = pd.DataFrame(rng.random((len(ids), len(hc.SQLite_fft_bins))) * 100, columns=hc.SQLite_fft_bins)
+    frame.insert(0, 'id', ids)
+    frame.insert(1, 'apiary_name', np.where(ids % 2, 'apiary_a', 'apiary_b'))
+    frame.insert(2, 'timestamp', 1635249781 + ids // 2 * 600)
+    frame.insert(3, 'bme680_internal_temperature', rng.normal(34, 2, len(ids)).round(2))
+    frame.insert(4, 'bme680_external_temperature', rng.normal(18, 5, len(ids)).round(2))
+
+    return frame[hc.SQLite_default_columns]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # point the app config at the temporary database before the engine is built
+        hc.SQLite_db_name = os.path.join(tmp_dir, 'hivekeepers.db')
+        hc.PARQUET_DIR = os.path.join(tmp_dir, 'parquet')
+        hc.CACHE_DIR = os.path.join(tmp_dir, 'cache')
+        hc.METRICS_DIR = os.path.join(tmp_dir, 'metrics')
+
+        import hivekeepers_helpers as hp
+        import hivekeepers_sync as sync
+
+        remote_rows = make_remote_rows(2000)
+
+        source_engine = db.create_engine(f'sqlite:///{os.path.join(tmp_dir, "source.db")}')
+        with source_engine.begin() as conn:
+            remote_rows.to_sql('sync_data', conn, index=False)
+
+        # stand the source database in for the remote MySQL server
+        sync._mysql_engine = source_engine
+        sync._mysql_engine_pid = os.getpid()
+
+        # old local database - the first 1500 remote rows, one of them stored twice, no indexes
+        local_rows = hp.clean_data_db(remote_rows.iloc[:1500].copy())
+        local_rows = pd.concat([local_rows, local_rows.iloc[[700]]], ignore_index=True)
+        with hp.get_sqlite_engine().begin() as conn:
+            local_rows.to_sql(hc.SQLite_2d_table_name, conn, index=False)
+
+        print(sync.update())
+
+        with hp.get_sqlite_engine().connect() as conn:
+            row_count, id_count = conn.execute(db.text(f'SELECT COUNT(*), COUNT(DISTINCT id) FROM {hc.SQLite_2d_table_name}')).one()
+            index_names = [index['name'] for index in db.inspect(conn).get_indexes(hc.SQLite_2d_table_name)]
+            rollup_counts = [conn.execute(db.text(f'SELECT SUM(row_count) FROM {table_name}')).scalar()
+                             for table_name in hp.ROLLUP_BUCKET_FORMATS]
+
+        assert row_count == id_count == len(remote_rows), f'{row_count} rows, {id_count} ids, {len(remote_rows)} remote rows'
+        assert f'ux_{hc.SQLite_2d_table_name}_id' in index_names, f'no unique id index: {index_names}'
+        assert rollup_counts == [row_count] * len(rollup_counts), f'rollup counts {rollup_counts}, {row_count} rows'
+        print(f'ok  {row_count} rows, one per remote id, unique id index built, rollups match')
+
+        message = sync.update()
+        assert message == 'database is already up to date...', message
+        print(f'ok  {message}')
+
+        sync._mysql_engine = None
+        hp.get_sqlite_engine().dispose()
+
+
+if __name__ == '__main__':
+    main()
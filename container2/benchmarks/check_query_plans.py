@@ -0,0 +1,93 @@
+# HiveKeepers - container2 - benchmarks/check_query_plans.py
+#
+# EXPLAIN QUERY PLAN checks for the dashboard and update queries
+#
+# builds a small local SQLite database with the same schema, indexes and
+# rollup tables as the update scripts, then asserts every query touching
+# hivedata2d is an index SEARCH rather than a full table SCAN.
+#
+# usage: python3 check_query_plans.py
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as db
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dash_app'))
+
+import hivekeepers_helpers as hp
+import hivekeepers_config as hc
+
+
+def make_raw_data(n_rows):
+    ## synthetic sync_data rows - unix timestamps, two apiaries
+    rng = np.random.default_rng(0)
+
+    frame = pd.DataFrame(rng.random((n_rows, len(hc.SQLite_fft_bins))), columns=hc.SQLite_fft_bins)
+    frame.insert(0, 'id', np.arange(1, n_rows + 1))
+    frame.insert(1, 'apiary_name', np.where(np.arange(n_rows) % 2, 'apiary-a', 'apiary-b'))
+    frame.insert(2, 'timestamp', 1635249781 + np.arange(n_rows) * 300)
+    frame.insert(3, 'bme680_internal_temperature', rng.normal(34, 2, n_rows))
+    frame.insert(4, 'bme680_external_temperature', rng.normal(18, 5, n_rows))
+
+    return frame
+
+
+def query_plan(conn, query, params=()):
+    rows = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {query}', params).fetchall()
+    return [row[-1] for row in rows]
+
+
+def check(name, plan, table_name=hc.SQLite_2d_table_name):
+    ## every plan step reading table_name must be an index search
+    steps = [step for step in plan if f' {table_name} ' in f'{step} ']
+    assert steps, f'{name}: {table_name} not in plan {plan}'
+
+    for step in steps:
+        assert step.startswith('SEARCH') and 'INDEX' in step, f'{name}: not an index search: {step}'
+
+    print(f'ok  {name}')
+    for step in plan:
+        print(f'      {step}')
+
+
+def main():
+    db_path = os.path.join(tempfile.mkdtemp(), 'hivekeepers.db')
+    engine = db.create_engine(f'sqlite:///{db_path}')
+
+    with engine.begin() as conn:
+        hp.clean_data_db(make_raw_data(5000)).to_sql(hc.SQLite_2d_table_name, conn, index=False)
+        hp.create_indexes(conn)
+        hp.create_derived_tables(conn)
+        hp.update_derived_tables(conn)
+
+    with engine.connect() as conn:
+        # get_data - compiled select with its bound parameters in position order
+        hivedata = db.Table(hc.SQLite_2d_table_name, db.MetaData(), autoload=True, autoload_with=engine)
+        compiled = hp.get_data_query(hivedata, 'apiary-a', '2021-10-27', '2021-10-28').compile(dialect=engine.dialect)
+        params = [value.strftime(hp.TIMESTAMP_FORMAT) if hasattr(value, 'strftime') else value
+                  for value in (compiled.params[name] for name in compiled.positiontup)]
+        check('get_data', query_plan(conn, str(compiled), tuple(params)))
+
+        check('get_apiary_names', query_plan(conn, hp.APIARY_NAMES_QUERY))
+
+        # the update and rollup queries as the helpers run them
+        check('update_apiary_metadata', query_plan(conn, hp.APIARY_METADATA_QUERY))
+
+        for table_name in hp.ROLLUP_BUCKET_FORMATS:
+            _, insert_query = hp.get_rollup_queries(table_name)
+            check(f'update_rollup_tables [{table_name}]',
+                  query_plan(conn, insert_query, {'since': '2021-10-27 00:00:00.000000'}))
+
+        check('get_data_table_name',
+              query_plan(conn, hp.ROLLUP_COUNT_QUERY, {'apiary_name': 'apiary-a',
+                                                       'range_start': '2021-10-27 00:00:00.000000',
+                                                       'range_end': '2021-10-28 00:00:00.000000'}),
+              table_name=hc.SQLite_hourly_table_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,396 @@
+# HiveKeepers - container2 - benchmarks/load_test.py
+#
+# concurrent user load test - request latency under gunicorn, per worker configuration
+#
+# writes a synthetic local database (synthetic_data.py), then for each worker
+# configuration starts the app under gunicorn with gunicorn_config.py and runs
+# --users simulated users against it for --duration seconds. Each user keeps one
+# keep-alive connection and loops over a mix of requests, with a short think time:
+#   ping      - GET /ping (the container health check)
+#   page      - GET /app/_dash-layout (a page load, with the apiary list)
+#   dates     - the date range selector callback for a random apiary
+#   chart_2d  - render_2d_graphs for a random apiary and date window (1 day to a year)
+#   chart_3d  - render_3d_graphs (scatter) for a random apiary and date window
+# and reports p50/p90/p99/max latency per request type, requests per second,
+# errors, and chart requests answered with a busy/still loading chart (shed).
+#
+# configurations (--configs):
+#   before    - gthread workers, chart builds on the request threads (APP_JOB_WORKERS=0)
+#   gthread   - gthread workers, chart builds on the bounded executor (hivekeepers_executor.py)
+#   gevent    - gevent workers, chart builds on the executor (skipped if gevent is not installed)
+#
+# with --url, runs the same load once against an app that is already running
+# (its own database - apiary names are read from the page layout)
+#
+# with --smoke, runs only gevent workers with chart requests and no think time, so
+# builds run concurrently on the native build threads (hivekeepers_executor.py),
+# and exits with an error if any request failed, no chart was built, or the
+# worker logs hold a traceback
+#
+# usage: python3 load_test.py [--users 32] [--duration 30] [--workers 2] [--threads 8]
+#                             [--apiaries 4] [--days 365] [--configs before,gthread,gevent] [--url URL]
+#        python3 load_test.py --smoke --duration 20 --days 90
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+DASH_APP_DIR = os.path.join(BENCHMARKS_DIR, '..', 'dash_app')
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from bench_startup import get_env, get_gunicorn
+from synthetic_data import START_TIME, get_apiary_names
+
+CONFIGS = {
+    'before': {'APP_WORKER_CLASS': 'gthread', 'APP_JOB_WORKERS': '0'},
+    'gthread': {'APP_WORKER_CLASS': 'gthread'},
+    'gevent': {'APP_WORKER_CLASS': 'gevent'},
+}
+
+# request type -> share of requests
+REQUEST_MIX = {'ping': 0.25, 'page': 0.15, 'dates': 0.2, 'chart_2d': 0.25, 'chart_3d': 0.15}
+
+# --smoke - chart builds only
+SMOKE_REQUEST_MIX = {'chart_2d': 0.5, 'chart_3d': 0.5}
+
+# worker log lines that fail --smoke
+SMOKE_LOG_ERRORS = ('Traceback', 'LoopExit')
+
+# date windows a user picks from, in days
+WINDOWS = (1, 7, 30, 90, 365)
+
+# gunicorn_config.py with the pid file, logs and port moved out of the container paths
+GUNICORN_CONFIG = '''
+import os
+from gunicorn_config import *
+
+pidfile = os.path.join({tmp_dir!r}, 'gunicorn.pid')
+accesslog = None
+errorlog = os.path.join({tmp_dir!r}, 'gunicorn-error.log')
+bind = '127.0.0.1:{port}'
+'''
+
+
+def get_callback_body(outputs, inputs):
+    ## returns a Dash callback request body (as bench_suite.call_callback)
+    def get_output(output):
+        component_id, component_property = output.split('.')
+        return {'id': component_id, 'property': component_property}
+
+    if len(outputs) > 1:
+        body = {'output': '..' + '...'.join(outputs) + '..', 'outputs': [get_output(output) for output in outputs]}
+    else:
+        body = {'output': outputs[0], 'outputs': get_output(outputs[0])}
+
+    body.update({'inputs': [{'id': component_id, 'property': component_property, 'value': value}
+                            for component_id, component_property, value in inputs],
+                 'changedPropIds': [f'{inputs[0][0]}.{inputs[0][1]}'],
+                 'state': []})
+
+    return json.dumps(body)
+
+
+class User:
+    ## one simulated user - a keep-alive connection and a random request mix
+
+    def __init__(self, host, port, apiary_names, first_date, days, seed, think_time, request_mix=REQUEST_MIX):
+        self.host = host
+        self.port = port
+        self.apiary_names = apiary_names
+        self.first_date = first_date
+        self.days = days
+        self.random = random.Random(seed)
+        self.think_time = think_time
+        self.request_mix = request_mix
+        self.connection = None
+
+    def request(self, method, path, body=None):
+        ## returns (status, response body) - reconnects once if the keep-alive connection was closed
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=120)
+
+            try:
+                headers = {'Content-Type': 'application/json'} if body is not None else {}
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, ConnectionError):
+                self.connection.close()
+                self.connection = None
+
+                if attempt:
+                    raise
+
+    def get_selection(self):
+        window = self.random.choice([days for days in WINDOWS if days <= self.days] or [self.days])
+        start_date = self.first_date + timedelta(days=self.random.randint(0, max(self.days - window, 0)))
+
+        return {'apiary_name': self.random.choice(self.apiary_names),
+                'start_date': str(start_date),
+                'end_date': str(start_date + timedelta(days=window)),
+                'db_version': None}
+
+    def run_request(self, kind):
+        ## returns (status, response body) of one request of the given type
+        if kind == 'ping':
+            return self.request('GET', '/ping')
+
+        if kind == 'page':
+            return self.request('GET', '/app/_dash-layout')
+
+        if kind == 'dates':
+            body = get_callback_body(['date-picker-range.min_date_allowed', 'date-picker-range.max_date_allowed',
+                                      'date-picker-range.start_date', 'date-picker-range.end_date',
+                                      'date-picker-range.disabled_days'],
+                                     [('apiary-selector', 'value', self.random.choice(self.apiary_names))])
+        elif kind == 'chart_2d':
+            body = get_callback_body(['graph1.figure', 'graph2.figure'],
+                                     [('data-selection', 'data', self.get_selection()),
+                                      ('graph1', 'relayoutData', None), ('graph2', 'relayoutData', None)])
+        else:
+            body = get_callback_body(['fft-figures.data'],
+                                     [('data-selection', 'data', self.get_selection()),
+                                      ('bin-selector', 'value', self.random.randint(1, 8)),
+                                      ('fft-mode', 'value', 'scatter')])
+
+        return self.request('POST', '/app/_dash-update-component', body)
+
+    def run(self, deadline, results):
+        kinds = list(self.request_mix)
+        weights = list(self.request_mix.values())
+
+        while time.perf_counter() < deadline:
+            kind = self.random.choices(kinds, weights)[0]
+            start = time.perf_counter()
+
+            try:
+                status, data = self.run_request(kind)
+            except Exception:
+                status, data = None, b''
+
+            seconds = time.perf_counter() - start
+            shed = b'Server busy' in data or b'Still loading' in data
+            results.append((kind, seconds, status, shed))
+
+            time.sleep(self.random.uniform(0, self.think_time))
+
+        if self.connection is not None:
+            self.connection.close()
+
+
+def run_load(url, apiary_names, first_date, days, users, duration, think_time, request_mix=REQUEST_MIX):
+    ## runs the simulated users against url - returns the list of (kind, seconds, status, shed)
+    split_url = urlsplit(url)
+    results = []
+    deadline = time.perf_counter() + duration
+
+    threads = [threading.Thread(target=User(split_url.hostname, split_url.port, apiary_names, first_date, days,
+                                            seed, think_time, request_mix).run,
+                                args=(deadline, results))
+               for seed in range(users)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+def print_results(label, results, duration):
+    print(f'\n{label}: {len(results)} requests, {len(results) / duration:.1f} requests/s')
+    print(f'{"request":>9} {"count":>6} {"p50 (ms)":>9} {"p90 (ms)":>9} {"p99 (ms)":>9} {"max (ms)":>9} '
+          f'{"errors":>7} {"shed":>5}')
+
+    for kind in REQUEST_MIX:
+        rows = [row for row in results if row[0] == kind]
+
+        if not rows:
+            continue
+
+        seconds = np.array([row[1] for row in rows]) * 1000
+        p50, p90, p99 = np.percentile(seconds, [50, 90, 99])
+        errors = sum(row[2] != 200 for row in rows)
+        shed = sum(row[3] for row in rows)
+
+        print(f'{kind:>9} {len(rows):>6} {p50:>9.1f} {p90:>9.1f} {p99:>9.1f} {seconds.max():>9.1f} '
+              f'{errors:>7} {shed:>5}')
+
+
+def wait_ready(url, process, timeout=120):
+    ## waits until the app answers /ping
+    split_url = urlsplit(url)
+    deadline = time.perf_counter() + timeout
+
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn exited during startup')
+
+        try:
+            connection = http.client.HTTPConnection(split_url.hostname, split_url.port, timeout=5)
+            connection.request('GET', '/ping')
+            if connection.getresponse().status == 200:
+                connection.close()
+                return
+        except (http.client.HTTPException, ConnectionError, OSError):
+            pass
+
+        time.sleep(0.1)
+
+    raise TimeoutError(f'app not ready after {timeout}s')
+
+
+def get_apiary_names_from_page(url):
+    ## returns the apiary names listed in the page layout of a running app
+    split_url = urlsplit(url)
+    connection = http.client.HTTPConnection(split_url.hostname, split_url.port, timeout=30)
+    connection.request('GET', '/app/_dash-layout')
+    layout = connection.getresponse().read().decode()
+    connection.close()
+
+    names = []
+
+    def find_options(node):
+        if isinstance(node, dict):
+            if node.get('props', {}).get('id') == 'apiary-selector':
+                names.extend(option['value'] if isinstance(option, dict) else option
+                             for option in node['props'].get('options', []))
+            for value in node.values():
+                find_options(value)
+        elif isinstance(node, list):
+            for value in node:
+                find_options(value)
+
+    find_options(json.loads(layout))
+
+    return names
+
+
+def check_smoke(results, log_path):
+    ## returns the --smoke failures - failed requests, no chart built, or errors in the worker log
+    failures = []
+
+    errors = sum(row[2] != 200 for row in results)
+    if errors:
+        failures.append(f'{errors} failed requests')
+
+    if not any(row[2] == 200 and not row[3] for row in results):
+        failures.append('no chart was built')
+
+    with open(log_path, errors='replace') as log_file:
+        log_errors = [line.strip() for line in log_file if any(error in line for error in SMOKE_LOG_ERRORS)]
+    if log_errors:
+        failures.append(f'{len(log_errors)} errors in the worker log, first: {log_errors[0]}')
+
+    return failures
+
+
+def main(args):
+    first_date = START_TIME.date()
+    request_mix = SMOKE_REQUEST_MIX if args.smoke else REQUEST_MIX
+
+    if args.url:
+        apiary_names = get_apiary_names_from_page(args.url)
+        print(f'{args.users} users for {args.duration}s against {args.url} - apiaries: {apiary_names}')
+        print_results(args.url, run_load(args.url, apiary_names, first_date, args.days, args.users,
+                                         args.duration, args.think_time, request_mix), args.duration)
+        return
+
+    gunicorn = get_gunicorn()
+
+    if gunicorn is None:
+        sys.exit('gunicorn not installed')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'hivekeepers.db')
+        subprocess.run([sys.executable, os.path.join(BENCHMARKS_DIR, 'synthetic_data.py'),
+                        db_path, str(args.apiaries), str(args.days), '10'],
+                       env=get_env(tmp_dir, db_path), capture_output=True, check=True)
+
+        apiary_names = get_apiary_names(args.apiaries)
+        config_path = os.path.join(tmp_dir, 'load_test_gunicorn_config.py')
+        port = 8960
+        url = f'http://127.0.0.1:{port}'
+
+        with open(config_path, 'w') as config_file:
+            config_file.write(GUNICORN_CONFIG.format(tmp_dir=tmp_dir, port=port))
+
+        print(f'{args.users} users for {args.duration}s, {args.workers} gunicorn workers x {args.threads} threads, '
+              f'{args.apiaries} apiaries x {args.days} days ({os.path.getsize(db_path) // 2 ** 20} MB)')
+
+        for name in ['gevent'] if args.smoke else args.configs.split(','):
+            if name == 'gevent':
+                try:
+                    import gevent
+                except ImportError:
+                    if args.smoke:
+                        sys.exit('gevent not installed')
+
+                    print('\ngevent not installed - skipping gevent workers')
+                    continue
+
+            # scheduled updates off - there is no remote server, chart cache off - every chart is built
+            env = get_env(tmp_dir, db_path, APP_WORKERS=str(args.workers), APP_THREADS=str(args.threads),
+                          SYNC_INTERVAL='0', CACHE_MAX_MB='0', **CONFIGS[name])
+            env['PYTHONPATH'] = os.pathsep.join([tmp_dir, DASH_APP_DIR])
+
+            # app logs (and the gunicorn error log) of the run - checked by --smoke
+            log_path = os.path.join(tmp_dir, f'{name}.log')
+
+            with open(log_path, 'w') as log_file:
+                process = subprocess.Popen(gunicorn + ['-c', config_path, 'hivekeepers_app:server'], cwd=DASH_APP_DIR,
+                                           env=env, stdout=log_file, stderr=subprocess.STDOUT)
+
+                try:
+                    wait_ready(url, process)
+                    results = run_load(url, apiary_names, first_date, args.days, args.users, args.duration,
+                                       0 if args.smoke else args.think_time, request_mix)
+                finally:
+                    process.terminate()
+                    process.wait(timeout=60)
+
+            print_results(f'{name} ({", ".join(f"{key}={value}" for key, value in CONFIGS[name].items())})',
+                          results, args.duration)
+
+            if args.smoke:
+                with open(log_path, 'a') as log_file, open(os.path.join(tmp_dir, 'gunicorn-error.log')) as error_log:
+                    log_file.write(error_log.read())
+
+                failures = check_smoke(results, log_path)
+                if failures:
+                    sys.exit('smoke run failed: ' + ', '.join(failures))
+
+                print('\nsmoke run ok - concurrent chart builds on gevent workers, no errors')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HiveKeepers concurrent user load test')
+    parser.add_argument('--users', type=int, default=32, help='simulated concurrent users (default 32)')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load per configuration (default 30)')
+    parser.add_argument('--think-time', type=float, default=0.5,
+                        help='maximum random pause between a user\'s requests in seconds (default 0.5)')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers (default 2)')
+    parser.add_argument('--threads', type=int, default=8, help='threads per gthread worker (default 8)')
+    parser.add_argument('--apiaries', type=int, default=4, help='synthetic apiaries (default 4)')
+    parser.add_argument('--days', type=int, default=365, help='days of readings per apiary (default 365)')
+    parser.add_argument('--configs', default='before,gthread,gevent',
+                        help='worker configurations to compare (default before,gthread,gevent)')
+    parser.add_argument('--url', help='load an app that is already running instead, eg. http://localhost:8050')
+    parser.add_argument('--smoke', action='store_true',
+                        help='short gevent run of concurrent chart builds only - exits with an error on any failure')
+
+    main(parser.parse_args())
@@ -0,0 +1,140 @@
+# HiveKeepers - container2 - benchmarks/synthetic_data.py
+#
+# synthetic hive readings at production scale, without the remote MySQL server
+#
+# make_readings() builds remote format rows (the sync_data table: unix
+# timestamps, SQLite_default_columns) for N apiaries x M days at one reading
+# per `minutes`, with:
+#   - a few seconds of jitter on every reading, ~1% of readings missing and
+#     ~1% of remote ids skipped (deleted/failed inserts upstream)
+#   - internal temperature held near brood temperature with a small daily
+#     swing, external temperature following the season and the time of day
+#   - fft bins shaped like colony hum: a fundamental peak (per apiary) and its
+#     first harmonic over a falling noise floor, louder by day than by night
+#
+# write_sync_data() writes them as a sync_data table into a SQLite database
+# that stands in for the remote MySQL server (see bench_suite.py), and
+# write_local_database() writes them, cleaned, as hivedata2d rows with the
+# indexes, rollup, metadata and sync state tables of a synced local database.
+#
+# usage: python3 synthetic_data.py output.db [apiaries] [days] [minutes_between_readings] [local|remote]
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as db
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dash_app'))
+
+import hivekeepers_config as hc
+
+# first reading - local time, as stored by the remote server
+START_TIME = pd.Timestamp('2021-10-01 00:00:00')
+
+
+def get_apiary_names(n_apiaries):
+    return [f'apiary_{number:02d}' for number in range(1, n_apiaries + 1)]
+
+
+def make_readings(n_apiaries=2, days=30, minutes=10, seed=0):
+    ## returns a dataframe of remote format rows (hc.SQLite_default_columns, unix timestamps)
+    ## for n_apiaries x days at one reading per `minutes`, in id (= time) order
+    rng = np.random.default_rng(seed)
+
+    n_readings = days * 1440 // minutes
+    seconds = np.arange(n_readings, dtype=np.int64) * minutes * 60
+
+    # every apiary reports on the same schedule, a few seconds apart - interleaved in time order
+    timestamps = (np.repeat(seconds, n_apiaries) + rng.integers(0, 30, n_readings * n_apiaries)
+                  + int(START_TIME.timestamp()))
+    apiary_index = np.tile(np.arange(n_apiaries), n_readings)
+
+    # drop ~1% of readings - sensor or network outages
+    kept = rng.random(len(timestamps)) > 0.01
+    timestamps = timestamps[kept]
+    apiary_index = apiary_index[kept]
+    n_rows = len(timestamps)
+
+    # hour of day and day of year for the daily and seasonal cycles
+    local_times = pd.to_datetime(timestamps, unit='s')
+    hours = (local_times.hour + local_times.minute / 60).to_numpy()
+    days_of_year = local_times.dayofyear.to_numpy()
+    daily_cycle = np.sin(2 * np.pi * (hours - 9) / 24)
+
+    # southern hemisphere seasons - warmest mid january
+    external = (15 + 6 * np.cos(2 * np.pi * (days_of_year - 15) / 365) + 5 * daily_cycle
+                + rng.normal(0, 1, n_rows))
+    internal = 34.5 + 0.5 * daily_cycle + rng.normal(0, 0.2, n_rows)
+
+    # colony hum - fundamental bin per apiary, first harmonic, 1/f noise floor, busier by day
+    bins = np.arange(1, len(hc.SQLite_fft_bins) + 1, dtype=np.float64)
+    peak_bins = (12 + 2 * rng.random(n_apiaries))[apiary_index][:, None]
+    spectrum = (80 * np.exp(-((bins - peak_bins) / 2.5) ** 2)
+                + 30 * np.exp(-((bins - 2 * peak_bins) / 4) ** 2)
+                + 20 / bins)
+    activity = (1.2 + 0.6 * daily_cycle)[:, None]
+    fft_values = spectrum * activity * rng.lognormal(0, 0.25, (n_rows, len(bins)))
+
+    # remote ids - in time order, ~1% skipped
+    ids = np.cumsum(1 + (rng.random(n_rows) < 0.01))
+
+    frame = pd.DataFrame(fft_values.round(2), columns=hc.SQLite_fft_bins)
+    frame.insert(0, 'id', ids)
+    frame.insert(1, 'apiary_name', np.array(get_apiary_names(n_apiaries))[apiary_index])
+    frame.insert(2, 'timestamp', timestamps)
+    frame.insert(3, 'bme680_internal_temperature', internal.round(2))
+    frame.insert(4, 'bme680_external_temperature', external.round(2))
+
+    return frame[hc.SQLite_default_columns]
+
+
+def write_sync_data(engine, readings):
+    ## takes a SQLite engine standing in for the remote MySQL server and make_readings() rows
+    ## (re)creates its sync_data table with them - id is the primary key, as on the remote server
+    with engine.begin() as conn:
+        conn.execute(db.text('DROP TABLE IF EXISTS sync_data'))
+        conn.execute(db.text(f'CREATE TABLE sync_data (id INTEGER PRIMARY KEY, apiary_name TEXT, timestamp INTEGER, '
+                             f'{", ".join(f"{column} REAL" for column in hc.SQLite_default_columns[3:])})'))
+        readings.to_sql('sync_data', conn, if_exists='append', index=False, chunksize=10000)
+
+
+def write_local_database(hp, readings):
+    ## takes the helpers module (imported with hc.SQLite_db_name pointing at the target
+    ## database) and make_readings() rows - writes them as a synced local database:
+    ## cleaned hivedata2d rows, indexes, rollup, metadata and sync state tables
+    with hp.get_sqlite_engine().begin() as conn:
+        hp.create_data_table(conn)
+        hp.insert_data(conn, hp.clean_data_db(readings.copy()))
+        hp.create_indexes(conn)
+        hp.create_derived_tables(conn)
+        hp.update_derived_tables(conn)
+        hp.set_high_water_mark(conn)
+
+
+def main(path, n_apiaries, days, minutes, kind):
+    readings = make_readings(n_apiaries, days, minutes)
+
+    if kind == 'remote':
+        write_sync_data(db.create_engine(f'sqlite:///{path}'), readings)
+    else:
+        # point the app config at the output database before the engine is built
+        hc.SQLite_db_name = path
+
+        import hivekeepers_helpers as hp
+        write_local_database(hp, readings)
+
+    print(f'{len(readings.index)} {kind} rows ({n_apiaries} apiaries x {days} days, '
+          f'one reading per {minutes} minutes) written to {path}')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit('usage: python3 synthetic_data.py output.db [apiaries] [days] [minutes_between_readings] [local|remote]')
+
+    main(sys.argv[1],
+         int(sys.argv[2]) if len(sys.argv) > 2 else 2,
+         int(sys.argv[3]) if len(sys.argv) > 3 else 30,
+         int(sys.argv[4]) if len(sys.argv) > 4 else 10,
+         sys.argv[5] if len(sys.argv) > 5 else 'local')
@@ -36,13 +36,52 @@ bind = '0.0.0.0:' + environ.get('APP_PORT', '8050')
 #
 #   threads
 #
-#       The number of worker threads for handling requests.
+#       The number of worker threads for handling requests (gthread workers).
+#
+#       Chart builds are capped at APP_JOB_WORKERS per worker, so most request
+#       threads are waiting or serving light requests - several are cheap.
+#
+#   worker_class - The type of workers to use - set from APP_WORKER_CLASS.
+#
+#       gthread (default): each worker serves up to `threads` requests at once.
+#       gevent: each worker serves up to `worker_connections` requests on one
+#           event loop - slow chart builds run on native threads (see
+#           hivekeepers_executor.py), so they don't stall it. Needs gevent.
+#       sync: each worker serves one request at a time.
+#
+#   worker_connections - The maximum number of simultaneous clients (gevent workers).
+#
+#   timeout - Workers silent for more than this many seconds are killed and restarted.
+#
+#       Kept above APP_JOB_TIMEOUT, so a request waiting on a slow chart build
+#       gets its busy/still loading chart rather than a killed worker.
 
-threads_default = max_workers() - 1
+threads_default = 8
 worker_tmp_dir = '/dev/shm'
 workers = environ.get('APP_WORKERS', max_workers())
 threads = environ.get('APP_THREADS', threads_default)
 
+worker_class = environ.get('APP_WORKER_CLASS', 'gthread').lower()
+
+if worker_class not in ('gthread', 'gevent', 'sync'):
+    worker_class = 'gthread'
+
+worker_connections = int(environ.get('APP_WORKER_CONNECTIONS', 100))
+timeout = max(30, int(float(environ.get('APP_JOB_TIMEOUT', 20))) + 10)
+
+#
+#   preload_app - Load application code before the worker processes are forked.
+#
+#       The master imports the app once (pandas, plotly, dash, ...) and every
+#       worker forks from it, sharing its memory copy-on-write - workers start,
+#       and restart, without importing anything. Code changes need a full
+#       restart (not a HUP) to be picked up.
+#
+#       True or False - set from APP_PRELOAD (yes/no, default no)
+#
+
+preload_app = environ.get('APP_PRELOAD', 'no').lower() == 'yes'
+
 #
 #   spew - Install a trace function that spews every line of Python
 #       that is executed when running the server. This is the
@@ -122,6 +161,12 @@ proc_name = 'hivekeeper_app'
 def post_fork(server, worker):
     server.log.info("Worker spawned (pid: %s)", worker.pid)
 
+    # preloaded app - threads started in the master don't survive the fork,
+    # so each worker starts its own scheduled database update thread
+    if preload_app:
+        import hivekeepers_sync
+        hivekeepers_sync.start_scheduler()
+
 def pre_fork(server, worker):
     pass
 
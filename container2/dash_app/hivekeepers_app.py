@@ -9,22 +9,25 @@
 ## =======================
 
 import os
-import subprocess
 from datetime import date,timedelta
-from pathlib import Path
 
 # pandas vers==1.4.0
+import numpy as np
 import pandas as pd
 
+import plotly.colors
 import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import plotly.express as px
 
+import flask
 import dash
 from dash import Dash, dcc, html, Input, Output
 
 import hivekeepers_helpers as hp
 import hivekeepers_config as hc
+import hivekeepers_cache as cache
+import hivekeepers_sync as sync
+import hivekeepers_metrics as metrics
+import hivekeepers_executor as executor
 
 import logging
 
@@ -71,26 +74,46 @@ else:
 ## MAIN APP SETTINGS
 ## =================
 
-# Build apiary names list
-# logger.info('building apiary names list for drop down menu')
-apiary_list = hp.get_apiary_names()
+# apiary names list for the drop down menu is read on each page load - see serve_layout()
 
 ## colours for charts - see fft callback section for full list of colour choices
 logger.info('getting colour scale list for 3d chart colour drop down menu')
-colorscales = px.colors.named_colorscales()
+colorscales = plotly.colors.named_colorscales()
+
+## colour scale definitions for the clientside colour scale callback - plotly.js only knows
+## a few scales by name, so the browser gets each one as [position, colour] pairs
+colorscale_definitions = {name: go.scatter3d.Marker(colorscale=name).colorscale for name in colorscales}
 
 ## ====================================
 ## Dash Section server & layout section
 ## ====================================
 
 ## Create dash app and set url basen pathame
+## compress: gzip/brotli responses (Flask-Compress), see hc.APP_COMPRESS
 logger.info('init Dash object with url base pathname set: .../app/')
-app = Dash(__name__, url_base_pathname='/app/')
+app = Dash(__name__, url_base_pathname='/app/', compress=hc.APP_COMPRESS)
 
 # server var for gunicorn
 logger.info('init app server...')
 server = app.server
 
+# scheduled database updates - runs in one worker only, see hivekeepers_sync
+#   with APP_PRELOAD this module is imported by the gunicorn master, where threads
+#   would not survive the fork - gunicorn_config.post_fork starts it in each worker instead
+if not hc.APP_PRELOAD:
+    sync.start_scheduler()
+
+# time callback requests - the time outside the (timed) callback is Dash serializing its result
+@server.before_request
+def start_callback_timer():
+    if flask.request.path.endswith('/_dash-update-component'):
+        metrics.start_request()
+
+@server.after_request
+def stop_callback_timer(response):
+    metrics.finish_request()
+    return response
+
 # initialise figures
 logger.info('init empty figure objects')
 fig1 = go.Figure()
@@ -98,262 +121,233 @@ fig2 = go.Figure()
 fig3 = go.Figure()
 fig4 = go.Figure()
 
-app.layout = html.Div(
-                children=[
-                    # web header, title bar
-                    html.Div(
-                        children='HiveKeepers Dash App',
-                        style = {'font-size': '48px',
-                                'color': '#413F38',
-                                'backgroundColor': '#F0D466',
-                                'font-family': 'Bahnschrift'},),
-
-                    # database update button
-                    html.Div([
-                        html.Button('Update Database',
-                                    id='update-button',
-                                    n_clicks=0,
-                                    style={'font-size': '18px', 'width': '287px', 'height':'35px'}),
-                        html.Div(id='output-container-button')]),
-
-                    # date range picker
-                    html.Div([
-                        dcc.DatePickerRange(
-                            id='date-picker-range',
-                            start_date_placeholder_text="Start Date",
-                            end_date_placeholder_text="End Date",
-                            updatemode='bothdates',
-                            minimum_nights=0),
-                        html.Div(id='output-date-picker-range')
-                    ]),
-
-                    # drop down apiary selector for all graphs
-                    html.Div([
-                        dcc.Dropdown(
-                            id='apiary-selector',
-                            options=[{'label': f"{i}", 'value': i} for i in apiary_list],
-                            placeholder="Select an apiary",
-                            clearable=False,
-                            style = {'font-size': '18px', 'width': '287px'})]),
-
-                    # graph 1 div
-                    html.Div([dcc.Graph(id='graph1', figure=fig1)]),
-
-                    # graph 2 div
-                    html.Div([dcc.Graph(id='graph2', figure=fig2)]),
-
-                    # drop downs selectors for fft graphs 3 and 4
-                    html.Div([
-                        # bin selector
-                        dcc.Dropdown(
-                            id='bin-selector',
-                            options=[{'label':'fft bins: 0-16', 'value':1},
-                                    {'label':'fft bins: 16-32', 'value':2},
-                                    {'label':'fft bins: 32-48', 'value':3},
-                                    {'label':'fft bins: 48-64', 'value':4},
-                                    {'label':'fft bins: all',   'value':5}],
-                            value=5,
-                            placeholder="Select FFT bin group",
-                            clearable=False,
-                            style = {'font-size': '18px', 'width': '287px'}),
-                        # colour selector
-                        dcc.Dropdown(
-                            id='colorscale', 
-                            options=[{"value": x, "label": x} for x in colorscales],
-                            value='viridis',
-                            placeholder="Select FFT colour scale",
-                            clearable=False,
-                            style = {'font-size': '18px', 'width': '287px'},)
-                    ]),
-
-                    # graph 3 div
-                    html.Div([dcc.Graph(id='graph3', figure=fig3)]),
-
-                    # graph 4 div
-                    html.Div([dcc.Graph(id='graph4', figure=fig4)])])
-
-## ================
-## Callback Section
-## ================
-
-## date range selector
-@app.callback(
-    Output(component_id='date-picker-range', component_property='min_date_allowed'),
-    Output(component_id='date-picker-range', component_property='max_date_allowed'),
-    Output(component_id='date-picker-range', component_property='start_date'),
-    Output(component_id='date-picker-range', component_property='end_date'),
-    Input('apiary-selector', 'value'))
-def get_data_options(apiary_name):
-    logger.info('running date range selector callback')
-    logger.debug(f'apiary_name: {apiary_name}')
-
-    if apiary_name is None:
-        logger.warn('no data sent to date range selector callback...')
-        raise dash.exceptions.PreventUpdate
-
-    # grab timestamps for selected apiary
-    try:
-        apiary_timestamps = hp.get_apiary_timestamps_name(apiary_name)
-    except Exception as e:
-        logger.info(f'get timestamps from sql-lite db error: {e}')
-
-    # convert timestamps to datetime objects
-    apiary_timestamps['timestamp'] = pd.to_datetime(apiary_timestamps['timestamp'])
-
-    # build apiary data date range (days)
-    apiary_days_range = [date for numd,date in zip([x for x in range(len(apiary_timestamps['timestamp'].unique()))], apiary_timestamps['timestamp'].dt.date.unique())]
-    logger.debug(f'apiary_days_range: {apiary_days_range}')
-    
-    if len(apiary_days_range) < 1:          # zero days found
-        logger.info('apiary_days_range is zero...')
-        return None, None, None, None
-
-    if len(apiary_days_range) > 1:          # data > 1 day
-        max_date =  apiary_days_range[-1] + timedelta(days=1)
-        start_date = apiary_days_range[-1]
-
-    if len(apiary_days_range) == 1:         # data <= 1 day
-        max_date =  apiary_days_range[0] + timedelta(days=1)
-        start_date = apiary_days_range[0]
-
-    min_date = apiary_days_range[0]
-    end_date =  max_date
-
-    logger.debug(f'min_date: {min_date}')
-    logger.debug(f'max_date: {max_date}')
-    logger.debug(f'start_date: {start_date}')
-    logger.debug(f'end_date: {end_date}')
-
-    return min_date, max_date, start_date, end_date
-
-## date range selector text output
-@app.callback(
-    Output('output-date-picker-range', 'children'),
-    Input('date-picker-range', 'start_date'),
-    Input('date-picker-range', 'end_date'))
-def update_output(start_date, end_date):
-    logger.info('running date range selector text output callback')
-    logger.debug(f'start_date: {start_date}')
-    logger.debug(f'end_date: {end_date}')
-
-    string_prefix = 'You have selected: '
-
-    if start_date is not None:
-        start_date_object = date.fromisoformat(start_date)
-        start_date_string = start_date_object.strftime('%B %d, %Y')
-        string_prefix = string_prefix + 'Start Date: ' + start_date_string + ' | '
-
-    if end_date is not None:
-        end_date_object = date.fromisoformat(end_date)
-        end_date_string = end_date_object.strftime('%B %d, %Y')
-        string_prefix = string_prefix + 'End Date: ' + end_date_string
-
-    if len(string_prefix) == len('You have selected: '):
-        return 'Please select a date range for graphs...'
-    else:
-        return string_prefix
-
-## all graphs, using: date range selector,
-##                    apiaryID selector,
-##                    & bin selector,
-@app.callback(
-    [Output('graph1', 'figure'),
-     Output('graph2', 'figure'),
-     Output('graph3', 'figure'),
-     Output('graph4', 'figure')],
-    [Input('apiary-selector', 'value'),
-     Input('date-picker-range', 'start_date'),
-     Input('date-picker-range', 'end_date'),
-     Input("bin-selector", "value"),
-     Input("colorscale", "value")])
-def render_graphs(apiary_name, start_date, end_date, bin_group, scale):
-    logger.info('running graph rendering callback')
-    logger.debug(f'apiary_name: {apiary_name}')
-    logger.debug(f'start_date: {start_date}')
-    logger.debug(f'end_date: {end_date}')
-    logger.debug(f'bin_group: {bin_group}')
-    logger.debug(f'scale: {scale}')
-
-    # PreventUpdate prevents ALL outputs updating
-    if apiary_name is None or start_date is None or end_date is None or bin_group is None:
-        logger.warn('no data sent to graph rendering callback...')
-        raise dash.exceptions.PreventUpdate
-
-    # convert date objects to formatted date strings
-    start_date_string = date.fromisoformat(start_date).strftime('%Y-%m-%d')
-    end_date_string = date.fromisoformat(end_date).strftime('%Y-%m-%d')
-    logger.debug(f'start_date_string: {start_date_string}, end_date_string: {end_date_string}')
-
-    # get data from sql-lite db 
-    try:
-        filtered_hivekeepers_data = hp.get_data(apiary_name, start_date_string, end_date_string)
-    except Exception as e:
-        logger.info(f'get data from sql-lite db error: {e}')
-    
-    logger.debug(f'filtered_hivekeepers_data: {filtered_hivekeepers_data}')
-    
-    # if dataframe is empty, update fig titles and return empty graphs
-    if filtered_hivekeepers_data.empty:
-        logger.info('No data found for graphs')
-
-        # empty fig 1
-        fig1 = go.Figure(data=[go.Scatter(x=[], y=[])])
-        fig1.update_layout(title_text='No data available')
-
-        # empty fig 2
-        fig2 = go.Figure(data=[go.Scatter(x=[], y=[])])
-        fig2.update_layout(title_text='No data available')
-
-        # empty fig 3
-        fig3 = go.Figure(data=[go.Scatter(x=[], y=[])])
-        fig3.update_layout(title='No data available')
-        
-        # empty fig 4
-        fig4 = go.Figure(data=[go.Scatter(x=[], y=[])])
-        fig4.update_layout(title='No data available')
-
-        return fig1, fig2, fig3, fig4
-
+## page layout - takes the apiary names for the drop down menu
+def build_layout(apiary_list):
+    return html.Div(
+                    children=[
+                        # web header, title bar
+                        html.Div(
+                            children='HiveKeepers Dash App',
+                            style = {'font-size': '48px',
+                                    'color': '#413F38',
+                                    'backgroundColor': '#F0D466',
+                                    'font-family': 'Bahnschrift'},),
+
+                        # database update button
+                        html.Div([
+                            html.Button('Update Database',
+                                        id='update-button',
+                                        n_clicks=0,
+                                        style={'font-size': '18px', 'width': '287px', 'height':'35px'}),
+                            html.Div(id='output-container-button'),
+                            # background update progress, polled while an update runs
+                            html.Div(id='sync-progress'),
+                            dcc.Interval(id='sync-interval', interval=2000, disabled=True)]),
+
+                        # date range picker
+                        html.Div([
+                            dcc.DatePickerRange(
+                                id='date-picker-range',
+                                start_date_placeholder_text="Start Date",
+                                end_date_placeholder_text="End Date",
+                                updatemode='bothdates',
+                                minimum_nights=0),
+                            html.Div(id='output-date-picker-range')
+                        ]),
+
+                        # drop down apiary selector for all graphs
+                        html.Div([
+                            dcc.Dropdown(
+                                id='apiary-selector',
+                                options=[{'label': f"{i}", 'value': i} for i in apiary_list],
+                                placeholder="Select an apiary",
+                                clearable=False,
+                                style = {'font-size': '18px', 'width': '287px'})]),
+
+                        # current data selection - shared by the 2d and 3d graph callbacks
+                        dcc.Store(id='data-selection'),
+
+                        # graph 1 div
+                        html.Div([dcc.Graph(id='graph1', figure=fig1)]),
+
+                        # graph 2 div
+                        html.Div([dcc.Graph(id='graph2', figure=fig2)]),
+
+                        # drop downs selectors for fft graphs 3 and 4
+                        html.Div([
+                            # bin selector
+                            dcc.Dropdown(
+                                id='bin-selector',
+                                options=[{'label':'fft bins: 0-16', 'value':1},
+                                        {'label':'fft bins: 16-32', 'value':2},
+                                        {'label':'fft bins: 32-48', 'value':3},
+                                        {'label':'fft bins: 48-64', 'value':4},
+                                        {'label':'fft bins: all',   'value':5}],
+                                value=5,
+                                placeholder="Select FFT bin group",
+                                clearable=False,
+                                style = {'font-size': '18px', 'width': '287px'}),
+                            # colour selector
+                            dcc.Dropdown(
+                                id='colorscale', 
+                                options=[{"value": x, "label": x} for x in colorscales],
+                                value='viridis',
+                                placeholder="Select FFT colour scale",
+                                clearable=False,
+                                style = {'font-size': '18px', 'width': '287px'},),
+                            # chart type selector - scatter markers, or a time bucketed spectrogram
+                            dcc.Dropdown(
+                                id='fft-mode',
+                                options=[{'label':'fft chart: scatter', 'value':'scatter'},
+                                        {'label':'fft chart: heatmap', 'value':'heatmap'},
+                                        {'label':'fft chart: surface', 'value':'surface'}],
+                                value='scatter',
+                                placeholder="Select FFT chart type",
+                                clearable=False,
+                                style = {'font-size': '18px', 'width': '287px'})
+                        ]),
+
+                        # 3d figures as built by the server, before the clientside colour scale is applied
+                        dcc.Store(id='fft-figures'),
+                        dcc.Store(id='colorscale-definitions', data=colorscale_definitions),
+
+                        # graph 3 div
+                        html.Div([dcc.Graph(id='graph3', figure=fig3)]),
+
+                        # graph 4 div
+                        html.Div([dcc.Graph(id='graph4', figure=fig4)])])
+
+
+## served page layout - a function, so Dash builds it on each page load: the apiary list is read
+## (from the cached apiary metadata) when the page is opened, not when a worker starts
+def serve_layout():
+    logger.info('building page layout')
+    return build_layout(hp.get_apiary_names())
+
+# callback validation layout - the same components without apiary names. set first, or
+# assigning a layout function calls it once to build one, reading the database at import
+app.validation_layout = build_layout([])
+app.layout = serve_layout
+
+## =====================
+## 2D Figure Builders
+## =====================
+
+def get_2d_trace_type(*traces):
+    ## takes the downsampled trace dataframes of a 2d chart
+    ## returns go.Scattergl when any holds more than hc.APP_WEBGL_THRESHOLD points, else go.Scatter
+    ## - svg slows down badly in the browser past a few thousand points per trace
+    if max(len(trace.index) for trace in traces) > hc.APP_WEBGL_THRESHOLD:
+        return go.Scattergl
+
+    return go.Scatter
+
+
+def get_2d_trace_style(scatter, trace, x_range=None):
+    ## takes the 2d chart trace type, a downsampled trace dataframe and the optional zoomed window
+    ## returns extra trace arguments - scattergl traces also draw their points as markers,
+    ## sized down as more points are visible (4px at hc.APP_WEBGL_THRESHOLD, 1px at 16x that)
+    ## so dense windows don't turn into a solid band. svg traces stay plain lines
+    if scatter is not go.Scattergl:
+        return {}
+
+    visible_points = len(trace.index)
+
+    if x_range is not None:
+        timestamps = trace['timestamp']
+        visible_points = int(((timestamps >= pd.Timestamp(x_range[0])) & (timestamps <= pd.Timestamp(x_range[1]))).sum())
+
+    size = 4 * np.sqrt(hc.APP_WEBGL_THRESHOLD / max(visible_points, 1))
+
+    return dict(mode='lines+markers',
+                marker=dict(size=float(np.clip(size, 1, 4))))
+
+
+def build_2d_layout(left_title, right_title):
+    ## returns the 2d chart axes - the chart traces go on y2 (left) and y3 (right),
+    ## leaving the base y axis free for the rangeslider overview (see add_2d_overview)
+    ## - the rangeslider y settings only reach the base y axis
+    return dict(xaxis_title='date',
+                yaxis=dict(visible=False,
+                           fixedrange=True),
+                yaxis2=dict(title=left_title,
+                            side='left'),
+                yaxis3=dict(title=right_title,
+                            overlaying='y2',
+                            side='right'))
+
+
+def add_2d_overview(fig, hivekeepers_data, y_column):
+    ## takes 2d figure, its (not downsampled) dataframe and the y column to overview
+    ## adds a coarse svg trace of the whole selection for the rangeslider - it sits on
+    ## the hidden base y axis, whose range keeps it off the main plot, while the
+    ## rangeslider autoranges to it
+    overview = hp.downsample_2d(hivekeepers_data, 'timestamp', y_column, n_out=hc.APP_OVERVIEW_POINTS)
+
+    fig.add_trace(go.Scatter(x=hp.get_plot_times(overview['timestamp']),
+                             y=hp.get_plot_values(overview[y_column]),
+                             name='overview',
+                             yaxis='y',
+                             hoverinfo='skip',
+                             showlegend=False,
+                             line=dict(color='grey', width=1)))
+
+    # both chart axes now overlay the base y axis
+    fig.update_layout(yaxis=dict(range=[1e9, 1e9 + 1]),
+                      yaxis2=dict(overlaying='y'),
+                      yaxis3=dict(overlaying='y'),
+                      xaxis=dict(rangeslider=dict(yaxis=dict(rangemode='auto'))))
+
+
+def build_fig1(hivekeepers_data, x_range=None, uirevision=None):
     ## ===============================================
     ## fig1 = X-Axis Time,
     ##        Y-Axis1 Internal Temp,
     ##        Y-Axis2 External Temp
     ## 2D line chart
+    ##
+    ## x_range: optional (start, end) zoomed window - shown at full
+    ##          point budget, with a coarse overview either side
     ## ===============================================
 
-    # Create figure with secondary y-axis
-    fig1 = make_subplots(specs=[[{"secondary_y": True}]])
+    # downsample each trace to the point budget
+    internal_temps = hp.downsample_2d(hivekeepers_data, 'timestamp', 'bme680_internal_temperature', x_range)
+    external_temps = hp.downsample_2d(hivekeepers_data, 'timestamp', 'bme680_external_temperature', x_range)
+
+    # webgl traces past the point threshold
+    scatter = get_2d_trace_type(internal_temps, external_temps)
+
+    # Create figure - traces on y2 (left) and y3 (right), see build_2d_layout
+    fig1 = go.Figure()
 
-    logger.debug(f"fig2 trace1 x = {filtered_hivekeepers_data['timestamp']}")
-    logger.debug(f"fig2 trace1 y = {filtered_hivekeepers_data['bme680_internal_temperature']}")
+    logger.debug('fig1 trace1 x = %s', internal_temps['timestamp'])
+    logger.debug('fig1 trace1 y = %s', internal_temps['bme680_internal_temperature'])
 
     # add internal temp trace
     try:
-        fig1.add_trace(go.Scatter(x=filtered_hivekeepers_data['timestamp'],                    #x=list(filtered_hivekeepers_data.timestamp),
-                                  y=filtered_hivekeepers_data['bme680_internal_temperature'],  #y=list(filtered_hivekeepers_data.bme680_internal_temperature),
-                                  name="internal_temperature"),
-                       secondary_y=False)
+        fig1.add_trace(scatter(x=hp.get_plot_times(internal_temps['timestamp']),
+                               y=hp.get_plot_values(internal_temps['bme680_internal_temperature']),
+                               name="internal_temperature",
+                               yaxis='y2',
+                               **get_2d_trace_style(scatter, internal_temps, x_range)))
     except Exception as e:
-        logger.error(f'fig2 1st trace error: {e}')
+        logger.error('fig1 1st trace error: %s', e)
     
-    logger.debug(f"fig2 trace2 x = {filtered_hivekeepers_data['timestamp']}")
-    logger.debug(f"fig2 trace2 y = {filtered_hivekeepers_data['bme680_external_temperature']}")
+    logger.debug('fig1 trace2 x = %s', external_temps['timestamp'])
+    logger.debug('fig1 trace2 y = %s', external_temps['bme680_external_temperature'])
 
     # add external temp trace
     try:
-        fig1.add_trace(go.Scatter(x=filtered_hivekeepers_data['timestamp'],                    #x=list(filtered_hivekeepers_data.timestamp),
-                                  y=filtered_hivekeepers_data['bme680_external_temperature'],  #y=list(filtered_hivekeepers_data.bme680_external_temperature),
-                                  name="external_temperature"),
-                       secondary_y=True)
+        fig1.add_trace(scatter(x=hp.get_plot_times(external_temps['timestamp']),
+                               y=hp.get_plot_values(external_temps['bme680_external_temperature']),
+                               name="external_temperature",
+                               yaxis='y3',
+                               **get_2d_trace_style(scatter, external_temps, x_range)))
     except Exception as e:
-        logger.error(f'fig1 2nd trace error: {e}')
+        logger.error('fig1 2nd trace error: %s', e)
 
-    # add axis titles
-    fig1.update_layout(
-        xaxis_title='date',
-        yaxis_title='temp (C)',
-        yaxis2_title='temp (C)'
-    )
+    # add axes and titles
+    fig1.update_layout(build_2d_layout('temp (C)', 'temp (C)'))
 
     # Set title
     fig1.update_layout(title_text="internal vs external hive temperatures")
@@ -366,50 +360,71 @@ def render_graphs(apiary_name, start_date, end_date, bin_group, scale):
                 visible=True
             ),
             type="date"
-        )
+        ),
+        uirevision=uirevision
     )
 
+    # webgl traces are not drawn in the rangeslider - give it a coarse overview instead
+    if scatter is go.Scattergl:
+        add_2d_overview(fig1, hivekeepers_data, 'bme680_internal_temperature')
+
+    # keep zoomed window
+    if x_range is not None:
+        fig1.update_xaxes(range=list(x_range))
+
+    return fig1
+
+
+def build_fig2(hivekeepers_data, x_range=None, uirevision=None):
     ## ===============================================
     ## fig2 = X-Axis Time,
     ##        Y-Axis1 Internal Temp,
     ##        Y-Axis2 Internal to External Detla Temp
     ## 2D line chart
+    ##
+    ## x_range: optional (start, end) zoomed window - shown at full
+    ##          point budget, with a coarse overview either side
     ## ==============================================
 
-    # Create figure with secondary y-axis
-    fig2 = make_subplots(specs=[[{"secondary_y": True}]])
+    # downsample each trace to the point budget
+    internal_temps = hp.downsample_2d(hivekeepers_data, 'timestamp', 'bme680_internal_temperature', x_range)
+    temp_deltas = hp.downsample_2d(hivekeepers_data, 'timestamp', 'temp_delta', x_range)
+
+    # webgl traces past the point threshold
+    scatter = get_2d_trace_type(internal_temps, temp_deltas)
+
+    # Create figure - traces on y2 (left) and y3 (right), see build_2d_layout
+    fig2 = go.Figure()
 
-    logger.debug(f"fig2 trace1 x = {filtered_hivekeepers_data['timestamp']}")
-    logger.debug(f"fig2 trace1 y = {filtered_hivekeepers_data['bme680_internal_temperature']}")
+    logger.debug('fig2 trace1 x = %s', internal_temps['timestamp'])
+    logger.debug('fig2 trace1 y = %s', internal_temps['bme680_internal_temperature'])
 
     # add internal temp trace
     try:
-        fig2.add_trace(go.Scatter(x=filtered_hivekeepers_data['timestamp'],
-                                  y=filtered_hivekeepers_data['bme680_internal_temperature'],
-                                  name="internal_temperature"),
-                       secondary_y=False)
+        fig2.add_trace(scatter(x=hp.get_plot_times(internal_temps['timestamp']),
+                               y=hp.get_plot_values(internal_temps['bme680_internal_temperature']),
+                               name="internal_temperature",
+                               yaxis='y2',
+                               **get_2d_trace_style(scatter, internal_temps, x_range)))
     except Exception as e:
-        logger.error(f'fig2 trace1 error: {e}')
+        logger.error('fig2 trace1 error: %s', e)
 
-    logger.debug(f"fig2 trace2 x = {filtered_hivekeepers_data['timestamp']}")
-    logger.debug(f"fig2 trace2 y = {filtered_hivekeepers_data['temp_delta']}")
+    logger.debug('fig2 trace2 x = %s', temp_deltas['timestamp'])
+    logger.debug('fig2 trace2 y = %s', temp_deltas['temp_delta'])
 
     # add delta temp trace
     try:
-        fig2.add_trace(go.Scatter(x=filtered_hivekeepers_data['timestamp'],
-                                  y=filtered_hivekeepers_data['temp_delta'],
-                                  name="temp_delta",
-                                  line=dict(color="orange")),
-                       secondary_y=True)
+        fig2.add_trace(scatter(x=hp.get_plot_times(temp_deltas['timestamp']),
+                               y=hp.get_plot_values(temp_deltas['temp_delta']),
+                               name="temp_delta",
+                               line=dict(color="orange"),
+                               yaxis='y3',
+                               **get_2d_trace_style(scatter, temp_deltas, x_range)))
     except Exception as e:
-        logger.error(f'fig2 trace2 error: {e}')
+        logger.error('fig2 trace2 error: %s', e)
     
-    # add axis titles
-    fig2.update_layout(
-        xaxis_title='date',
-        yaxis_title='temp (C)',
-        yaxis2_title='temp delta (C)'
-    )
+    # add axes and titles
+    fig2.update_layout(build_2d_layout('temp (C)', 'temp delta (C)'))
 
     # Set title
     fig2.update_layout(
@@ -424,9 +439,36 @@ def render_graphs(apiary_name, start_date, end_date, bin_group, scale):
                 visible=True
             ),
             type="date"
-        )
+        ),
+        uirevision=uirevision
     )
 
+    # webgl traces are not drawn in the rangeslider - give it a coarse overview instead
+    if scatter is go.Scattergl:
+        add_2d_overview(fig2, hivekeepers_data, 'bme680_internal_temperature')
+
+    # keep zoomed window
+    if x_range is not None:
+        fig2.update_xaxes(range=list(x_range))
+
+    return fig2
+
+## =====================
+## 3D Figure Builders
+## =====================
+
+def build_bin_axis(fft_bins):
+    ## takes list of fft_bin column names
+    ## returns 3d scene axis for the fft bin numbers, labelled with (up to 16 of) the bin names
+    bin_numbers = hp.get_bin_numbers(fft_bins)
+    step = max(1, len(bin_numbers) // 16)
+
+    return dict(title='fft_bands',
+                tickvals=bin_numbers[::step],
+                ticktext=list(fft_bins)[::step])
+
+
+def build_fig3(hivekeepers_data_3d, scale='viridis', uirevision=None):
     ## ===============================================
     ## fig3 = X-Axis Time,
     ##        Y-Axis FFT Bins,
@@ -448,48 +490,34 @@ def render_graphs(apiary_name, start_date, end_date, bin_group, scale):
     # tealrose    temps       tropic      balance     curl        delta       oxy         edge
     # hsv         icefire     phase       twilight    mrybm       mygbm
 
-    # get fft bin names and amplitude values
-    fft_bins = hp.get_fft_bins(filtered_hivekeepers_data)
-    logger.debug(f'fft_bins: {fft_bins}')
-
-    # get bins from drop down selection
-    bins = hp.get_bin_range(bin_group, fft_bins)
-    logger.debug(f'bins: {bins}')
-
-    # get 3d data from sql-lite db
-    try:
-        date_range_df_3d = hp.build_3d_data(filtered_hivekeepers_data)
-    except Exception as e:
-        logger.error(f'build_3d_data error: {e}')
+    logger.debug('fig3 x = %s', hivekeepers_data_3d['timestamp'])
+    logger.debug('fig3 y = %s', hivekeepers_data_3d['fft_band'])
+    logger.debug('fig3 z = %s', hivekeepers_data_3d['fft_amplitude'])
 
-    # grab data for selected bin group
-    filtered_hivekeepers_data_3d = date_range_df_3d.loc[date_range_df_3d['fft_band'].isin(bins)]
-    
-    logger.debug(f"fig3 x = {filtered_hivekeepers_data_3d['timestamp']}")
-    logger.debug(f"fig3 y = {filtered_hivekeepers_data_3d['fft_band']}")
-    logger.debug(f"fig3 z = {filtered_hivekeepers_data_3d['fft_amplitude']}")
+    # amplitude is both the z axis and the marker colour
+    fft_amplitudes = hp.get_plot_values(hivekeepers_data_3d['fft_amplitude'])
     
     # set chart data config
     try:
-        trace_3d = go.Scatter3d(x = filtered_hivekeepers_data_3d['timestamp'],
-                                y = filtered_hivekeepers_data_3d['fft_band'],
-                                z = filtered_hivekeepers_data_3d['fft_amplitude'],
+        trace_3d = go.Scatter3d(x = hp.get_plot_times(hivekeepers_data_3d['timestamp']),
+                                y = hp.get_band_numbers(hivekeepers_data_3d['fft_band']),
+                                z = fft_amplitudes,
                                 mode='markers',
                                 marker=dict(size=12,
-                                    color=filtered_hivekeepers_data_3d['fft_amplitude'],
+                                    color=fft_amplitudes,
                                     colorscale=scale,
                                     opacity=0.8,
                                     showscale=True,
                                     colorbar=dict(title='amplitude'),))
     except Exception as e:
-         logger.error(f'fig3 error: {e}')
+         logger.error('fig3 error: %s', e)
 
     data_3d = [trace_3d]
 
     # set chart axis labels
     layout_3d = go.Layout(
-        scene = dict(xaxis = dict(title='timestamp'),
-                     yaxis = dict(title='fft_bands'),
+        scene = dict(xaxis = dict(title='timestamp', type='date'),
+                     yaxis = build_bin_axis(hivekeepers_data_3d['fft_band'].cat.categories),
                      zaxis = dict(title='amplitude'),),)
 
     # build chart
@@ -498,8 +526,13 @@ def render_graphs(apiary_name, start_date, end_date, bin_group, scale):
     # set chart title and size
     fig3.update_layout(title='3D FFT chart - Scatter Plot (X-Axis Time, Y-Axis FFT Bins, Z-Axis Amplitude, C-Axis Internal Temp)',
                        autosize=True,
-                       height=900)
+                       height=900,
+                       uirevision=uirevision)
+
+    return fig3
+
 
+def build_fig4(hivekeepers_data_3d, scale='viridis', uirevision=None):
     ## ===============================================
     ## fig4 = X-Axis Time,
     ##        Y-Axis FFT Bins,
@@ -508,32 +541,32 @@ def render_graphs(apiary_name, start_date, end_date, bin_group, scale):
     ## 3D FFT chart - Scatter Plot
     ## ===============================================
 
-    logger.debug(f"fig4 x = {filtered_hivekeepers_data_3d['timestamp']}")
-    logger.debug(f"fig4 y = {filtered_hivekeepers_data_3d['fft_band']}")
-    logger.debug(f"fig4 z = {filtered_hivekeepers_data_3d['fft_amplitude']}")
-    logger.debug(f"fig4 c = {filtered_hivekeepers_data_3d['internal_temperature']}")
+    logger.debug('fig4 x = %s', hivekeepers_data_3d['timestamp'])
+    logger.debug('fig4 y = %s', hivekeepers_data_3d['fft_band'])
+    logger.debug('fig4 z = %s', hivekeepers_data_3d['fft_amplitude'])
+    logger.debug('fig4 c = %s', hivekeepers_data_3d['internal_temperature'])
 
     # set chart data config
     try:
-        trace4d = go.Scatter3d(x = filtered_hivekeepers_data_3d['timestamp'],
-                               y = filtered_hivekeepers_data_3d['fft_band'],
-                               z = filtered_hivekeepers_data_3d['fft_amplitude'],
+        trace4d = go.Scatter3d(x = hp.get_plot_times(hivekeepers_data_3d['timestamp']),
+                               y = hp.get_band_numbers(hivekeepers_data_3d['fft_band']),
+                               z = hp.get_plot_values(hivekeepers_data_3d['fft_amplitude']),
                                mode='markers',
                                marker=dict(size=12,
-                                    color=filtered_hivekeepers_data_3d['internal_temperature'],
+                                    color=hp.get_plot_values(hivekeepers_data_3d['internal_temperature']),
                                     colorscale=scale,
                                     opacity=0.8,
                                     showscale=True,
                                     colorbar=dict(title='internal temp (C)'),))
     except Exception as e:
-         logger.error(f'fig4 error: {e}')
+         logger.error('fig4 error: %s', e)
 
     data_4d = [trace4d]
 
     # set chart axis labels
     layout_4d = go.Layout(
-        scene = dict(xaxis = dict(title='timestamp'),
-                     yaxis = dict(title='fft_bands'),
+        scene = dict(xaxis = dict(title='timestamp', type='date'),
+                     yaxis = build_bin_axis(hivekeepers_data_3d['fft_band'].cat.categories),
                      zaxis = dict(title='amplitude'),),)
 
     # build chart
@@ -542,54 +575,555 @@ def render_graphs(apiary_name, start_date, end_date, bin_group, scale):
     # set chart title and size
     fig4.update_layout(title='3D FFT chart - Scatter Plot (X-Axis Time, Y-Axis FFT Bins, Z-Axis Amplitude, C-Axis Internal Temp)',
                        autosize=True,
-                       height=900)
+                       height=900,
+                       uirevision=uirevision)
+
+    return fig4
+
+
+## =====================
+## Spectrogram Figure Builders
+## =====================
+
+def build_spectrogram_fig3(spectrogram_data, mode='heatmap', scale='viridis', uirevision=None):
+    ## ===============================================
+    ## fig3 = X-Axis Time,
+    ##        Y-Axis FFT Bins,
+    ##        C-Axis (and Z-Axis for surface) Amplitude
+    ## FFT spectrogram - Heatmap or Surface
+    ##
+    ## spectrogram_data: wide time x bin dataframe from hp.build_spectrogram_data
+    ## ===============================================
+    bins = hp.get_fft_bins(spectrogram_data)
+
+    # bins down the y axis, time along the x axis
+    amplitudes = hp.get_plot_values(spectrogram_data[bins].to_numpy().T)
+
+    logger.debug('spectrogram fig3 x = %s', spectrogram_data['timestamp'])
+    logger.debug('spectrogram fig3 y = %s', bins)
+
+    if mode == 'surface':
+        # bin numbers up the y axis, labelled with the bin names
+        trace = go.Surface(x=hp.get_plot_times(spectrogram_data['timestamp']),
+                           y=hp.get_bin_numbers(bins),
+                           z=amplitudes,
+                           colorscale=scale,
+                           colorbar=dict(title='amplitude'))
+
+        layout = go.Layout(
+            scene = dict(xaxis = dict(title='timestamp', type='date'),
+                         yaxis = build_bin_axis(bins),
+                         zaxis = dict(title='amplitude'),),)
+
+        title = '3D FFT chart - Surface (X-Axis Time, Y-Axis FFT Bins, Z-Axis Amplitude)'
+    else:
+        trace = go.Heatmap(x=hp.get_plot_times(spectrogram_data['timestamp']),
+                           y=bins,
+                           z=amplitudes,
+                           colorscale=scale,
+                           colorbar=dict(title='amplitude'))
+
+        layout = go.Layout(xaxis = dict(title='timestamp', type='date'),
+                           yaxis = dict(title='fft_bands'))
+
+        title = 'FFT spectrogram - Heatmap (X-Axis Time, Y-Axis FFT Bins, C-Axis Amplitude)'
+
+    fig3 = go.Figure(data=[trace], layout=layout)
+
+    fig3.update_layout(title=title,
+                       autosize=True,
+                       height=900,
+                       uirevision=uirevision)
 
-    return fig1, fig2, fig3, fig4
+    return fig3
+
+
+def build_spectrogram_fig4(spectrogram_data, scale='viridis', uirevision=None):
+    ## ===============================================
+    ## fig4 = X-Axis Time,
+    ##        Y-Axis FFT Bins,
+    ##        Z-Axis Amplitude,
+    ##        C-Axis Internal Temp
+    ## FFT spectrogram - Surface
+    ##
+    ## a flat heatmap has no second colour channel for the temperature,
+    ## so fig4 is a surface in both spectrogram modes
+    ## ===============================================
+    bins = hp.get_fft_bins(spectrogram_data)
+
+    amplitudes = hp.get_plot_values(spectrogram_data[bins].to_numpy().T)
+
+    # one internal temp per time bucket, repeated up every bin
+    temperatures = np.tile(spectrogram_data['internal_temperature'].to_numpy(), (len(bins), 1))
+
+    logger.debug('spectrogram fig4 x = %s', spectrogram_data['timestamp'])
+    logger.debug('spectrogram fig4 c = %s', spectrogram_data['internal_temperature'])
+
+    trace = go.Surface(x=hp.get_plot_times(spectrogram_data['timestamp']),
+                       y=hp.get_bin_numbers(bins),
+                       z=amplitudes,
+                       surfacecolor=hp.get_plot_values(temperatures),
+                       colorscale=scale,
+                       colorbar=dict(title='internal temp (C)'))
+
+    layout = go.Layout(
+        scene = dict(xaxis = dict(title='timestamp', type='date'),
+                     yaxis = build_bin_axis(bins),
+                     zaxis = dict(title='amplitude'),),)
 
-## database update button - returns prints from update_db script
+    fig4 = go.Figure(data=[trace], layout=layout)
+
+    fig4.update_layout(title='3D FFT chart - Surface (X-Axis Time, Y-Axis FFT Bins, Z-Axis Amplitude, C-Axis Internal Temp)',
+                       autosize=True,
+                       height=900,
+                       uirevision=uirevision)
+
+    return fig4
+
+
+def build_empty_figure(title_text='No data available'):
+    # empty chart shown when a selection has no data - or, with a message, when its data could not be built
+    fig = go.Figure(data=[go.Scatter(x=[], y=[])])
+    fig.update_layout(title_text=title_text)
+
+    return fig
+
+
+# chart titles for selections the background executor could not build (see hivekeepers_executor)
+BUSY_TITLE = 'Server busy - please try again shortly'
+TIMEOUT_TITLE = 'Still loading this selection - please try again shortly'
+
+
+def get_chart_data(key_parts, build):
+    # chart data from the data cache - on a miss built by the background executor, which caches
+    # the result itself, so a selection that timed out is answered from the cache when retried
+    data = cache.get(key_parts) if None not in key_parts else None
+
+    if data is None:
+        data = executor.run(cache.get_or_set, key_parts, build)
+
+    return data
+
+## ================
+## Callback Section
+## ================
+
+## date range selector
 @app.callback(
-    dash.dependencies.Output('output-container-button', 'children'),
-    dash.dependencies.Output('apiary-selector', 'options'),
-    [dash.dependencies.Input('update-button', 'n_clicks')])
-def run_script_onClick(n_clicks):
-    logger.info('Running database update button callback')
+    Output(component_id='date-picker-range', component_property='min_date_allowed'),
+    Output(component_id='date-picker-range', component_property='max_date_allowed'),
+    Output(component_id='date-picker-range', component_property='start_date'),
+    Output(component_id='date-picker-range', component_property='end_date'),
+    Output(component_id='date-picker-range', component_property='disabled_days'),
+    Input('apiary-selector', 'value'))
+@metrics.timed('get_data_options')
+def get_data_options(apiary_name):
+    logger.info('running date range selector callback')
+    logger.debug('apiary_name: %s', apiary_name)
 
-    if not n_clicks:
-        logger.info('no data sent to run script onClick callback...')
+    if apiary_name is None:
+        logger.warn('no data sent to date range selector callback...')
         raise dash.exceptions.PreventUpdate
 
-    # without `shell` it needs list ['/full/path/python', 'script.py']
-    # with `shell` it needs string 'python script.py'
+    # grab cached metadata for selected apiary - days with data kept current by the update scripts
+    try:
+        with metrics.stage('sql_fetch'):
+            apiary_metadata = hp.get_apiary_metadata(apiary_name)
+    except Exception as e:
+        logger.info('get apiary metadata from sql-lite db error: %s', e)
+        apiary_metadata = None
+
+    # build apiary data date range (days)
+    apiary_days_range = apiary_metadata['days'] if apiary_metadata else []
+    logger.debug('apiary_days_range: %s', apiary_days_range)
+    
+    if len(apiary_days_range) < 1:          # zero days found
+        logger.info('apiary_days_range is zero...')
+        return None, None, None, None, []
+
+    if len(apiary_days_range) > 1:          # data > 1 day
+        max_date =  apiary_days_range[-1] + timedelta(days=1)
+        start_date = apiary_days_range[-1]
 
-    # check if SQLite db is empty or not
-    db_length = Path(hc.SQLite_db_name).stat().st_size
-    logger.debug(f'database length is: {db_length}')
+    if len(apiary_days_range) == 1:         # data <= 1 day
+        max_date =  apiary_days_range[0] + timedelta(days=1)
+        start_date = apiary_days_range[0]
 
-    if db_length < 1:
-        logger.debug(f'database length is: {db_length}, which is less than 1')
+    min_date = apiary_days_range[0]
+    end_date =  max_date
 
-        try:
-            # if empty, build from scratch
-            result = subprocess.check_output('python3 startup_update_db.py', shell=True)
-        except Exception as e:
-            logger.error(f'database update error: {e}')
+    # disable days without data between the first and last day
+    days_with_data = set(apiary_days_range)
+    disabled_days = [day.date() for day in pd.date_range(min_date, apiary_days_range[-1]) if day.date() not in days_with_data]
+
+    logger.debug('min_date: %s', min_date)
+    logger.debug('max_date: %s', max_date)
+    logger.debug('start_date: %s', start_date)
+    logger.debug('end_date: %s', end_date)
+    logger.debug('disabled_days: %s', disabled_days)
+
+    return min_date, max_date, start_date, end_date, disabled_days
+
+## date range selector text output
+@app.callback(
+    Output('output-date-picker-range', 'children'),
+    Input('date-picker-range', 'start_date'),
+    Input('date-picker-range', 'end_date'))
+def update_output(start_date, end_date):
+    logger.info('running date range selector text output callback')
+    logger.debug('start_date: %s', start_date)
+    logger.debug('end_date: %s', end_date)
+
+    string_prefix = 'You have selected: '
+
+    if start_date is not None:
+        start_date_object = date.fromisoformat(start_date)
+        start_date_string = start_date_object.strftime('%B %d, %Y')
+        string_prefix = string_prefix + 'Start Date: ' + start_date_string + ' | '
+
+    if end_date is not None:
+        end_date_object = date.fromisoformat(end_date)
+        end_date_string = end_date_object.strftime('%B %d, %Y')
+        string_prefix = string_prefix + 'End Date: ' + end_date_string
+
+    if len(string_prefix) == len('You have selected: '):
+        return 'Please select a date range for graphs...'
     else:
+        return string_prefix
+
+## shared data selection, using: date range selector,
+##                               apiaryID selector,
+##                               & database update button
+## - both graph callbacks read it, so the selection and the database version
+##   (part of every cache key) are resolved once per change
+@app.callback(
+    Output('data-selection', 'data'),
+    [Input('apiary-selector', 'value'),
+     Input('date-picker-range', 'start_date'),
+     Input('date-picker-range', 'end_date'),
+     Input('output-container-button', 'children')])
+def select_data(apiary_name, start_date, end_date, update_result):
+    logger.info('running data selection callback')
+    logger.debug('apiary_name: %s', apiary_name)
+    logger.debug('start_date: %s', start_date)
+    logger.debug('end_date: %s', end_date)
+
+    if apiary_name is None or start_date is None or end_date is None:
+        logger.warn('no data sent to data selection callback...')
+        raise dash.exceptions.PreventUpdate
+
+    # convert date objects to formatted date strings
+    start_date_string = date.fromisoformat(start_date).strftime('%Y-%m-%d')
+    end_date_string = date.fromisoformat(end_date).strftime('%Y-%m-%d')
+    logger.debug('start_date_string: %s, end_date_string: %s', start_date_string, end_date_string)
+
+    # database version - part of every cache key, so database updates invalidate cached results
+    try:
+        db_version = hp.get_db_version()
+    except Exception as e:
+        logger.warning('get database version error: %s', e)
+        db_version = None
+    logger.debug('db_version: %s', db_version)
+
+    return {'apiary_name': apiary_name,
+            'start_date': start_date_string,
+            'end_date': end_date_string,
+            'db_version': db_version}
+
+## 2d graphs, using: data selection,
+##                   & 2d chart zoom/rangeslider events
+@app.callback(
+    [Output('graph1', 'figure'),
+     Output('graph2', 'figure')],
+    [Input('data-selection', 'data'),
+     Input('graph1', 'relayoutData'),
+     Input('graph2', 'relayoutData')])
+@metrics.timed('render_2d_graphs')
+def render_2d_graphs(selection, relayout_graph1, relayout_graph2):
+    logger.info('running 2d graph rendering callback')
+    logger.debug('selection: %s', selection)
+
+    if selection is None:
+        logger.warn('no data sent to 2d graph rendering callback...')
+        raise dash.exceptions.PreventUpdate
+
+    apiary_name = selection['apiary_name']
+    start_date_string = selection['start_date']
+    end_date_string = selection['end_date']
+    db_version = selection['db_version']
+
+    # keeps user zoom on the 2d charts until the apiary or date range changes
+    uirevision = f'{apiary_name} {start_date_string} {end_date_string}'
+
+    ## zoom/rangeslider event on a 2d chart - only rebuild that chart,
+    ## at full point budget for the zoomed window
+    triggered = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
+    logger.debug('triggered: %s', triggered)
+
+    if triggered in (['graph1.relayoutData'], ['graph2.relayoutData']):
+        zoomed_graph = triggered[0].split('.')[0]
+        x_range = hp.get_relayout_xrange(relayout_graph1 if zoomed_graph == 'graph1' else relayout_graph2)
+
+        # not an x-axis zoom event (autosize, legend click, etc.)
+        if x_range is None:
+            raise dash.exceptions.PreventUpdate
+
+        # double click / 'all' button - back to the whole selection
+        if x_range == 'reset':
+            x_range = None
+
         try:
-            # if not empty, update it
-            result = subprocess.check_output('python3 update_db.py', shell=True)
+            zoomed_hivekeepers_data = executor.run(hp.get_zoom_data, apiary_name, start_date_string, end_date_string,
+                                                   x_range, columns=hc.SQLite_2d_columns,
+                                                   max_points=hc.APP_MAX_POINTS)
+        except (executor.Busy, executor.Timeout) as e:
+            # keep the chart as it is - the user can zoom again
+            logger.warning('zoom data not built: %s', e)
+            raise dash.exceptions.PreventUpdate
         except Exception as e:
-            logger.error(f'database update error: {e}')
+            logger.info('get data from sql-lite db error: %s', e)
+            raise dash.exceptions.PreventUpdate
+
+        if zoomed_hivekeepers_data.empty:
+            raise dash.exceptions.PreventUpdate
 
-    # convert bytes to string
-    result = result.decode()
-    logger.debug(f'returned string from update_db.py: {result}')
+        with metrics.stage('figure_build'):
+            if zoomed_graph == 'graph1':
+                return build_fig1(zoomed_hivekeepers_data, x_range, uirevision), dash.no_update
 
-    # build/update apiary name list
+            return dash.no_update, build_fig2(zoomed_hivekeepers_data, x_range, uirevision)
+
+    # return cached figures for this exact selection
+    figures_key = ('figures_2d', apiary_name, start_date_string, end_date_string, db_version)
+    figures = cache.get(figures_key) if db_version is not None else None
+
+    if figures is not None:
+        logger.info('returning cached 2d figures')
+        return figures
+
+    # get data from sql-lite db (or the data cache) - only the 2d chart columns,
+    # from the hourly/daily rollups when the raw range exceeds the point budget
+    # - the 3d charts read their own bin group: one read of every fft bin for both
+    #   charts costs more than the two narrow reads
+    try:
+        filtered_hivekeepers_data = get_chart_data(('data_2d', apiary_name, start_date_string, end_date_string, db_version),
+                                                   lambda: hp.get_data(apiary_name, start_date_string, end_date_string,
+                                                                       columns=hc.SQLite_2d_columns,
+                                                                       max_points=hc.APP_MAX_POINTS))
+    except executor.Busy as e:
+        logger.warning('2d data not built: %s', e)
+        return build_empty_figure(BUSY_TITLE), build_empty_figure(BUSY_TITLE)
+    except executor.Timeout as e:
+        logger.warning('2d data not built: %s', e)
+        return build_empty_figure(TIMEOUT_TITLE), build_empty_figure(TIMEOUT_TITLE)
+    except Exception as e:
+        logger.info('get data from sql-lite db error: %s', e)
+        raise dash.exceptions.PreventUpdate
+    
+    logger.debug('filtered_hivekeepers_data: %s', filtered_hivekeepers_data)
+    hp.log_memory_usage('2d dataframe', filtered_hivekeepers_data)
+    
+    # if dataframe is empty, return empty graphs
+    if filtered_hivekeepers_data.empty:
+        logger.info('No data found for 2d graphs')
+        return build_empty_figure(), build_empty_figure()
+
+    # build 2d charts - downsampled to the point budget
+    with metrics.stage('figure_build'):
+        fig1 = build_fig1(filtered_hivekeepers_data, uirevision=uirevision)
+        fig2 = build_fig2(filtered_hivekeepers_data, uirevision=uirevision)
+
+    # cache figures for this selection - as plain dicts, unpickling go.Figure re-validates every trace
+    if db_version is not None:
+        cache.set(figures_key, (fig1.to_dict(), fig2.to_dict()))
+
+    return fig1, fig2
+
+## 3d fft graphs, using: data selection,
+##                       bin selector
+##                       & chart type selector
+## - figures go to the fft-figures store, the colour scale is applied clientside
+@app.callback(
+    Output('fft-figures', 'data'),
+    [Input('data-selection', 'data'),
+     Input("bin-selector", "value"),
+     Input('fft-mode', 'value')])
+@metrics.timed('render_3d_graphs')
+def render_3d_graphs(selection, bin_group, fft_mode):
+    logger.info('running 3d graph rendering callback')
+    logger.debug('selection: %s', selection)
+    logger.debug('bin_group: %s', bin_group)
+    logger.debug('fft_mode: %s', fft_mode)
+
+    if selection is None or bin_group is None:
+        logger.warn('no data sent to 3d graph rendering callback...')
+        raise dash.exceptions.PreventUpdate
+
+    apiary_name = selection['apiary_name']
+    start_date_string = selection['start_date']
+    end_date_string = selection['end_date']
+    db_version = selection['db_version']
+
+    # keeps user camera rotation on the 3d charts until the apiary or date range changes
+    uirevision = f'{apiary_name} {start_date_string} {end_date_string}'
+
+    # return cached figures for this exact selection - eg. flicking back to a previous bin group
+    figures_key = ('figures_3d', apiary_name, start_date_string, end_date_string, bin_group, fft_mode, db_version)
+    figures = cache.get(figures_key) if db_version is not None else None
+
+    if figures is not None:
+        logger.info('returning cached 3d figures')
+        return figures
+
+    # spectrogram modes use the wide time x bin matrix, scatter mode the long-format 3d data
+    spectrogram = fft_mode in ('heatmap', 'surface')
+
+    # build 3d data (or get it from the data cache)
+    def build_3d_data():
+        # get fft bin column names from drop down selection
+        bins = hp.get_bin_columns(bin_group)
+        logger.debug('bins: %s', bins)
+
+        # get data from sql-lite db - only the chart columns and the selected fft bins,
+        # from the hourly/daily rollups when the raw range exceeds the point budget
+        hivekeepers_data = hp.get_data(apiary_name, start_date_string, end_date_string,
+                                       columns=hc.SQLite_2d_columns + bins,
+                                       max_points=hc.APP_MAX_POINTS)
+        logger.debug('hivekeepers_data: %s', hivekeepers_data)
+
+        if hivekeepers_data.empty:
+            return hivekeepers_data
+
+        if spectrogram:
+            with metrics.stage('build_spectrogram_data'):
+                return hp.build_spectrogram_data(hivekeepers_data)
+
+        with metrics.stage('build_3d_data'):
+            return hp.build_3d_data(hivekeepers_data)
+
+    try:
+        filtered_hivekeepers_data_3d = get_chart_data(('data_spectrogram' if spectrogram else 'data_3d',
+                                                       apiary_name, start_date_string, end_date_string, bin_group, db_version),
+                                                      build_3d_data)
+    except executor.Busy as e:
+        logger.warning('3d data not built: %s', e)
+        return build_empty_figure(BUSY_TITLE).to_dict(), build_empty_figure(BUSY_TITLE).to_dict()
+    except executor.Timeout as e:
+        logger.warning('3d data not built: %s', e)
+        return build_empty_figure(TIMEOUT_TITLE).to_dict(), build_empty_figure(TIMEOUT_TITLE).to_dict()
+    except Exception as e:
+        logger.error('build_3d_data error: %s', e)
+        raise dash.exceptions.PreventUpdate
+
+    hp.log_memory_usage('3d dataframe', filtered_hivekeepers_data_3d)
+
+    # if dataframe is empty, return empty graphs
+    if filtered_hivekeepers_data_3d.empty:
+        logger.info('No data found for 3d graphs')
+        return build_empty_figure().to_dict(), build_empty_figure().to_dict()
+
+    with metrics.stage('figure_build'):
+        if spectrogram:
+            fig3 = build_spectrogram_fig3(filtered_hivekeepers_data_3d, fft_mode, uirevision=uirevision).to_dict()
+            fig4 = build_spectrogram_fig4(filtered_hivekeepers_data_3d, uirevision=uirevision).to_dict()
+        else:
+            fig3 = build_fig3(filtered_hivekeepers_data_3d, uirevision=uirevision).to_dict()
+            fig4 = build_fig4(filtered_hivekeepers_data_3d, uirevision=uirevision).to_dict()
+
+    # cache figures for this selection - as plain dicts, unpickling go.Figure re-validates every trace
+    if db_version is not None:
+        cache.set(figures_key, (fig3, fig4))
+
+    return fig3, fig4
+
+## 3d fft graphs colour scale, using: 3d figures store,
+##                                    & colour scale selector
+## - runs in the browser, a colour scale change only sets the colorscale
+##   on the stored figures, so no data goes back to the server
+app.clientside_callback(
+    """
+    function(figures, scale, colorscale_definitions) {
+        if (!figures) {
+            return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+        }
+
+        var colorscale = (colorscale_definitions && colorscale_definitions[scale]) || scale;
+
+        return figures.map(function(figure) {
+            var data = figure.data.map(function(trace) {
+                // spectrogram traces carry the colour scale on the trace itself
+                if (trace.type === 'heatmap' || trace.type === 'surface') {
+                    return Object.assign({}, trace, {colorscale: colorscale});
+                }
+                if (!trace.marker) {
+                    return trace;
+                }
+                return Object.assign({}, trace, {marker: Object.assign({}, trace.marker, {colorscale: colorscale})});
+            });
+            return Object.assign({}, figure, {data: data});
+        });
+    }
+    """,
+    [Output('graph3', 'figure'),
+     Output('graph4', 'figure')],
+    [Input('fft-figures', 'data'),
+     Input('colorscale', 'value')],
+    [dash.dependencies.State('colorscale-definitions', 'data')])
+
+## database update button & progress polling
+##   the button starts a background update (hivekeepers_sync) and returns at once,
+##   the interval then polls the shared status until the update finishes
+@app.callback(
+    dash.dependencies.Output('output-container-button', 'children'),
+    dash.dependencies.Output('apiary-selector', 'options'),
+    dash.dependencies.Output('sync-progress', 'children'),
+    dash.dependencies.Output('sync-interval', 'disabled'),
+    [dash.dependencies.Input('update-button', 'n_clicks'),
+     dash.dependencies.Input('sync-interval', 'n_intervals')])
+def run_script_onClick(n_clicks, n_intervals):
+    logger.info('Running database update button callback')
+
+    triggered = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
+    logger.debug('triggered: %s', triggered)
+
+    if 'update-button.n_clicks' in triggered:
+        if not n_clicks:
+            logger.info('no data sent to run script onClick callback...')
+            raise dash.exceptions.PreventUpdate
+
+        # single-flight - a click while an update is running (in any worker) just follows it
+        if sync.start_background_sync():
+            progress_text = 'database update started...'
+        else:
+            progress_text = 'database update already running...'
+
+        return dash.no_update, dash.no_update, progress_text, False
+
+    # page load (no click, no poll yet) - the last update's message is not this visitor's,
+    # and the layout already has the apiary list, so only follow an update already running
+    if not n_intervals:
+        if sync.get_sync_status().get('state') != 'running':
+            raise dash.exceptions.PreventUpdate
+
+        return dash.no_update, dash.no_update, 'database update running...', False
+
+    # interval poll
+    sync_status = sync.get_sync_status()
+    logger.debug('sync status: %s', sync_status)
+
+    if sync_status['state'] == 'running':
+        max_rows = sync_status.get('max_rows')
+        progress_text = (f"database update running... {sync_status.get('rows', 0)}"
+                         f"{f' of up to {max_rows}' if max_rows else ''} rows ({sync_status.get('seconds', 0)}s)")
+
+        return dash.no_update, dash.no_update, progress_text, False
+
+    # finished - build/update apiary name list, stop polling
     logger.info('updating apiary name list for drop down menu')
     apiary_list = hp.get_apiary_names()
 
-    # return prints from update_db script
-    return result, apiary_list
+    # return status message of the update
+    return sync_status.get('message', ''), apiary_list, '', True
 
 ## CONTAINER health-check
 @app.server.route("/ping")
@@ -597,11 +1131,27 @@ def ping():
     logger.debug('Running healtheck callback ping() via .../ping')
     return "{status: ok}"
 
+## stage timing metrics - Prometheus text format, merged across all workers
+##   see hivekeepers_metrics, scheduled sync lag added as gauges
+@app.server.route("/metrics")
+def get_metrics():
+    logger.debug('Running metrics callback get_metrics() via .../metrics')
+    sync_metrics = sync.get_sync_metrics()
+
+    gauges = {'hivekeepers_sync_lag_ids': ('remote MySQL ids not yet in the local database', sync_metrics.get('lag_ids')),
+              'hivekeepers_sync_last_success_timestamp_seconds': ('time of the last successful scheduled database update', sync_metrics.get('last_success')),
+              'hivekeepers_sync_consecutive_failures': ('scheduled database updates failed in a row', sync_metrics.get('consecutive_failures'))}
+
+    return flask.Response(metrics.get_prometheus_text(gauges), mimetype='text/plain; version=0.0.4')
+
 ## =================
 ## Serve Dash server
 ## =================
 
 if __name__ == "__main__":
+    # no gunicorn master here - start the scheduled database updates even if APP_PRELOAD is set
+    sync.start_scheduler()
+
     # set gunincorn through system env var - see docker-compose file
     #app.run_server(host="0.0.0.0", port=8050, debug=False, use_reloader=False)
     app.run_server(host="0.0.0.0", port=hc.APP_PORT, debug=False, use_reloader=False)
@@ -0,0 +1,158 @@
+# HiveKeepers - container2 - dash_app/hivekeepers_cache.py
+# written by: Andrew McDonald
+# initial: 18/10/26
+# current: 18/10/26
+# version: 0.9
+
+## ==========================================================
+## shared result cache for the chart callbacks
+##
+##   entries are pickled to files in hc.CACHE_DIR (/dev/shm by default),
+##   so every gunicorn worker - and the update scripts - see the same cache
+##
+##   keys always include the database version from sync_state, so entries
+##   from before a database update are never returned; the update scripts
+##   also clear() the cache once they have appended new rows
+##
+##   total size is kept under hc.CACHE_MAX_MB by evicting the least
+##   recently used entries (file mtime is touched on every hit)
+## ==========================================================
+
+import os
+import pickle
+import hashlib
+import tempfile
+
+import hivekeepers_config as hc
+
+import logging
+
+## =================
+## Configure Logging 
+## =================
+
+logger = logging.getLogger()
+
+## ======================
+## cache helper functions
+## ======================
+
+def cache_enabled():
+    return hc.CACHE_MAX_MB > 0
+
+
+def get_cache_path(key_parts):
+    ## takes tuple of key parts - eg. ('data_2d', apiary_name, start_date, end_date, db_version)
+    ## returns cache file path for the key
+    key = hashlib.sha1(repr(key_parts).encode()).hexdigest()
+    return os.path.join(hc.CACHE_DIR, f'{key}.pkl')
+
+
+def get(key_parts):
+    ## returns cached value for the key, or None on a miss
+    if not cache_enabled():
+        return None
+
+    path = get_cache_path(key_parts)
+
+    try:
+        with open(path, 'rb') as cache_file:
+            value = pickle.load(cache_file)
+
+        # mark as recently used
+        os.utime(path)
+    except FileNotFoundError:
+        logger.debug('cache miss: %s', key_parts)
+        return None
+    except Exception as e:
+        logger.warning('cache read exception: %s', e)
+        return None
+
+    logger.debug('cache hit: %s', key_parts)
+
+    return value
+
+
+def set(key_parts, value):
+    ## stores value under the key, then evicts least recently used entries over the size limit
+    if not cache_enabled():
+        return
+
+    try:
+        os.makedirs(hc.CACHE_DIR, exist_ok=True)
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # never let one entry flush the whole cache
+        if len(data) > hc.CACHE_MAX_MB * 1024 * 1024 // 4:
+            logger.info('not caching %s entry of %s bytes - too large', key_parts[0], len(data))
+            return
+
+        # write to temp file then rename - readers in other workers never see a partial file
+        file_descriptor, temp_path = tempfile.mkstemp(dir=hc.CACHE_DIR, suffix='.tmp')
+        with os.fdopen(file_descriptor, 'wb') as cache_file:
+            cache_file.write(data)
+        os.replace(temp_path, get_cache_path(key_parts))
+    except Exception as e:
+        logger.warning('cache write exception: %s', e)
+        return
+
+    logger.debug('cache set: %s (%s bytes)', key_parts, len(data))
+
+    evict()
+
+
+def get_or_set(key_parts, build):
+    ## returns cached value for the key - on a miss calls build() and caches its result
+    ## key_parts containing None (eg. unknown db version) are never cached
+    if None in key_parts:
+        return build()
+
+    value = get(key_parts)
+
+    if value is None:
+        value = build()
+        set(key_parts, value)
+
+    return value
+
+
+def evict():
+    ## removes least recently used entries until the cache is under hc.CACHE_MAX_MB
+    max_bytes = hc.CACHE_MAX_MB * 1024 * 1024
+
+    try:
+        entries = []
+        for entry in os.scandir(hc.CACHE_DIR):
+            if entry.name.endswith('.pkl'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except FileNotFoundError:
+        return
+
+    total_bytes = sum(size for _, size, _ in entries)
+
+    # oldest first
+    for _, size, path in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+        total_bytes -= size
+        logger.debug('cache evicted: %s', path)
+
+
+def clear():
+    logger.info('clearing chart cache')
+    ## removes every cache entry - called by the update scripts after new rows are appended
+    try:
+        for entry in os.scandir(hc.CACHE_DIR):
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+    except FileNotFoundError:
+        pass
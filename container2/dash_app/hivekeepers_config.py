@@ -46,6 +46,83 @@ else:
 
 logger.debug(f'SQL_LOGGING: {SQL_VERBOSE}')
 
+# get 2d chart point budget per trace from user input - default 5000 if none given
+APP_MAX_POINTS = int(os.environ.get('APP_MAX_POINTS', 5000))
+
+# get 2d chart downsampling mode from user input - default lttb if none given
+app_downsample_mode = os.environ.get('APP_DOWNSAMPLE_MODE', 'lttb').lower()
+
+if app_downsample_mode == 'minmax':
+    APP_DOWNSAMPLE_MODE = 'minmax'
+elif app_downsample_mode == 'none':
+    APP_DOWNSAMPLE_MODE = 'none'
+else:
+    APP_DOWNSAMPLE_MODE = 'lttb'
+
+# get callback response compression (gzip/brotli) from user input - default yes if none given
+app_compress = os.environ.get('APP_COMPRESS', 'YES').upper()
+
+if app_compress == 'NO':
+    APP_COMPRESS = False
+else:
+    APP_COMPRESS = True
+
+# get gunicorn app preloading from user input - default no if none given
+#   yes: the app is imported once by the gunicorn master and workers fork from it (see gunicorn_config.py)
+app_preload = os.environ.get('APP_PRELOAD', 'NO').upper()
+
+if app_preload == 'YES':
+    APP_PRELOAD = True
+else:
+    APP_PRELOAD = False
+
+# get chart build executor settings from user input (see hivekeepers_executor.py)
+#   APP_JOB_WORKERS: chart data builds run at once per gunicorn worker, 0 runs them on the request thread (default 2)
+#   APP_JOB_QUEUE: builds waiting for a free slot before new ones are turned away as busy (default 8)
+#   APP_JOB_TIMEOUT: seconds a request waits for its build - the build carries on and is cached (default 20)
+#   with APP_PROFILE set, builds run on the request thread so slow request profiles include them
+APP_JOB_WORKERS = int(os.environ.get('APP_JOB_WORKERS', 2))
+APP_JOB_QUEUE = int(os.environ.get('APP_JOB_QUEUE', 8))
+APP_JOB_TIMEOUT = float(os.environ.get('APP_JOB_TIMEOUT', 20))
+
+# get 2d chart webgl switch point from user input - traces with more points use scattergl - default 2000 if none given
+APP_WEBGL_THRESHOLD = int(os.environ.get('APP_WEBGL_THRESHOLD', 2000))
+
+# get 2d chart rangeslider overview points from user input (webgl charts only) - default 500 if none given
+APP_OVERVIEW_POINTS = int(os.environ.get('APP_OVERVIEW_POINTS', 500))
+
+# get fft spectrogram time bucket budget from user input - default 1000 (about a chart's pixel width) if none given
+APP_SPECTROGRAM_WIDTH = int(os.environ.get('APP_SPECTROGRAM_WIDTH', 1000))
+
+# get slow callback/update profiling from user input - options: off, cprofile, pyinstrument (default off)
+#   chart callbacks and database updates slower than APP_PROFILE_SLOW_SECONDS (default 1.0)
+#   write a profile to PROFILE_DIR - cProfile .prof files (snakeviz, pstats) or pyinstrument .html
+app_profile = os.environ.get('APP_PROFILE', 'off').lower()
+
+if app_profile == 'cprofile':
+    APP_PROFILE = 'cprofile'
+elif app_profile == 'pyinstrument':
+    APP_PROFILE = 'pyinstrument'
+else:
+    APP_PROFILE = 'off'
+
+APP_PROFILE_SLOW_SECONDS = float(os.environ.get('APP_PROFILE_SLOW_SECONDS', 1.0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/home/hivekeeper/persistent/logs/container2/profiles')
+
+logger.debug(f'APP_MAX_POINTS: {APP_MAX_POINTS}')
+logger.debug(f'APP_DOWNSAMPLE_MODE: {APP_DOWNSAMPLE_MODE}')
+logger.debug(f'APP_WEBGL_THRESHOLD: {APP_WEBGL_THRESHOLD}')
+logger.debug(f'APP_OVERVIEW_POINTS: {APP_OVERVIEW_POINTS}')
+logger.debug(f'APP_SPECTROGRAM_WIDTH: {APP_SPECTROGRAM_WIDTH}')
+logger.debug(f'APP_COMPRESS: {APP_COMPRESS}')
+logger.debug(f'APP_PRELOAD: {APP_PRELOAD}')
+logger.debug(f'APP_JOB_WORKERS: {APP_JOB_WORKERS}')
+logger.debug(f'APP_JOB_QUEUE: {APP_JOB_QUEUE}')
+logger.debug(f'APP_JOB_TIMEOUT: {APP_JOB_TIMEOUT}')
+logger.debug(f'APP_PROFILE: {APP_PROFILE}')
+logger.debug(f'APP_PROFILE_SLOW_SECONDS: {APP_PROFILE_SLOW_SECONDS}')
+logger.debug(f'PROFILE_DIR: {PROFILE_DIR}')
+
 # get/set MySQL credentials from user - default 'missing' if none given
 MYSQL_USER = os.environ.get('MYSQL_USER', 'missing')
 MYSQL_PASS = os.environ.get('MYSQL_PASS', 'missing')
@@ -57,11 +134,88 @@ logger.debug(f'MYSQL_USER: {MYSQL_PASS}')
 logger.debug(f'MYSQL_USER: {MYSQL_HOST}')
 logger.debug(f'MYSQL_USER: {MYSQL_DB}')
 
-# set SQLite database name, table names
-SQLite_db_name = '/home/hivekeeper/persistent/db/hivekeepers.db'  ## << ----- testing!
+# get sync chunk size from user input - rows pulled from MySQL and committed locally per chunk
+#   bounds update memory use regardless of backlog size (default 10000)
+SYNC_CHUNK_SIZE = int(os.environ.get('SYNC_CHUNK_SIZE', 10000))
+
+# get cold start fetch workers from user input - id range partitions fetched from MySQL at once
+#   each worker holds one pooled MySQL connection, keep at or below the pool size of 10 (default 4)
+SYNC_WORKERS = int(os.environ.get('SYNC_WORKERS', 4))
+
+# get scheduled sync settings from user input
+#   SYNC_INTERVAL: seconds between background updates run by the app, 0 turns them off (default 0)
+#   SYNC_JITTER: +/- fraction each wait is randomised by (default 0.1)
+#   SYNC_MAX_BACKOFF: longest wait in seconds after repeated failures (default 3600)
+SYNC_INTERVAL = int(os.environ.get('SYNC_INTERVAL', 0))
+SYNC_JITTER = float(os.environ.get('SYNC_JITTER', 0.1))
+SYNC_MAX_BACKOFF = int(os.environ.get('SYNC_MAX_BACKOFF', 3600))
+
+logger.debug(f'SYNC_CHUNK_SIZE: {SYNC_CHUNK_SIZE}')
+logger.debug(f'SYNC_WORKERS: {SYNC_WORKERS}')
+logger.debug(f'SYNC_INTERVAL: {SYNC_INTERVAL}')
+logger.debug(f'SYNC_JITTER: {SYNC_JITTER}')
+logger.debug(f'SYNC_MAX_BACKOFF: {SYNC_MAX_BACKOFF}')
+
+# set SQLite database name from user input (eg. a scratch database for benchmarks), table names
+SQLite_db_name = os.environ.get('SQLITE_DB_NAME', '/home/hivekeeper/persistent/db/hivekeepers.db')
 SQLite_2d_table_name = 'hivedata2d'
 
 logger.debug(f'SQLite_db_name: {SQLite_db_name}')
+
+# set database update lock and status files - beside the database so every gunicorn worker
+# (and the update scripts) share them: one update runs at a time, any worker can report on it
+SYNC_LOCK_FILE = os.path.join(os.path.dirname(SQLite_db_name), 'sync.lock')
+SYNC_STATUS_FILE = os.path.join(os.path.dirname(SQLite_db_name), 'sync_status.json')
+
+# get raw data storage backend from user input - options: sqlite, parquet (default sqlite)
+#   parquet keeps a columnar copy of the raw data (one file per apiary per month) written by
+#   the database updates and read by the charts - needs pyarrow, rollups stay in SQLite
+storage_backend = os.environ.get('STORAGE_BACKEND', 'sqlite').lower()
+
+if storage_backend == 'parquet':
+    STORAGE_BACKEND = 'parquet'
+else:
+    STORAGE_BACKEND = 'sqlite'
+
+# set parquet location and row group size - row groups are the unit skipped by timestamp filters
+PARQUET_DIR = os.path.join(os.path.dirname(SQLite_db_name), 'parquet')
+PARQUET_ROW_GROUP_SIZE = int(os.environ.get('PARQUET_ROW_GROUP_SIZE', 1024))
+
+logger.debug(f'STORAGE_BACKEND: {STORAGE_BACKEND}')
+logger.debug(f'PARQUET_DIR: {PARQUET_DIR}')
+logger.debug(f'PARQUET_ROW_GROUP_SIZE: {PARQUET_ROW_GROUP_SIZE}')
+
+# set scheduled sync lock and metrics files - the worker holding the lock runs the schedule
+SYNC_SCHEDULER_LOCK_FILE = os.path.join(os.path.dirname(SQLite_db_name), 'sync_scheduler.lock')
+SYNC_METRICS_FILE = os.path.join(os.path.dirname(SQLite_db_name), 'sync_metrics.json')
+
+logger.debug(f'SYNC_LOCK_FILE: {SYNC_LOCK_FILE}')
+logger.debug(f'SYNC_STATUS_FILE: {SYNC_STATUS_FILE}')
+logger.debug(f'SYNC_SCHEDULER_LOCK_FILE: {SYNC_SCHEDULER_LOCK_FILE}')
+logger.debug(f'SYNC_METRICS_FILE: {SYNC_METRICS_FILE}')
+
+# set SQLite connection pool size per process and PRAGMA tuning
+#   gevent workers don't pool SQLite connections (see hivekeepers_helpers.get_sqlite_engine)
+#   mmap_size in bytes, cache_size negative = KiB (default: 256MB mmap, 64MB page cache)
+SQLITE_POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', 5))
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 268435456))
+SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -65536))
+
+logger.debug(f'SQLITE_POOL_SIZE: {SQLITE_POOL_SIZE}')
+
+# set chart cache location and size from user input - shared memory so all workers share it
+#   CACHE_MAX_MB=0 turns the cache off (default 256MB)
+CACHE_DIR = os.environ.get('CACHE_DIR', '/dev/shm/hivekeepers_cache')
+CACHE_MAX_MB = int(os.environ.get('CACHE_MAX_MB', 256))
+
+# set stage timing metrics location - one file per process in shared memory, merged by /metrics
+METRICS_DIR = os.environ.get('METRICS_DIR', '/dev/shm/hivekeepers_metrics')
+
+logger.debug(f'CACHE_DIR: {CACHE_DIR}')
+logger.debug(f'METRICS_DIR: {METRICS_DIR}')
+logger.debug(f'CACHE_MAX_MB: {CACHE_MAX_MB}')
+logger.debug(f'SQLITE_MMAP_SIZE: {SQLITE_MMAP_SIZE}')
+logger.debug(f'SQLITE_CACHE_SIZE: {SQLITE_CACHE_SIZE}')
 logger.debug(f'SQLite_2d_table_name: {SQLite_2d_table_name}')
 
 # set local SQLite database headers - replaced 'apiary_id' with 'apiary_name'
@@ -81,3 +235,31 @@ SQLite_default_columns = ['id', 'apiary_name', 'timestamp', 'bme680_internal_tem
                         'fft_bin60', 'fft_bin61', 'fft_bin62', 'fft_bin63', 'fft_bin64']
 
 logger.debug(f'SQLite_default_columns: {SQLite_default_columns}')
+
+# local SQLite fft bin column names - used to project bin group selections into queries
+SQLite_fft_bins = [column for column in SQLite_default_columns if column.startswith('fft_bin')]
+
+# local SQLite non fft bin columns needed by the charts - 'temp_delta' is added by clean_data_db()
+SQLite_2d_columns = ['id', 'apiary_name', 'timestamp', 'bme680_internal_temperature',
+                     'bme680_external_temperature', 'temp_delta']
+
+logger.debug(f'SQLite_fft_bins: {SQLite_fft_bins}')
+logger.debug(f'SQLite_2d_columns: {SQLite_2d_columns}')
+
+# set local SQLite rollup table names - per apiary hourly/daily aggregates of hivedata2d
+SQLite_hourly_table_name = 'hivedata2d_hourly'
+SQLite_daily_table_name = 'hivedata2d_daily'
+
+# local SQLite columns stored as mean, min and max in the rollup tables - fft bins are stored as mean only
+SQLite_rollup_stat_columns = ['bme680_internal_temperature', 'bme680_external_temperature', 'temp_delta']
+
+logger.debug(f'SQLite_hourly_table_name: {SQLite_hourly_table_name}')
+logger.debug(f'SQLite_daily_table_name: {SQLite_daily_table_name}')
+
+# set local SQLite per apiary metadata table name (first/last timestamp, row count, days with data)
+# and key/value sync state table name (database version, etc.)
+SQLite_metadata_table_name = 'apiary_metadata'
+SQLite_sync_state_table_name = 'sync_state'
+
+logger.debug(f'SQLite_metadata_table_name: {SQLite_metadata_table_name}')
+logger.debug(f'SQLite_sync_state_table_name: {SQLite_sync_state_table_name}')
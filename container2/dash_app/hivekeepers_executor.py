@@ -0,0 +1,206 @@
+# HiveKeepers - container2 - dash_app/hivekeepers_executor.py
+# written by: Andrew McDonald
+# initial: 18/10/26
+# current: 18/10/26
+# version: 0.9
+
+## ==========================================================
+## bounded background executor for slow chart work
+##
+##   the chart callbacks hand their data builds (SQLite reads, 3d data) to a
+##   small pool of hc.APP_JOB_WORKERS threads per process instead of running
+##   them on the request thread:
+##     - only APP_JOB_WORKERS builds run at once, so a few large selections
+##       can't hold every request thread - pings, page loads and cached charts
+##       keep being answered while they run
+##     - at most APP_JOB_QUEUE more builds wait, past that run() raises Busy
+##       straight away instead of queueing the request
+##     - a request waits at most APP_JOB_TIMEOUT seconds, then run() raises
+##       Timeout - the build carries on, and as the callbacks build through
+##       the chart cache, the next request for the selection gets its result
+##
+##   in gevent workers (APP_WORKER_CLASS=gevent) builds run on a native
+##   thread pool of their own, so the event loop keeps serving other requests
+##   while SQLite and pandas work - the hub's own pool (DNS lookups etc.) is
+##   left alone. The builds share the process' SQLite engine, metrics and
+##   pending count with the greenlets across those native threads, while
+##   threading is monkey patched - so every lock taken on both sides comes
+##   from native_lock(), never threading.Lock (a gevent lock there), and the
+##   SQLite engine has no connection pool in gevent workers (its queue locks
+##   are gevent locks too - see hivekeepers_helpers.get_sqlite_engine)
+##
+##   database updates keep their own single-flight background thread
+##   (hivekeepers_sync) - start_thread() runs it on a native thread in gevent
+##   workers too, so an update never stalls the event loop
+##
+##   APP_JOB_WORKERS=0 turns the pool off - builds run on the request thread
+##
+##   with APP_PROFILE set, builds also run on the request thread: the slow
+##   request profiler (hivekeepers_metrics) only sees the thread it was
+##   started in, so a pooled build would leave the profile showing nothing
+##   but the wait for it. Busy/Timeout don't apply while profiling
+## ==========================================================
+
+import os
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import hivekeepers_config as hc
+import hivekeepers_metrics as metrics
+
+import logging
+
+## =================
+## Configure Logging
+## =================
+
+logger = logging.getLogger()
+
+## ======================
+## errors
+## ======================
+
+class Busy(Exception):
+    ## raised by run() when APP_JOB_QUEUE builds are already waiting
+    pass
+
+
+class Timeout(Exception):
+    ## raised by run() when a build takes longer than APP_JOB_TIMEOUT - the build carries on
+    pass
+
+## ======================
+## executor
+## ======================
+
+def native_lock():
+    ## returns a lock native threads can share - threading.Lock from before any gevent
+    ## monkey patching, as a patched one is a gevent lock, not safe across native threads
+    try:
+        from gevent.monkey import get_original
+    except ImportError:
+        return threading.Lock()
+
+    return get_original('threading', 'Lock')()
+
+
+def gevent_patched():
+    ## True in a gevent worker - threading is monkey patched, so real threads come from the hub
+    gevent_monkey = sys.modules.get('gevent.monkey')
+
+    return gevent_monkey is not None and gevent_monkey.is_module_patched('threading')
+
+
+# one pool per process - created lazily, so each forked gunicorn worker builds its own
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+# builds submitted and not yet finished (running or waiting) in this process -
+# counted down by the build threads, native threads in gevent workers
+_pending = 0
+_pending_lock = native_lock()
+
+
+def get_executor():
+    ## returns the process-wide pool - a ThreadPoolExecutor, or a gevent native thread pool
+    global _executor, _executor_pid
+
+    if _executor is not None and _executor_pid == os.getpid():
+        return _executor
+
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            if gevent_patched():
+                import gevent.threadpool
+                logger.info('creating gevent native thread pool for chart builds: %s workers', hc.APP_JOB_WORKERS)
+                _executor = gevent.threadpool.ThreadPool(hc.APP_JOB_WORKERS)
+            else:
+                logger.info('creating chart build pool for this process: %s workers', hc.APP_JOB_WORKERS)
+                _executor = ThreadPoolExecutor(max_workers=hc.APP_JOB_WORKERS, thread_name_prefix='hivekeepers-job')
+
+            _executor_pid = os.getpid()
+
+    return _executor
+
+
+def run_native(function, *args):
+    ## runs function(*args) on a native thread of its own and returns its result
+    ## for gevent workers, where a long blocking call on a greenlet stalls every other request
+    import gevent.threadpool
+    pool = gevent.threadpool.ThreadPool(1)
+
+    try:
+        return pool.apply(function, args)
+    finally:
+        pool.kill()
+
+
+def start_thread(target, args=(), name=None):
+    ## starts and returns a daemon thread running target(*args)
+    ## in gevent workers the thread is a greenlet, so target is run by run_native
+    if gevent_patched():
+        target, args = run_native, (target,) + tuple(args)
+
+    thread = threading.Thread(target=target, args=args, name=name, daemon=True)
+    thread.start()
+
+    return thread
+
+
+def get_pending():
+    ## returns the number of builds running or waiting in this process
+    return _pending
+
+
+def run(function, *args, **kwargs):
+    ## runs function(*args, **kwargs) in the pool and returns its result
+    ## raises Busy if APP_JOB_WORKERS + APP_JOB_QUEUE builds are already pending,
+    ## Timeout if the result is not ready within APP_JOB_TIMEOUT seconds
+    global _pending
+
+    # no pool, or profiling - see above
+    if hc.APP_JOB_WORKERS <= 0 or hc.APP_PROFILE != 'off':
+        return function(*args, **kwargs)
+
+    with _pending_lock:
+        if _pending >= hc.APP_JOB_WORKERS + hc.APP_JOB_QUEUE:
+            logger.warning('chart build pool full: %s builds pending', _pending)
+            raise Busy(f'{_pending} chart builds already pending')
+
+        _pending += 1
+
+    # the build's stages are recorded against the calling callback
+    job = metrics.get_job()
+    submit_time = time.perf_counter()
+
+    def run_job():
+        global _pending
+
+        try:
+            with metrics.in_job(job):
+                metrics.record_stage('executor_wait', time.perf_counter() - submit_time)
+                return function(*args, **kwargs)
+        finally:
+            with _pending_lock:
+                _pending -= 1
+
+    executor = get_executor()
+
+    if isinstance(executor, ThreadPoolExecutor):
+        future = executor.submit(run_job)
+
+        try:
+            return future.result(timeout=hc.APP_JOB_TIMEOUT)
+        except FutureTimeoutError:
+            raise Timeout(f'chart build not finished after {hc.APP_JOB_TIMEOUT}s') from None
+
+    import gevent
+    async_result = executor.spawn(run_job)
+
+    try:
+        return async_result.get(timeout=hc.APP_JOB_TIMEOUT)
+    except gevent.Timeout:
+        raise Timeout(f'chart build not finished after {hc.APP_JOB_TIMEOUT}s') from None
@@ -5,13 +5,33 @@
 # version: 0.9
 
 # pandas vers==1.4.0
+import os
+import json
+import shutil
 import sqlite3
+import tempfile
+from urllib.parse import quote
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import sqlalchemy as db
-from sqlalchemy import func
-import copy
+from sqlalchemy.pool import NullPool, QueuePool
+from datetime import datetime, timedelta
 
+import numpy as np
 import pandas as pd
 import hivekeepers_config as hc
+import hivekeepers_metrics as metrics
+import hivekeepers_executor as executor
+
+# optional columnar storage backend - see hc.STORAGE_BACKEND
+#   imported on first use by load_pyarrow(), pyarrow would add a third of a second to every worker start
+pa = ds = pq = None
+
+# optional fast json encoder - plotly uses it for figure json when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 import logging
 
@@ -21,21 +41,103 @@ import logging
 
 logger = logging.getLogger()
 
+## ======================
+## SQLite engine handling
+## ======================
+
+# one pooled engine per process - created lazily, so each forked gunicorn worker
+# builds its own instead of reusing connections inherited from the parent
+_sqlite_engine = None
+_sqlite_engine_pid = None
+_sqlite_tables = {}
+_sqlite_lock = executor.native_lock()
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    ## runs on every new pooled SQLite connection
+    ##   WAL lets dashboard readers run while the update scripts write
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA mmap_size={hc.SQLITE_MMAP_SIZE}')
+    cursor.execute(f'PRAGMA cache_size={hc.SQLITE_CACHE_SIZE}')
+    cursor.close()
+
+
+def get_sqlite_engine():
+    ## returns the process-wide pooled SQLite engine - (re)built on first use in each process
+    global _sqlite_engine, _sqlite_engine_pid
+
+    if _sqlite_engine is not None and _sqlite_engine_pid == os.getpid():
+        return _sqlite_engine
+
+    with _sqlite_lock:
+        if _sqlite_engine is None or _sqlite_engine_pid != os.getpid():
+            logger.info('creating pooled SQLite engine for this process')
+
+            # connections are handed between request threads by the pool - except in gevent
+            # workers, where chart builds connect from native threads (hivekeepers_executor)
+            # and the pool's queue locks would be gevent locks: each checkout opens its own
+            if executor.gevent_patched():
+                pool_options = {'poolclass': NullPool}
+            else:
+                pool_options = {'poolclass': QueuePool,
+                                'pool_size': hc.SQLITE_POOL_SIZE,
+                                'max_overflow': hc.SQLITE_POOL_SIZE}
+
+            engine = db.create_engine(f'sqlite:///{hc.SQLite_db_name}',
+                                      echo=hc.SQL_VERBOSE,
+                                      connect_args={'check_same_thread': False},
+                                      **pool_options)
+            db.event.listen(engine, 'connect', set_sqlite_pragmas)
+
+            # inherited engine belongs to the parent process - drop it, don't dispose it
+            _sqlite_tables.clear()
+            _sqlite_engine = engine
+            _sqlite_engine_pid = os.getpid()
+
+    return _sqlite_engine
+
+
+def get_sqlite_table(table_name):
+    ## returns reflected SQLite table metadata - reflected once per process, then cached
+    engine = get_sqlite_engine()
+
+    hivedata = _sqlite_tables.get(table_name)
+
+    if hivedata is None:
+        logger.info('reflecting SQLite table: %s', table_name)
+        hivedata = db.Table(table_name, db.MetaData(), autoload=True, autoload_with=engine)
+        _sqlite_tables[table_name] = hivedata
+
+    return hivedata
+
+
+def has_data_table():
+    ## True if the local database holds the raw data table - a new or empty database file
+    ## has none, but isn't 0 bytes once anything has connected (WAL mode is set on connect)
+    return db.inspect(get_sqlite_engine()).has_table(hc.SQLite_2d_table_name)
+
 ## ====================
 ## APP helper functions
 ## ====================
 
 def get_apiary_names():
     logger.info('getting apiary name list from local SQLite server...')
-    # create SQLite db engine
+    # names from the cached apiary metadata - only the database version is read while it is current
+    apiary_list_names = sorted(load_apiary_metadata())
 
-    try:
-        sql_lite_engine = db.create_engine(f'sqlite:///{hc.SQLite_db_name}', echo=hc.SQL_VERBOSE)
-    except Exception as e:
-        logger.warning(f'SQLite database exception: {e}')
+    if apiary_list_names:
+        logger.info('successfully got apiary id list from apiary metadata')
+        return apiary_list_names
+
+    # no metadata table yet (eg. database built before it existed) - read the raw table
+    # get pooled SQLite db engine
+    sql_lite_engine = get_sqlite_engine()
 
-    query =  f'SELECT DISTINCT apiary_name FROM {hc.SQLite_2d_table_name}'
-    logger.debug(f'get apiary names query: {query}')
+    # distinct names via the (apiary_name, timestamp) index - one seek per apiary, no table scan
+    query = APIARY_NAMES_QUERY
+    logger.debug('get apiary names query: %s', query)
 
     apiary_list_names = []
 
@@ -45,9 +147,9 @@ def get_apiary_names():
             for row in result:
                 apiary_list_names.append(row[0])
     except Exception as e:
-        logger.warning(f'SQLite database exception: {e}')
+        logger.warning('SQLite database exception: %s', e)
 
-    logger.debug(f'apiary_list: {apiary_list_names}')
+    logger.debug('apiary_list: %s', apiary_list_names)
 
     if apiary_list_names:
         logger.info('successfully got apiary id list from local SQLite server')
@@ -57,55 +159,268 @@ def get_apiary_names():
     return apiary_list_names
 
 
-def get_apiary_timestamps_name(apiary_name):
-    logger.info('getting apiary name timestampes from SQLite server')
-    # create SQLite db engine
-    sql_lite_engine = db.create_engine(f'sqlite:///{hc.SQLite_db_name}', echo=hc.SQL_VERBOSE)
+# per apiary metadata held in memory - reloaded only when the database version changes
+_apiary_metadata = {}
+_apiary_metadata_version = None
+
+
+def get_apiary_metadata(apiary_name):
+    logger.info('getting apiary metadata')
+    ## takes apiary name
+    ## returns dict of first_timestamp, last_timestamp, row_count and days (sorted list of
+    ## datetime.date with data) for the apiary - or None if the apiary has no metadata
+    apiary_metadata = load_apiary_metadata().get(apiary_name)
+    logger.debug('apiary_metadata: %s', apiary_metadata)
 
-    query =  f'SELECT timestamp FROM {hc.SQLite_2d_table_name} WHERE apiary_name = "{apiary_name}"'
+    return apiary_metadata
 
-    with sql_lite_engine.connect() as conn:
-        apiary_timestamp_df = pd.read_sql_query(query, conn)
 
-    logger.debug(f'apiary_df: {apiary_timestamp_df.head()}')
+def load_apiary_metadata():
+    ## returns dict of apiary name -> metadata (see get_apiary_metadata) for every apiary
+    ##
+    ## the whole metadata table is cached per process; each call only reads the
+    ## database version from sync_state to check the cache is still current
+    global _apiary_metadata, _apiary_metadata_version
 
-    return apiary_timestamp_df
+    try:
+        with get_sqlite_engine().connect() as conn:
+            db_version = get_db_version(conn)
+
+            if db_version != _apiary_metadata_version:
+                logger.info('loading apiary metadata for database version: %s', db_version)
+                query = (f'SELECT apiary_name, first_timestamp, last_timestamp, row_count, days '
+                         f'FROM {hc.SQLite_metadata_table_name}')
+
+                metadata = {}
+                for row in conn.execute(db.text(query)):
+                    metadata[row[0]] = {'first_timestamp': pd.Timestamp(row[1]),
+                                        'last_timestamp': pd.Timestamp(row[2]),
+                                        'row_count': row[3],
+                                        'days': [date_value.date() for date_value in pd.to_datetime(json.loads(row[4]))]}
+
+                _apiary_metadata = metadata
+                _apiary_metadata_version = db_version
+    except Exception as e:
+        logger.warning('SQLite database exception: %s', e)
+
+    return _apiary_metadata
 
 
-def get_data(apiary_name, start_date, end_date):
+def get_db_version(conn=None):
+    ## takes optional open SQLite connection - uses a pooled one if not given
+    ## returns the database version - bumped by the update scripts every time data changes
+    query = f"SELECT value FROM {hc.SQLite_sync_state_table_name} WHERE key = 'db_version'"
+
+    if conn is None:
+        with get_sqlite_engine().connect() as conn:
+            row = conn.execute(db.text(query)).fetchone()
+    else:
+        row = conn.execute(db.text(query)).fetchone()
+
+    return int(row[0]) if row else 0
+
+
+def get_data(apiary_name, start_date, end_date, columns=None, max_points=None):
     logger.info('getting all data for apiary between start_date, end_date from SQLite server')
+    ## columns:    optional list of column names to select - defaults to all columns
+    ##             eg. hc.SQLite_2d_columns + get_bin_columns(bin_group)
+    ## max_points: optional row budget - reads the finest of raw, hourly or daily
+    ##             data that fits the budget, defaults to raw data
     # working dir: /home/hivekeeper/dash_app/
-    # Create connection
+    # check out pooled connection
+    logger.info('opening connection to local SQLite database')
+    connection = get_sqlite_engine().connect()
+
+    # choose raw or rollup table for the requested range
+    if max_points is None:
+        table_name = hc.SQLite_2d_table_name
+    else:
+        table_name = get_data_table_name(connection, apiary_name, start_date, end_date, max_points)
+
+    # raw data from the columnar backend if enabled - rollups always come from SQLite
+    if table_name == hc.SQLite_2d_table_name and parquet_enabled():
+        connection.close()
+
+        with metrics.stage('parquet_read'):
+            apiary_data_df = get_parquet_data(apiary_name, start_date, end_date, columns)
+        apiary_data_df.attrs['table_name'] = table_name
+
+        return apiary_data_df
+
+    hivedata = get_sqlite_table(table_name)
+    logger.debug('SQLite tables: %s', hivedata)
+
+    # project only the requested columns out of SQLite - rollup tables have no id column
+    if columns is None:
+        selected = [hivedata]
+    else:
+        selected = [hivedata.columns[column] for column in columns if column in hivedata.columns]
+    logger.debug('SQLite selected columns: %s', columns)
+
+    query = get_data_query(hivedata, apiary_name, start_date, end_date, selected)
+    logger.debug('SQLite query = %s', query)
+
+    try:
+        # read the DBAPI cursor straight into typed numpy columns - no Row objects
+        logger.info('reading SQLite response into 2d dataframe...')
+        with metrics.stage('sql_execute'):
+            ResultProxy = connection.execute(query)
+        apiary_data_df = read_cursor_columns(ResultProxy.cursor)
+        ResultProxy.close()
+    finally:
+        # return connection to the pool
+        logger.info('closing connection to local SQLite database...')
+        connection.close()
+
+    # record which table the data came from - raw or rollup
+    apiary_data_df.attrs['table_name'] = table_name
+
+    logger.debug('2d dataframe: %s', apiary_data_df.head())
+
+    return apiary_data_df
+
+
+def get_column_dtype(column):
+    ## returns the numpy dtype (or 'category') a data column is loaded as
+    ##   sensor and fft values float32 - plenty for temperatures and amplitudes, half the memory
+    ##   of float64. frames headed for the SQLite server (clean_data_db) stay float64
+    if column == 'timestamp':
+        return 'datetime64[ns]'
+    if column == 'apiary_name':
+        return 'category'
+    if column in ('id', 'row_count'):
+        return np.int64
+
+    return np.float32
+
+
+def get_typed_column(column, values):
+    ## takes column name and a sequence of raw SQLite values (None for NULL)
+    ## returns them as a typed numpy array - timestamps are parsed from their stored text
+    dtype = get_column_dtype(column)
+
+    if dtype == 'datetime64[ns]':
+        return np.array(values, dtype='datetime64[us]').astype(dtype)
+    if dtype == 'category':
+        return np.array(values, dtype=object)
+
+    # NULL becomes NaN in float columns
+    return np.array(values, dtype=dtype)
+
+
+def read_cursor_columns(cursor, fetch_size=10000):
+    ## takes an executed DBAPI cursor
+    ## returns its rows as a dataframe of typed columns (see get_column_dtype) - rows are
+    ## fetched fetch_size at a time and transposed straight into numpy arrays, so the whole
+    ## result never exists as Python row objects
+    columns = [description[0] for description in cursor.description]
+    column_chunks = [[] for _ in columns]
+
+    with metrics.stage('sql_fetch'):
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+
+            if not rows:
+                break
+
+            for column_chunk, column, values in zip(column_chunks, columns, zip(*rows)):
+                column_chunk.append(get_typed_column(column, values))
+
+    if not column_chunks or not column_chunks[0]:
+        return pd.DataFrame()
+
+    with metrics.stage('dataframe_build'):
+        dataframe = pd.DataFrame({column: np.concatenate(column_chunk) for column, column_chunk in zip(columns, column_chunks)})
+
+        return apply_column_dtypes(dataframe)
+
+
+def apply_column_dtypes(dataframe):
+    ## returns dataframe with every column cast to its load dtype (see get_column_dtype)
+    dtypes = {column: get_column_dtype(column) for column in dataframe.columns}
+
+    return dataframe.astype({column: dtype for column, dtype in dtypes.items() if dataframe[column].dtype != dtype})
+
+
+def get_data_query(hivedata, apiary_name, start_date, end_date, selected=None):
+    ## takes reflected table, apiary, inclusive 'YYYY-MM-DD' date range and optional selected columns
+    ## returns select query over a half-open timestamp range - left bare (no DATE()
+    ## wrapper) so SQLite can seek the (apiary_name, timestamp) index
+    range_start, range_end = get_timestamp_range(start_date, end_date)
+
+    query = db.select(selected or [hivedata]).where(db.and_(hivedata.columns.apiary_name == apiary_name,
+                                                            hivedata.columns.timestamp >= range_start,
+                                                            hivedata.columns.timestamp < range_end))
+
+    return query.order_by(hivedata.columns.timestamp)
+
+
+def get_timestamp_range(start_date, end_date):
+    ## takes inclusive 'YYYY-MM-DD' start and end date strings
+    ## returns half-open [start, end) datetime bounds - end is midnight after end_date
+    range_start = datetime.strptime(start_date, '%Y-%m-%d')
+    range_end = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
+
+    return range_start, range_end
+
+
+def get_data_table_name(connection, apiary_name, start_date, end_date, max_points):
+    logger.info('choosing data table for apiary between start_date, end_date within point budget')
+    ## takes open SQLite connection, apiary, date range and a row budget
+    ## returns the finest table (raw -> hourly -> daily) whose row count for the range fits
+    ## the budget - row counts come from the hourly rollup, so no raw rows are scanned
+    range_start, range_end = get_timestamp_range(start_date, end_date)
+
     try:
-        logger.info('opening connection to local SQLite database')
-        engine = db.create_engine(f'sqlite:///{hc.SQLite_db_name}', echo=hc.SQL_VERBOSE)
-        connection = engine.connect()
+        raw_count, hourly_count = connection.execute(db.text(ROLLUP_COUNT_QUERY), {'apiary_name': apiary_name,
+                                                             'range_start': range_start.strftime(TIMESTAMP_FORMAT),
+                                                             'range_end': range_end.strftime(TIMESTAMP_FORMAT)}).fetchone()
     except Exception as e:
-        logger.warning(f'SQLite database exception: {e}')
-    
-    metadata = db.MetaData()
-    logger.debug(f'SQLite metadata: {metadata}')
+        logger.warning('SQLite rollup table exception, using raw data: %s', e)
+        return hc.SQLite_2d_table_name
 
-    hivedata = db.Table(hc.SQLite_2d_table_name, metadata, autoload=True, autoload_with=engine)
-    logger.debug(f'SQLite tables: {hivedata}')
+    logger.debug('raw_count: %s, hourly_count: %s, max_points: %s', raw_count, hourly_count, max_points)
 
-    query = db.select([hivedata]).where(db.and_(hivedata.columns.apiary_name == apiary_name),(func.DATE(hivedata.columns.timestamp).between(start_date, end_date)))
-    logger.debug(f'SQLite query = {query}')
+    if not raw_count or raw_count <= max_points:
+        table_name = hc.SQLite_2d_table_name
+    elif hourly_count <= max_points:
+        table_name = hc.SQLite_hourly_table_name
+    else:
+        table_name = hc.SQLite_daily_table_name
 
-    ResultProxy = connection.execute(query)
-    ResultSet = ResultProxy.fetchall()
-    
-    logger.info('closing connection to local SQLite database...')
-    connection.close()
+    logger.info('using data table: %s', table_name)
 
-    logger.debug(f'SQLite response = {ResultSet}')
+    return table_name
 
-    logger.info('converting SQLite response to 2d dataframe...')
-    apiary_data_df = pd.DataFrame(ResultSet)
 
-    logger.debug(f'2d dataframe: {apiary_data_df.head()}')
+def get_zoom_data(apiary_name, start_date, end_date, x_range, columns=None, max_points=None):
+    logger.info('getting overview and zoomed window data for apiary between start_date, end_date')
+    ## takes the same arguments as get_data() plus a (start, end) zoomed x_range
+    ## returns the selection's data at the resolution fitting max_points, with the
+    ## zoomed window swapped for the finest resolution that fits max_points on its own
+    overview_df = get_data(apiary_name, start_date, end_date, columns, max_points)
 
-    return apiary_data_df
+    # overview already holds raw data - nothing finer to fetch
+    if x_range is None or overview_df.empty or overview_df.attrs['table_name'] == hc.SQLite_2d_table_name:
+        return overview_df
+
+    # zoomed window days, clipped to the selected date range
+    window_start = max(x_range[0].strftime('%Y-%m-%d'), start_date)
+    window_end = min(x_range[1].strftime('%Y-%m-%d'), end_date)
+
+    window_df = get_data(apiary_name, window_start, window_end, columns, max_points)
+
+    if window_df.empty:
+        return overview_df
+
+    # replace the overview rows covered by the window
+    before = overview_df['timestamp'] < window_df['timestamp'].iloc[0]
+    after = overview_df['timestamp'] > window_df['timestamp'].iloc[-1]
+    zoom_data_df = pd.concat([overview_df[before], window_df, overview_df[after]], ignore_index=True)
+
+    logger.debug('zoom dataframe: %s', zoom_data_df.head())
+
+    return zoom_data_df
 
 
 def clean_data_db(dataframe):
@@ -121,7 +436,7 @@ def clean_data_db(dataframe):
     # eg. from 1635249781 to 2021-10-26 12:03:01
     dataframe['timestamp'] = pd.to_datetime(dataframe['timestamp'], unit='s')
 
-    logger.debug(f'cleaned_dataframe: {dataframe.head()}')
+    logger.debug('cleaned_dataframe: %s', dataframe.head())
 
     return dataframe
 
@@ -130,87 +445,97 @@ def build_3d_data(dataframe):
     logger.info('building dataframe for 3d charts...')
     ## --------------------------------
     ## build new dataframe for 4d chart 
-    ## takes hivekeepers dataframe, a list of the fft_bins and a list of the fft_amplitude values
-    ## returns a dataframe where each index has each fft_bin and fft_amplitude value (total 64 per index)
+    ## takes hivekeepers dataframe with its fft_bin columns
+    ## returns a long-format dataframe where each source row is exploded into
+    ## one row per fft_bin (total 64 per index when all bins are present)
+    ##
+    ## built directly from numpy arrays: the fft_bin block is ravelled row-major,
+    ## so row i, bin j lands at position i * len(bins) + j - the per-row columns
+    ## are np.repeat'ed and the bin names np.tile'd to line up with it
     ## --------------------------------
 
-    # get fft bin names and amplitude values
+    # get fft bin names
     logger.info('get fft bin name list...')
     bins = get_fft_bins(dataframe)
-    logger.debug(f'fft bins: {bins}')
-
-    # get fft bin names and amplitude values
-    logger.info('get fft bin values list...')
-    fft_amplitudes = dataframe[bins].values
-    logger.debug(f'fft amplitude: {bins}')
-
-    # get timestamp and internal temp data
-    logger.info('get internal temperature values...')
-    internal_temps = copy.deepcopy(dataframe['bme680_internal_temperature'])
-    logger.debug(f'internal temperatures df: {internal_temps}')
-
-    # build initial df with timestamp and apiary columns
-    logger.info('build first part of 3d data... apiary and timestamps columns...')
-    data_3d_1 = [copy.deepcopy(dataframe['timestamp']), copy.deepcopy(dataframe['apiary_name'])]
-    headers_3d_1 = ['timestamp', 'apiary_name']
-    df_3d_1 =  pd.concat(data_3d_1, axis=1, keys=headers_3d_1)
-    logger.debug(f'df_3d_1: {df_3d_1}')
-
-    # add internal temperate column and data - repeat for each bin per timestamp index
-    logger.info('build second part of 3d data... for every timestamp, repeat the current rows 64 fft bins...')
-    df_3d_2 = df_3d_1.loc[df_3d_1.index.repeat(len(bins))].assign(internal_temp=internal_temps).reset_index(drop=True)
-    #df_3d_2 = copy.deepcopy(df_3d_1.loc[df_3d_1.index.repeat(len(bins))].assign(internal_temp=internal_temps).reset_index(drop=True))
-    #df_3d_2 = df_3d_1.loc[df_3d_1.index.repeat(len(bins))].assign(internal_temp=internal_temps).reset_index(drop=True)
-    logger.debug(f'df_3d_2: {df_3d_2}')
-
-    # build lists for converting to dataframe
-    logger.info('prepare lists of fftbins and amplitudes for converting to 3d dataframe...')
-    amp_list = []
-    bin_list = []
-    for i in fft_amplitudes:
-        n = 0
-        for j in i:
-            amp_list.append(j)
-            bin_list.append(bins[n])
-            n += 1
-
-    logger.debug(f'amp_list: {amp_list}')
-    logger.debug(f'bin_list: {bin_list}')
-
-    # convert each list to dataframe
-    logger.info('convert new amplitude list to dataframe')
-    df_fft_amplitude = pd.DataFrame(amp_list, columns=['fft_amplitude'])
-
-    logger.info('convert new fft bins list to dataframe')
-    df_fft_band = pd.DataFrame(bin_list, columns=['fft_band'])
-
-    # final 3d dataframe data
-    logger.info('build final 3d dataframe using timestamp, apiary_name, internaltemp, fftammplitude, fftband')
+    logger.debug('fft bins: %s', bins)
+
+    n_rows = len(dataframe.index)
+    n_bins = len(bins)
+
+    # flatten fft amplitude block - (rows, bins) -> (rows * bins,)
+    logger.info('flatten fft bin amplitude values...')
+    fft_amplitudes = dataframe[bins].to_numpy().ravel()
 
-    logger.info('define 3d dataframe data')
-    data_3d = [df_3d_2['timestamp'],
-               df_3d_2['apiary_name'],
-               df_3d_2['internal_temp'],
-               df_fft_amplitude['fft_amplitude'],
-               df_fft_band['fft_band']]
+    # fft band names as a categorical - int8 bin index codes, tiled for every row
+    logger.info('build fft band categorical...')
+    fft_bands = pd.Categorical.from_codes(np.tile(np.arange(n_bins, dtype=np.int8), n_rows), categories=bins)
 
-    # final 3d dataframe headers
-    logger.info('define 3d dataframe headers')
-    headers_3d = ['timestamp',
-                  'apiary_name',
-                  'internal_temperature',
-                  'fft_amplitude',
-                  'fft_band']
+    # apiary names stay categorical - only the codes are repeated
+    apiary_names = pd.Categorical(dataframe['apiary_name'])
+    apiary_names = pd.Categorical.from_codes(np.repeat(apiary_names.codes, n_bins), categories=apiary_names.categories)
 
-    # build 3d dataframe
-    logger.info('build final 3d dataframe')
-    dataframe_3d = pd.concat(data_3d, axis=1, keys=headers_3d)
+    # build 3d dataframe - repeat timestamp, apiary and internal temp for each bin per row
+    logger.info('build final 3d dataframe using timestamp, apiary_name, internaltemp, fftammplitude, fftband')
+    dataframe_3d = pd.DataFrame({
+        'timestamp': np.repeat(dataframe['timestamp'].to_numpy(), n_bins),
+        'apiary_name': apiary_names,
+        'internal_temperature': np.repeat(dataframe['bme680_internal_temperature'].to_numpy(), n_bins),
+        'fft_amplitude': fft_amplitudes,
+        'fft_band': fft_bands})
 
-    logger.debug(f'final 3d dataframe: {dataframe_3d.head()}')
+    logger.debug('final 3d dataframe: %s', dataframe_3d.head())
 
     return dataframe_3d
 
 
+def build_spectrogram_data(dataframe, n_buckets=hc.APP_SPECTROGRAM_WIDTH):
+    logger.info('building dataframe for fft spectrogram charts...')
+    ## --------------------------------
+    ## build time x bin matrix for the spectrogram charts
+    ## takes hivekeepers dataframe (ordered by timestamp) with its fft_bin columns
+    ## returns a wide dataframe - timestamp, internal_temperature and the fft_bin
+    ## columns - holding at most n_buckets rows, no long-format explosion
+    ##
+    ## longer selections are averaged into n_buckets equal time buckets, empty
+    ## buckets are kept as NaN rows so gaps in the data show as gaps in the chart
+    ## --------------------------------
+    bins = get_fft_bins(dataframe)
+    logger.debug('fft bins: %s', bins)
+
+    columns = ['bme680_internal_temperature'] + bins
+    values = dataframe[columns].to_numpy(dtype=np.float32)
+    timestamps = dataframe['timestamp'].to_numpy()
+
+    if len(timestamps) > n_buckets > 0:
+        logger.info('bucketing %s rows into %s time buckets', len(timestamps), n_buckets)
+
+        # equal width time buckets over the selection
+        times = timestamps.astype(np.int64)
+        edges = np.linspace(times[0], times[-1], n_buckets + 1)
+        bucket = np.clip(np.searchsorted(edges, times, side='right') - 1, 0, n_buckets - 1)
+
+        # rows are ordered, so each bucket is a contiguous run - sum each run, skipping NaN
+        starts = np.flatnonzero(np.diff(bucket, prepend=-1))
+        finite = np.isfinite(values)
+        sums = np.add.reduceat(np.where(finite, values, 0), starts, axis=0)
+        counts = np.add.reduceat(finite, starts, axis=0)
+
+        means = np.full((n_buckets, len(columns)), np.nan, dtype=np.float32)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means[bucket[starts]] = sums / counts
+
+        values = means
+        timestamps = (edges[:-1] + np.diff(edges) / 2).astype(np.int64).astype('datetime64[ns]')
+
+    spectrogram = pd.DataFrame(values[:, 1:], columns=bins)
+    spectrogram.insert(0, 'timestamp', timestamps)
+    spectrogram.insert(1, 'internal_temperature', values[:, 0])
+
+    logger.debug('spectrogram dataframe: %s', spectrogram.head())
+
+    return spectrogram
+
+
 def get_uniques_in_column(dataframe, column):
     logger.info('building list of unique values from a dataframe column')
     unique_list = []
@@ -220,16 +545,16 @@ def get_uniques_in_column(dataframe, column):
         if item not in unique_list:
             unique_list.append(item)
 
-    logger.debug(f'unique list: {unique_list}')
+    logger.debug('unique list: %s', unique_list)
 
     return unique_list
 
 
 def get_bin_range(bin_group, fft_bins):
     logger.info('setting the fft_bin range from user selection')
-    logger.debug(f'fft bin_group: {bin_group}')
-    logger.debug(f'fft fft_bins: {fft_bins}')
-    logger.debug(f'fft fft_bins length: {len(fft_bins)}')
+    logger.debug('fft bin_group: %s', bin_group)
+    logger.debug('fft fft_bins: %s', fft_bins)
+    logger.debug('fft fft_bins length: %s', len(fft_bins))
     ## takes int value representing a selected grouping
     ## returns list of selected fft_bin names
     if bin_group == 1:
@@ -244,14 +569,237 @@ def get_bin_range(bin_group, fft_bins):
         return fft_bins
 
 
+def get_bin_columns(bin_group):
+    logger.info('getting the fft_bin column names for user selection')
+    ## takes int value representing a selected grouping
+    ## returns list of SQLite fft_bin column names to query for that group
+    return get_bin_range(bin_group, hc.SQLite_fft_bins)
+
+
 def get_fft_bins(dataframe):
     logger.info('building list of fft_bin column headers from dataframe')
     fft_bins = [col for col in dataframe if col.startswith('fft_bin')]
-    logger.debug(f'fft_bins list: {fft_bins}')
+    logger.debug('fft_bins list: %s', fft_bins)
 
     return fft_bins
 
 
+def get_bin_numbers(fft_bins):
+    ## takes list of fft_bin column names
+    ## returns their bin numbers - eg. ['fft_bin16', 'fft_bin17'] to [16, 17]
+    return [int(fft_bin[len('fft_bin'):]) for fft_bin in fft_bins]
+
+
+def get_band_numbers(fft_bands):
+    ## takes categorical fft_band series (see build_3d_data)
+    ## returns the bin number of every row as an int8 array - sent to the
+    ## browser in place of the repeated bin name strings
+    bin_numbers = np.array(get_bin_numbers(fft_bands.cat.categories), dtype=np.int8)
+
+    return bin_numbers[fft_bands.cat.codes.to_numpy()]
+
+
+def get_memory_usage(dataframe):
+    ## takes dataframe
+    ## returns series of bytes used per column (index included), counting the
+    ## python objects behind object columns
+    return dataframe.memory_usage(deep=True)
+
+
+def log_memory_usage(name, dataframe):
+    ## logs the memory used by a dataframe - total at info, per column at debug
+    ## skipped when info logging is off, deep memory usage walks object columns
+    if not logger.isEnabledFor(logging.INFO):
+        return
+
+    memory_usage = get_memory_usage(dataframe)
+    logger.info('%s memory: %.2f MB for %s rows', name, memory_usage.sum() / 1e6, len(dataframe.index))
+    logger.debug('%s memory by column: %s', name, memory_usage.to_dict())
+
+
+def get_plot_values(values):
+    ## takes series/array of chart values
+    ## returns float32 values widened to float64 at the fewest decimals that round trip,
+    ## so the figure json carries 34.12 rather than 34.119998931884766 - values with no
+    ## short decimal form are widened as is, other dtypes are returned unchanged
+    ##
+    ## orjson already writes float32 at its shortest decimal, so with it installed
+    ## float32 values are returned unchanged too
+    values = np.asarray(values)
+
+    if values.dtype != np.float32 or orjson is not None:
+        return values
+
+    widened = values.astype(np.float64)
+
+    # find the decimals on a sample, then check them against every value
+    sample_size = 1000
+    for decimals in range(7):
+        if np.array_equal(np.round(widened[:sample_size], decimals).astype(np.float32), values[:sample_size], equal_nan=True):
+            rounded = np.round(widened, decimals)
+            if np.array_equal(rounded.astype(np.float32), values, equal_nan=True):
+                return rounded
+            break
+
+    return widened
+
+
+def get_plot_times(values):
+    ## takes series/array of chart timestamps
+    ## returns datetime64 values as epoch milliseconds - a date axis reads them the
+    ## same as ISO date strings, at about half the json size; other dtypes are
+    ## returned unchanged
+    values = np.asarray(values)
+
+    if not np.issubdtype(values.dtype, np.datetime64):
+        return values
+
+    return values.astype('datetime64[ms]').astype(np.int64)
+
+
+def lttb_indices(x, y, n_out):
+    ## --------------------------------
+    ## Largest-Triangle-Three-Buckets downsampling
+    ## takes numpy arrays x, y (x ascending) and a target point count
+    ## returns the sorted indices of the points to keep - always keeps the
+    ## first and last point, plus the point in each middle bucket forming the
+    ## largest triangle with the previously kept point and the next bucket average
+    ## --------------------------------
+    n = len(x)
+
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # n_out - 2 buckets spanning points 1 .. n - 2
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # average point of the next bucket - the last point for the final bucket
+        if i < n_out - 3:
+            next_start, next_end = edges[i + 1], edges[i + 2]
+            avg_x = x[next_start:next_end].mean()
+            avg_y = y[next_start:next_end].mean()
+        else:
+            avg_x = x[-1]
+            avg_y = y[-1]
+
+        # (doubled) triangle area for every point in the current bucket
+        bucket_x = x[start:end]
+        bucket_y = y[start:end]
+        area = np.abs((x[a] - avg_x) * (bucket_y - y[a]) - (x[a] - bucket_x) * (avg_y - y[a]))
+
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+
+    return indices
+
+
+def minmax_indices(y, n_out):
+    ## --------------------------------
+    ## min/max per bucket downsampling
+    ## takes numpy array y and a target point count
+    ## returns the sorted indices of the min and max point of n_out / 2 equal
+    ## sized buckets - keeps every peak and trough of the raw series
+    ## --------------------------------
+    n = len(y)
+
+    if n_out >= n or n_out < 2:
+        return np.arange(n)
+
+    n_buckets = n_out // 2
+
+    # bucket id for every point - ascending, so each bucket is a contiguous run
+    bucket = (np.arange(n) * n_buckets) // n
+
+    # sort by bucket, then by value - first/last of each run is the bucket min/max
+    order = np.lexsort((y, bucket))
+    ends = np.cumsum(np.bincount(bucket, minlength=n_buckets))
+    starts = ends - np.bincount(bucket, minlength=n_buckets)
+
+    return np.unique(np.concatenate([order[starts], order[ends - 1]]))
+
+
+def downsample_indices(x, y, n_out, mode):
+    ## takes numpy arrays x, y, a target point count and a mode: lttb, minmax, none
+    ## returns sorted indices of the points to keep - non-finite y values are dropped
+    valid = np.flatnonzero(np.isfinite(y))
+
+    if mode == 'none' or len(valid) <= n_out:
+        return valid
+
+    if mode == 'minmax':
+        return valid[minmax_indices(y[valid], n_out)]
+
+    # lttb - work on x relative to the first point to keep float precision
+    x_valid = x[valid].astype(np.float64)
+    return valid[lttb_indices(x_valid - x_valid[0], y[valid], n_out)]
+
+
+def downsample_2d(dataframe, x_column, y_column, x_range=None, n_out=hc.APP_MAX_POINTS, mode=hc.APP_DOWNSAMPLE_MODE):
+    logger.info('downsampling %s to %s points using mode: %s', y_column, n_out, mode)
+    ## --------------------------------
+    ## downsample one 2d chart trace to a point budget
+    ## takes dataframe, x column (timestamp), y column, optional (start, end) x_range
+    ## returns dataframe of x_column, y_column holding at most ~n_out points
+    ##
+    ## with an x_range (zoomed window) the full budget is spent inside the window,
+    ## while a coarse overview (a quarter of the budget) is kept either side so
+    ## the rangeslider and zoom out still show the whole selection
+    ## --------------------------------
+    x = dataframe[x_column].to_numpy()
+    x_values = x.astype(np.int64) if np.issubdtype(x.dtype, np.datetime64) else x
+    y = dataframe[y_column].to_numpy(dtype=np.float64)
+
+    if x_range is None:
+        keep = downsample_indices(x_values, y, n_out, mode)
+    else:
+        window_start, window_end = np.searchsorted(x, [np.datetime64(x_range[0]), np.datetime64(x_range[1])])
+
+        segments = []
+        for start, end, budget in [(0, window_start, n_out // 4),
+                                   (window_start, window_end, n_out),
+                                   (window_end, len(x), n_out // 4)]:
+            segments.append(start + downsample_indices(x_values[start:end], y[start:end], budget, mode))
+
+        keep = np.concatenate(segments)
+
+    logger.debug('downsampled %s from %s to %s points', y_column, len(x), len(keep))
+
+    return dataframe[[x_column, y_column]].iloc[keep]
+
+
+def get_relayout_xrange(relayout_data):
+    logger.info('getting x-axis range from chart relayout data')
+    logger.debug('relayout_data: %s', relayout_data)
+    ## takes a dcc.Graph relayoutData dict
+    ## returns (start, end) pd.Timestamps for a zoom/rangeslider event,
+    ##         'reset' for an x-axis autorange (double click / all button) event,
+    ##         None for any other event (autosize, legend clicks, y-axis zoom, etc.)
+    if not relayout_data:
+        return None
+
+    if relayout_data.get('xaxis.autorange'):
+        return 'reset'
+
+    # rangeslider events send a list, zoom/pan events send range[0], range[1]
+    if 'xaxis.range' in relayout_data:
+        x_start, x_end = relayout_data['xaxis.range']
+    elif 'xaxis.range[0]' in relayout_data and 'xaxis.range[1]' in relayout_data:
+        x_start = relayout_data['xaxis.range[0]']
+        x_end = relayout_data['xaxis.range[1]']
+    else:
+        return None
+
+    return pd.Timestamp(x_start), pd.Timestamp(x_end)
+
+
 def get_2d_xrangeslider():
     logger.info('getting 2d chart rangeslider')
     hr = dict(count=1,
@@ -294,4 +842,510 @@ def get_2d_xrangeslider():
     buttons_list = list([hr, day, week, month, half_yr, ytd, year, all]) 
 
     return dict(buttons=buttons_list)
-    
\ No newline at end of file
+    
+
+## ===================
+## DB helper functions
+## ===================
+
+# text format of timestamps stored in SQLite - used for text query bounds
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+# distinct apiary names as a recursive skip-scan - each step is a single seek of the
+# (apiary_name, timestamp) index for the next name, instead of a scan of every row
+APIARY_NAMES_QUERY = (f'WITH RECURSIVE apiary_names(apiary_name) AS ('
+                      f'SELECT MIN(apiary_name) FROM {hc.SQLite_2d_table_name} '
+                      f'UNION ALL SELECT (SELECT MIN(apiary_name) FROM {hc.SQLite_2d_table_name} '
+                      f'WHERE apiary_name > apiary_names.apiary_name) '
+                      f'FROM apiary_names WHERE apiary_name IS NOT NULL) '
+                      f'SELECT apiary_name FROM apiary_names WHERE apiary_name IS NOT NULL')
+
+
+def remove_duplicate_ids(conn):
+    ## takes open SQLite connection (caller manages the transaction)
+    ## deletes all but the first stored row (MIN(rowid)) of each id - the old update
+    ## script appended rows again when the remote ids had gaps
+    ## returns number of rows removed
+    query = (f'DELETE FROM {hc.SQLite_2d_table_name} WHERE rowid NOT IN '
+             f'(SELECT MIN(rowid) FROM {hc.SQLite_2d_table_name} GROUP BY id)')
+    logger.debug('SQLite remove duplicate ids query: %s', query)
+
+    return conn.execute(db.text(query)).rowcount
+
+
+def create_indexes(conn):
+    logger.info('creating indexes on local SQLite server if missing')
+    ## takes open SQLite connection (caller manages the transaction)
+    ## builds the (apiary_name, timestamp) index used by every dashboard query,
+    ## and a unique index on id used by the update scripts
+    ## a database from before the id index is deduplicated first (see remove_duplicate_ids)
+    ## returns number of duplicate rows removed
+    unique_index_name = f'ux_{hc.SQLite_2d_table_name}_id'
+    has_unique_index = conn.execute(db.text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :name"),
+                                    {'name': unique_index_name}).first() is not None
+
+    duplicates_removed = 0 if has_unique_index else remove_duplicate_ids(conn)
+
+    if duplicates_removed:
+        logger.warning('removed %s duplicate id rows from %s before indexing id', duplicates_removed, hc.SQLite_2d_table_name)
+
+    queries = [f'CREATE INDEX IF NOT EXISTS ix_{hc.SQLite_2d_table_name}_apiary_name_timestamp '
+               f'ON {hc.SQLite_2d_table_name} (apiary_name, timestamp)',
+               f'CREATE UNIQUE INDEX IF NOT EXISTS {unique_index_name} '
+               f'ON {hc.SQLite_2d_table_name} (id)']
+
+    for query in queries:
+        logger.debug('SQLite create index query: %s', query)
+        conn.execute(db.text(query))
+
+    return duplicates_removed
+
+# strftime bucket formats for each rollup table - matches the raw timestamp text format
+ROLLUP_BUCKET_FORMATS = {hc.SQLite_hourly_table_name: '%Y-%m-%d %H:00:00.000000',
+                         hc.SQLite_daily_table_name: '%Y-%m-%d 00:00:00.000000'}
+
+# raw and hourly row counts of a selection, from the hourly rollup (see get_data_table_name)
+ROLLUP_COUNT_QUERY = (f'SELECT SUM(row_count), COUNT(*) FROM {hc.SQLite_hourly_table_name} '
+                      'WHERE apiary_name = :apiary_name AND timestamp >= :range_start AND timestamp < :range_end')
+
+# per apiary metadata (see update_apiary_metadata) - first/last timestamps are single
+# seeks of the (apiary_name, timestamp) index, row counts come from the daily rollup
+APIARY_METADATA_QUERY = (f'SELECT d.apiary_name, '
+                         f'(SELECT MIN(timestamp) FROM {hc.SQLite_2d_table_name} WHERE apiary_name = d.apiary_name), '
+                         f'(SELECT MAX(timestamp) FROM {hc.SQLite_2d_table_name} WHERE apiary_name = d.apiary_name), '
+                         f'SUM(d.row_count) FROM {hc.SQLite_daily_table_name} d GROUP BY d.apiary_name')
+APIARY_DAYS_QUERY = f'SELECT apiary_name, timestamp FROM {hc.SQLite_daily_table_name} ORDER BY apiary_name, timestamp'
+
+
+def get_rollup_columns():
+    ## returns the rollup table column names - stat columns keep their raw name for the mean
+    columns = ['apiary_name', 'timestamp', 'row_count']
+
+    for column in hc.SQLite_rollup_stat_columns:
+        columns += [column, f'{column}_min', f'{column}_max']
+
+    return columns + hc.SQLite_fft_bins
+
+
+def create_derived_tables(conn):
+    logger.info('creating rollup, metadata and sync state tables on local SQLite server if missing')
+    ## takes open SQLite connection
+    ## returns list of the table names that had to be created - if any, the caller
+    ## should rebuild them all with update_derived_tables(conn)
+    existing_tables = db.inspect(conn).get_table_names()
+    created_tables = []
+
+    other_tables = {hc.SQLite_metadata_table_name: (f'CREATE TABLE {hc.SQLite_metadata_table_name} '
+                                                    '(apiary_name TEXT PRIMARY KEY, first_timestamp DATETIME, '
+                                                    'last_timestamp DATETIME, row_count INTEGER, days TEXT)'),
+                    hc.SQLite_sync_state_table_name: (f'CREATE TABLE {hc.SQLite_sync_state_table_name} '
+                                                      '(key TEXT PRIMARY KEY, value TEXT)')}
+
+    for table_name, query in other_tables.items():
+        if table_name not in existing_tables:
+            logger.debug('SQLite create table query: %s', query)
+            conn.execute(db.text(query))
+            created_tables.append(table_name)
+
+    for table_name in ROLLUP_BUCKET_FORMATS:
+        if table_name in existing_tables:
+            continue
+
+        value_columns = [f'{column} REAL' for column in get_rollup_columns()[3:]]
+        query = (f'CREATE TABLE {table_name} (apiary_name TEXT NOT NULL, timestamp DATETIME NOT NULL, '
+                 f'row_count INTEGER, {", ".join(value_columns)}, PRIMARY KEY (apiary_name, timestamp))')
+        logger.debug('SQLite create rollup query: %s', query)
+
+        conn.execute(db.text(query))
+        created_tables.append(table_name)
+
+    logger.debug('created tables: %s', created_tables)
+
+    return created_tables
+
+
+def get_rollup_queries(table_name):
+    ## takes a rollup table name (a ROLLUP_BUCKET_FORMATS key)
+    ## returns its (delete, insert) queries - both take a :since timestamp string, '' for all rows
+    bucket_format = ROLLUP_BUCKET_FORMATS[table_name]
+
+    aggregates = ['COUNT(*)']
+    for column in hc.SQLite_rollup_stat_columns:
+        aggregates += [f'AVG({column})', f'MIN({column})', f'MAX({column})']
+    aggregates += [f'AVG({column})' for column in hc.SQLite_fft_bins]
+
+    delete_query = f'DELETE FROM {table_name} WHERE timestamp >= :since'
+    # apiary_name IN (...) lets SQLite seek the (apiary_name, timestamp) index per apiary
+    insert_query = (f'INSERT INTO {table_name} ({", ".join(get_rollup_columns())}) '
+                    f"SELECT apiary_name, strftime('{bucket_format}', timestamp) AS bucket, {', '.join(aggregates)} "
+                    f'FROM {hc.SQLite_2d_table_name} WHERE apiary_name IN ({APIARY_NAMES_QUERY}) '
+                    f'AND timestamp >= :since GROUP BY apiary_name, bucket')
+
+    return delete_query, insert_query
+
+
+def update_rollup_tables(conn, since=None):
+    logger.info('updating rollup tables on local SQLite server')
+    ## takes open SQLite connection (caller manages the transaction) and optional since timestamp
+    ##   since: earliest timestamp of newly appended raw rows - every hourly/daily bucket from
+    ##          the start of that day is re-aggregated from the raw table
+    ##          None rebuilds the rollup tables from all raw rows
+    if since is None:
+        since_string = ''
+    else:
+        since_string = pd.Timestamp(since).strftime('%Y-%m-%d 00:00:00.000000')
+    logger.debug('rollup since: %s', since_string)
+
+    for table_name in ROLLUP_BUCKET_FORMATS:
+        delete_query, insert_query = get_rollup_queries(table_name)
+        logger.debug('SQLite rollup queries: %s; %s', delete_query, insert_query)
+
+        conn.execute(db.text(delete_query), {'since': since_string})
+        conn.execute(db.text(insert_query), {'since': since_string})
+
+    logger.info('rollup tables updated')
+
+
+def update_apiary_metadata(conn):
+    logger.info('updating apiary metadata table on local SQLite server')
+    ## takes open SQLite connection (caller manages the transaction)
+    ## rebuilds the per apiary metadata from the daily rollup table - first/last
+    ## timestamps are single seeks of the (apiary_name, timestamp) index
+    # days with data per apiary, as 'YYYY-MM-DD' strings
+    apiary_days = {}
+    for apiary_name, day in conn.execute(db.text(APIARY_DAYS_QUERY)):
+        apiary_days.setdefault(apiary_name, []).append(str(day)[:10])
+
+    rows = [{'apiary_name': row[0], 'first_timestamp': row[1], 'last_timestamp': row[2],
+             'row_count': row[3], 'days': json.dumps(apiary_days.get(row[0], []))}
+            for row in conn.execute(db.text(APIARY_METADATA_QUERY))]
+    logger.debug('apiary metadata rows: %s', len(rows))
+
+    conn.execute(db.text(f'DELETE FROM {hc.SQLite_metadata_table_name}'))
+
+    if rows:
+        conn.execute(db.text(f'INSERT INTO {hc.SQLite_metadata_table_name} '
+                             '(apiary_name, first_timestamp, last_timestamp, row_count, days) '
+                             'VALUES (:apiary_name, :first_timestamp, :last_timestamp, :row_count, :days)'), rows)
+
+
+def update_derived_tables(conn, since=None):
+    logger.info('updating derived tables on local SQLite server')
+    ## takes open SQLite connection (caller manages the transaction) and optional since timestamp
+    ## refreshes the rollup tables (from since, see update_rollup_tables), the apiary
+    ## metadata table, then bumps the database version so app caches reload
+    update_rollup_tables(conn, since)
+    update_apiary_metadata(conn)
+
+    conn.execute(db.text(f"INSERT INTO {hc.SQLite_sync_state_table_name} (key, value) VALUES ('db_version', 1) "
+                         'ON CONFLICT(key) DO UPDATE SET value = value + 1'))
+
+    logger.info('derived tables updated')
+
+
+def get_sync_state(conn, key, default=None):
+    ## takes open SQLite connection and a sync state key
+    ## returns the stored value as text, or default if the key is not set
+    row = conn.execute(db.text(f'SELECT value FROM {hc.SQLite_sync_state_table_name} WHERE key = :key'),
+                       {'key': key}).fetchone()
+
+    return row[0] if row else default
+
+
+def set_sync_state(conn, key, value):
+    ## takes open SQLite connection (caller manages the transaction), a sync state key and value
+    ## inserts or replaces the value - eg. the last synced id checkpoint
+    conn.execute(db.text(f'INSERT INTO {hc.SQLite_sync_state_table_name} (key, value) VALUES (:key, :value) '
+                         'ON CONFLICT(key) DO UPDATE SET value = excluded.value'),
+                 {'key': key, 'value': str(value)})
+
+
+def get_high_water_mark(conn):
+    ## takes open SQLite connection (caller manages the transaction)
+    ## returns the highest remote id synced to the local database - updates fetch only rows above it
+    ## if not yet recorded (eg. database built before it existed) it is set from the local MAX(id),
+    ## a seek of the unique id index
+    high_water_mark = get_sync_state(conn, 'last_synced_id')
+
+    if high_water_mark is None:
+        high_water_mark = conn.execute(db.text(f'SELECT MAX(id) FROM {hc.SQLite_2d_table_name}')).scalar() or 0
+        logger.info('initialising high water mark from local max id: %s', high_water_mark)
+        set_sync_state(conn, 'last_synced_id', int(high_water_mark))
+
+    return int(high_water_mark)
+
+
+def set_high_water_mark(conn, last_synced_id=None):
+    ## takes open SQLite connection (caller manages the transaction) and optional highest synced id
+    ## records the high water mark and the sync time (UTC) - last_synced_id None takes the local MAX(id)
+    if last_synced_id is None:
+        last_synced_id = conn.execute(db.text(f'SELECT MAX(id) FROM {hc.SQLite_2d_table_name}')).scalar() or 0
+
+    set_sync_state(conn, 'last_synced_id', int(last_synced_id))
+    set_sync_state(conn, 'last_sync_time', datetime.utcnow().strftime(TIMESTAMP_FORMAT))
+
+
+def create_data_table(conn):
+    logger.info('creating empty data table on local SQLite server')
+    ## takes open SQLite connection (caller manages the transaction)
+    ## drops and recreates the raw data table, without indexes - same schema
+    ## pandas to_sql builds from the cleaned data (columns + temp_delta)
+    value_columns = [f'{column} FLOAT' for column in hc.SQLite_default_columns[3:]]
+    query = (f'CREATE TABLE {hc.SQLite_2d_table_name} (id BIGINT, apiary_name TEXT, timestamp DATETIME, '
+             f'{", ".join(value_columns)}, temp_delta FLOAT)')
+    logger.debug('SQLite create table query: %s', query)
+
+    conn.execute(db.text(f'DROP TABLE IF EXISTS {hc.SQLite_2d_table_name}'))
+    conn.execute(db.text(query))
+
+
+def insert_data(conn, dataframe):
+    ## takes open SQLite connection (caller manages the transaction) and cleaned dataframe
+    ## bulk inserts the rows with a single prepared executemany - timestamps stored as
+    ## text in the same format as to_sql, NaN stored as NULL by SQLite
+    ## returns the number of rows inserted - 0 for an empty dataframe (eg. a bulk load
+    ## partition that falls in a gap in the remote ids)
+    if dataframe.empty:
+        return 0
+
+    columns = hc.SQLite_default_columns + ['temp_delta']
+    column_values = [dataframe[column].dt.strftime(TIMESTAMP_FORMAT).tolist() if column == 'timestamp'
+                     else dataframe[column].tolist() for column in columns]
+
+    query = f'INSERT INTO {hc.SQLite_2d_table_name} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
+    rows = list(zip(*column_values))
+
+    conn.exec_driver_sql(query, rows)
+
+    return len(rows)
+
+
+def get_id_partitions(min_id, max_id, partition_size):
+    ## returns list of inclusive (start_id, end_id) ranges covering min_id to max_id
+    return [(start_id, min(start_id + partition_size - 1, max_id))
+            for start_id in range(min_id, max_id + 1, partition_size)]
+
+
+def fetch_partition(source_engine, id_range):
+    ## takes remote db engine and an inclusive (start_id, end_id) range
+    ## returns the cleaned rows in that range - runs in a fetch worker thread,
+    ## each holding its own pooled connection
+    query = (f'select {", ".join(str(column) for column in hc.SQLite_default_columns)} from sync_data '
+             f'WHERE id BETWEEN :start_id AND :end_id ORDER BY id')
+
+    with source_engine.connect() as conn:
+        dataframe = pd.read_sql(db.text(query), conn, params={'start_id': id_range[0], 'end_id': id_range[1]})
+
+    return clean_data_db(dataframe)
+
+
+def insert_partition(sqlite_engine, future):
+    ## takes local SQLite engine and the future of a fetch_partition call
+    ## waits for the partition and inserts it - returns the number of rows inserted
+    ## the wait is timed as the mysql_fetch stage: fetch and clean time the writer
+    ## is not hiding behind its own inserts
+    with metrics.stage('mysql_fetch'):
+        dataframe = future.result()
+
+    with metrics.stage('sqlite_insert'), sqlite_engine.begin() as conn:
+        return insert_data(conn, dataframe)
+
+
+def bulk_load(source_engine, sqlite_engine, workers=None, partition_size=None, progress=None):
+    logger.info('bulk loading all remote data into local SQLite server')
+    ## takes remote db engine (MySQL, or any engine with a sync_data table) and local SQLite engine
+    ## the remote id range is split into partitions of partition_size ids, fetched by a pool of
+    ## workers, and written in id order by this (single writer) thread - at most 2 * workers
+    ## partitions are held in memory. The raw table is recreated without indexes, build them
+    ## (create_indexes) after the load
+    ## progress: optional function called with (rows_loaded, max_rows) after each partition
+    ## returns the number of rows loaded
+    workers = workers or hc.SYNC_WORKERS
+    partition_size = partition_size or hc.SYNC_CHUNK_SIZE
+
+    with source_engine.connect() as conn:
+        min_id, max_id = conn.execute(db.text('SELECT MIN(id), MAX(id) FROM sync_data')).fetchone()
+    logger.debug('remote id range: %s - %s', min_id, max_id)
+
+    with sqlite_engine.begin() as conn:
+        create_data_table(conn)
+
+    if min_id is None:
+        logger.info('no remote data to load')
+        return 0
+
+    id_partitions = get_id_partitions(int(min_id), int(max_id), partition_size)
+    logger.info('fetching %s partitions of %s ids with %s workers', len(id_partitions), partition_size, workers)
+
+    rows_loaded = 0
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for id_range in id_partitions:
+            pending.append(executor.submit(fetch_partition, source_engine, id_range))
+
+            # keep the fetch workers busy, but only a bounded number of partitions in memory
+            if len(pending) >= 2 * workers:
+                rows_loaded += insert_partition(sqlite_engine, pending.popleft())
+
+                if progress is not None:
+                    progress(rows_loaded, int(max_id) - int(min_id) + 1)
+
+        while pending:
+            rows_loaded += insert_partition(sqlite_engine, pending.popleft())
+
+            if progress is not None:
+                progress(rows_loaded, int(max_id) - int(min_id) + 1)
+
+    logger.info('bulk load complete: %s rows', rows_loaded)
+
+    return rows_loaded
+
+## =======================
+## Parquet storage helpers
+## =======================
+
+def load_pyarrow():
+    ## imports pyarrow on first use - returns False if it is not installed
+    global pa, ds, pq
+
+    if pq is None:
+        try:
+            import pyarrow as pa
+            import pyarrow.dataset as ds
+            import pyarrow.parquet as pq
+        except ImportError:
+            return False
+
+    return True
+
+
+def parquet_enabled():
+    ## True if raw data is kept in parquet files - STORAGE_BACKEND=parquet and pyarrow installed
+    if hc.STORAGE_BACKEND != 'parquet':
+        return False
+
+    if not load_pyarrow():
+        logger.warning('STORAGE_BACKEND is parquet but pyarrow is not installed, using SQLite')
+        return False
+
+    return True
+
+
+def get_parquet_columns():
+    ## returns the raw data columns stored in each parquet file
+    return hc.SQLite_default_columns + ['temp_delta']
+
+
+def get_parquet_path(apiary_name, month, parquet_dir=None):
+    ## takes apiary name and 'YYYY-MM' month
+    ## returns the parquet file path holding that apiary's rows for the month
+    return os.path.join(parquet_dir or hc.PARQUET_DIR, f'apiary_name={quote(apiary_name, safe="")}', f'{month}.parquet')
+
+
+def write_parquet_file(path, dataframe):
+    ## writes dataframe to path - to a temp file then renamed, so readers never see half of it
+    ## timestamps stored as microseconds, matching the timestamp filters in get_parquet_data
+    load_pyarrow()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    os.close(fd)
+
+    table = pa.Table.from_pandas(dataframe, preserve_index=False)
+    pq.write_table(table, tmp_path, row_group_size=hc.PARQUET_ROW_GROUP_SIZE,
+                   coerce_timestamps='us', allow_truncated_timestamps=True)
+    os.replace(tmp_path, path)
+
+
+def append_parquet_data(dataframe):
+    logger.info('appending new data to parquet files')
+    ## takes cleaned rows (any apiaries and months) - merges them into each apiary/month file,
+    ## de-duplicated on id (a re-synced chunk replaces its rows) and sorted by timestamp
+    load_pyarrow()
+    months = dataframe['timestamp'].dt.strftime('%Y-%m')
+
+    for (apiary_name, month), month_data in dataframe[get_parquet_columns()].groupby([dataframe['apiary_name'], months]):
+        path = get_parquet_path(apiary_name, month)
+
+        if os.path.exists(path):
+            month_data = pd.concat([pq.read_table(path).to_pandas(), month_data], ignore_index=True)
+
+        month_data = month_data.drop_duplicates('id', keep='last').sort_values(['timestamp', 'id'])
+        logger.debug('parquet file: %s, rows: %s', path, len(month_data.index))
+
+        write_parquet_file(path, month_data)
+
+
+def rebuild_parquet_data(conn):
+    logger.info('rebuilding parquet files from local SQLite server')
+    ## takes open SQLite connection
+    ## writes every apiary/month file from the raw table into a new directory, then swaps it
+    ## in - each month is one seek of the (apiary_name, timestamp) index
+    new_parquet_dir = f'{hc.PARQUET_DIR}.new'
+    shutil.rmtree(new_parquet_dir, ignore_errors=True)
+
+    months_query = (f"SELECT DISTINCT substr(timestamp, 1, 7) FROM {hc.SQLite_daily_table_name} "
+                    'WHERE apiary_name = :apiary_name ORDER BY 1')
+    data_query = (f'SELECT {", ".join(get_parquet_columns())} FROM {hc.SQLite_2d_table_name} '
+                  'WHERE apiary_name = :apiary_name AND timestamp >= :range_start AND timestamp < :range_end '
+                  'ORDER BY timestamp, id')
+
+    for (apiary_name,) in conn.execute(db.text(APIARY_NAMES_QUERY)).fetchall():
+        for (month,) in conn.execute(db.text(months_query), {'apiary_name': apiary_name}).fetchall():
+            range_start = datetime.strptime(month, '%Y-%m')
+            range_end = (range_start + timedelta(days=32)).replace(day=1)
+
+            month_data = pd.read_sql(db.text(data_query), conn, parse_dates=['timestamp'],
+                                     params={'apiary_name': apiary_name,
+                                             'range_start': range_start.strftime(TIMESTAMP_FORMAT),
+                                             'range_end': range_end.strftime(TIMESTAMP_FORMAT)})
+
+            write_parquet_file(get_parquet_path(apiary_name, month, new_parquet_dir), month_data)
+
+    os.makedirs(new_parquet_dir, exist_ok=True)
+
+    # swap the directories with two renames, removing the old files only after - deleting them
+    # first would leave readers in other workers with no files, and empty charts cached until
+    # the next database version
+    old_parquet_dir = f'{hc.PARQUET_DIR}.old'
+    shutil.rmtree(old_parquet_dir, ignore_errors=True)
+
+    if os.path.isdir(hc.PARQUET_DIR):
+        os.replace(hc.PARQUET_DIR, old_parquet_dir)
+
+    os.replace(new_parquet_dir, hc.PARQUET_DIR)
+    shutil.rmtree(old_parquet_dir, ignore_errors=True)
+
+    logger.info('parquet files rebuilt')
+
+
+def get_parquet_data(apiary_name, start_date, end_date, columns=None):
+    logger.info('getting data for apiary between start_date, end_date from parquet files')
+    ## takes the same arguments as get_data() (raw data only)
+    ## reads only the month files overlapping the range, only the requested columns, and
+    ## only the row groups whose timestamp statistics overlap the range (predicate pushdown)
+    load_pyarrow()
+    range_start, range_end = get_timestamp_range(start_date, end_date)
+
+    months = pd.period_range(range_start, range_end - timedelta(microseconds=1), freq='M').strftime('%Y-%m')
+    paths = [path for path in (get_parquet_path(apiary_name, month) for month in months) if os.path.exists(path)]
+    logger.debug('parquet files: %s', paths)
+
+    if not paths:
+        return pd.DataFrame()
+
+    available_columns = get_parquet_columns()
+    selected = available_columns if columns is None else [column for column in columns if column in available_columns]
+
+    timestamp = ds.field('timestamp')
+    range_filter = ((timestamp >= pa.scalar(range_start, type=pa.timestamp('us'))) &
+                    (timestamp < pa.scalar(range_end, type=pa.timestamp('us'))))
+
+    table = ds.dataset(paths, format='parquet').to_table(columns=selected, filter=range_filter)
+    apiary_data_df = apply_column_dtypes(table.to_pandas())
+
+    logger.debug('2d dataframe: %s', apiary_data_df.head())
+
+    return apiary_data_df
+
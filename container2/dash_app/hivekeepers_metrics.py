@@ -0,0 +1,439 @@
+# HiveKeepers - container2 - dash_app/hivekeepers_metrics.py
+# written by: Andrew McDonald
+# initial: 18/10/26
+# current: 18/10/26
+# version: 0.9
+
+## ==========================================================
+## stage timing metrics and slow request profiling
+##
+##   a job is one chart callback or database update (timed() decorator),
+##   a stage is one step inside it - sql fetch, dataframe build,
+##   build_3d_data, figure build, etc. (stage() context manager).
+##   durations go into per-(job, stage) histograms in this process
+##
+##   every process writes its histograms to a file in hc.METRICS_DIR
+##   (/dev/shm by default) after each job, so the /metrics route of any
+##   gunicorn worker can merge all workers - and the update scripts -
+##   into one Prometheus text page. Files are named by pid and process
+##   start time, so a new process reusing a pid never overwrites them.
+##   Each /metrics read folds the files of exited processes (recycled
+##   workers, finished update scripts) into merged.json, so the files -
+##   and the work of each read - don't grow with every restart
+##
+##   the job is exported as the `task` label - Prometheus sets `job` itself
+##   on every scraped series (and would rename ours to exported_job)
+##
+##   with APP_PROFILE set, jobs slower than APP_PROFILE_SLOW_SECONDS
+##   write a cProfile (.prof) or pyinstrument (.html) profile to hc.PROFILE_DIR
+## ==========================================================
+
+import os
+import json
+import time
+import fcntl
+import tempfile
+import threading
+import functools
+import contextlib
+from datetime import datetime
+
+import hivekeepers_config as hc
+
+# optional - only needed for APP_PROFILE=pyinstrument
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+import logging
+
+## =================
+## Configure Logging
+## =================
+
+logger = logging.getLogger()
+
+if hc.APP_PROFILE == 'pyinstrument' and pyinstrument is None:
+    logger.warning('APP_PROFILE=pyinstrument but pyinstrument is not installed - profiling with cProfile')
+
+## ======================
+## in-process histograms
+## ======================
+
+# histogram bucket upper bounds in seconds - +Inf is implied
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# (metric name, job, stage) -> {'buckets': [count per bucket], 'sum': seconds, 'count': observations}
+# updated from the native build threads of gevent workers too - a native lock, as
+# hivekeepers_executor.native_lock (not imported here, the executor imports this module)
+_histograms = {}
+
+try:
+    from gevent.monkey import get_original
+    _histograms_lock = get_original('threading', 'Lock')()
+except ImportError:
+    _histograms_lock = threading.Lock()
+
+# job running in this thread, and the request (if any) it runs in
+_local = threading.local()
+
+# name of this process' metrics file - set on first save in each process (see get_metrics_path)
+_metrics_path = None
+_metrics_path_pid = None
+
+# histograms of exited processes, in hc.METRICS_DIR (see load)
+MERGED_FILE_NAME = 'merged.json'
+
+
+def observe(metric, job, stage, seconds):
+    ## adds one duration to the (metric, job, stage) histogram
+    key = (metric, job, stage)
+
+    with _histograms_lock:
+        histogram = _histograms.get(key)
+
+        if histogram is None:
+            histogram = _histograms[key] = {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0}
+
+        for index, upper_bound in enumerate(BUCKETS):
+            if seconds <= upper_bound:
+                histogram['buckets'][index] += 1
+
+        histogram['sum'] += seconds
+        histogram['count'] += 1
+
+
+def get_job():
+    ## returns the job running in this thread - stages timed outside a job are recorded under 'other'
+    return getattr(_local, 'job', None) or 'other'
+
+
+def record_stage(stage, seconds):
+    observe('hivekeepers_stage_seconds', get_job(), stage, seconds)
+
+
+@contextlib.contextmanager
+def stage(name):
+    ## times the enclosed block as a stage of the current job
+    ##   eg. with metrics.stage('build_3d_data'): ...
+    start_time = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start_time)
+
+
+@contextlib.contextmanager
+def in_job(job):
+    ## records stages in the enclosed block against job - for work a job hands to another thread
+    ##   eg. with metrics.in_job(job): ... (see hivekeepers_executor.run)
+    outer_job = getattr(_local, 'job', None)
+    _local.job = job
+
+    try:
+        yield
+    finally:
+        _local.job = outer_job
+
+## ======================
+## jobs and profiling
+## ======================
+
+def start_profiler():
+    ## returns a started profiler for this thread, or None if profiling is off or unavailable
+    if hc.APP_PROFILE == 'off':
+        return None
+
+    try:
+        if hc.APP_PROFILE == 'pyinstrument' and pyinstrument is not None:
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+            return profiler
+
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+    except Exception as e:
+        # eg. a profile already running in another thread (python 3.12+)
+        logger.debug('profiler not started: %s', e)
+        return None
+
+
+def stop_profiler(profiler, job, seconds):
+    ## stops the profiler - writes its profile to hc.PROFILE_DIR if the job was slow
+    if pyinstrument is not None and isinstance(profiler, pyinstrument.Profiler):
+        profiler.stop()
+    else:
+        profiler.disable()
+
+    if seconds < hc.APP_PROFILE_SLOW_SECONDS:
+        return
+
+    try:
+        os.makedirs(hc.PROFILE_DIR, exist_ok=True)
+        name = f'{job}_{datetime.now().strftime("%Y%m%d_%H%M%S_%f")}_{os.getpid()}'
+
+        if pyinstrument is not None and isinstance(profiler, pyinstrument.Profiler):
+            path = os.path.join(hc.PROFILE_DIR, f'{name}.html')
+            with open(path, 'w') as profile_file:
+                profile_file.write(profiler.output_html())
+        else:
+            path = os.path.join(hc.PROFILE_DIR, f'{name}.prof')
+            profiler.dump_stats(path)
+    except Exception as e:
+        logger.warning('profile write exception: %s', e)
+        return
+
+    logger.warning('slow %s: %.2fs - profile written to %s', job, seconds, path)
+
+
+def timed(job):
+    ## decorator - times each call as a job (and profiles it with APP_PROFILE set)
+    ##   eg. @app.callback(...)
+    ##       @metrics.timed('render_2d_graphs')
+    ##       def render_2d_graphs(...): ...
+    ## nested jobs (eg. update() run by sync()) are timed, but only the outermost is profiled
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            outer_job = getattr(_local, 'job', None)
+            _local.job = job
+
+            profiler = start_profiler() if outer_job is None else None
+            start_time = time.perf_counter()
+
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start_time
+                _local.job = outer_job
+
+                if profiler is not None:
+                    stop_profiler(profiler, job, seconds)
+
+                observe('hivekeepers_job_seconds', job, None, seconds)
+
+                # callback time is taken off the request time by finish_request
+                if getattr(_local, 'request_start_time', None) is not None:
+                    _local.request_job = job
+                    _local.request_job_seconds = seconds
+                elif outer_job is None:
+                    save()
+
+        return wrapper
+
+    return decorator
+
+## ======================
+## callback requests
+## ======================
+
+def start_request():
+    ## called before each Dash callback request (app before_request hook)
+    _local.request_start_time = time.perf_counter()
+    _local.request_job = None
+    _local.request_job_seconds = 0.0
+
+
+def finish_request():
+    ## called after each Dash callback request (app after_request hook)
+    ## records the time outside the callback - Dash serializing the returned
+    ## figures to JSON, plus request parsing - as the job's json_serialization stage
+    start_time = getattr(_local, 'request_start_time', None)
+
+    if start_time is None:
+        return
+
+    _local.request_start_time = None
+
+    # clientside-only or prevented updates never ran a timed callback
+    if _local.request_job is None:
+        return
+
+    request_seconds = time.perf_counter() - start_time
+    observe('hivekeepers_stage_seconds', _local.request_job, 'json_serialization',
+            max(request_seconds - _local.request_job_seconds, 0.0))
+    observe('hivekeepers_request_seconds', _local.request_job, None, request_seconds)
+
+    save()
+
+## ======================
+## shared metrics files
+## ======================
+
+def get_metrics_path():
+    ## returns this process' metrics file path - {pid}_{start time}.json, made once per process
+    ## (not at import: with a preloaded app every worker would inherit the master's)
+    global _metrics_path, _metrics_path_pid
+
+    if _metrics_path is None or _metrics_path_pid != os.getpid():
+        _metrics_path = os.path.join(hc.METRICS_DIR, f'{os.getpid()}_{time.time_ns()}.json')
+        _metrics_path_pid = os.getpid()
+
+    return _metrics_path
+
+
+def write_snapshot(path, histograms):
+    ## writes histograms (keyed as _histograms) to path - written to a temp file then renamed,
+    ## so readers never see half of it
+    data = json.dumps([[metric, job, stage, histogram] for (metric, job, stage), histogram in histograms.items()])
+
+    file_descriptor, temp_path = tempfile.mkstemp(dir=hc.METRICS_DIR, suffix='.tmp')
+    with os.fdopen(file_descriptor, 'w') as metrics_file:
+        metrics_file.write(data)
+    os.replace(temp_path, path)
+
+
+def save():
+    ## replaces this process' metrics file
+    with _histograms_lock:
+        histograms = {key: dict(histogram, buckets=list(histogram['buckets'])) for key, histogram in _histograms.items()}
+
+    try:
+        os.makedirs(hc.METRICS_DIR, exist_ok=True)
+        write_snapshot(get_metrics_path(), histograms)
+    except Exception as e:
+        logger.warning('metrics write exception: %s', e)
+
+
+def add_snapshot(merged, path):
+    ## adds the histograms in the metrics file at path to merged - a missing or half written file adds nothing
+    try:
+        with open(path) as metrics_file:
+            snapshot = json.load(metrics_file)
+    except (FileNotFoundError, ValueError):
+        return
+
+    for metric, job, stage, histogram in snapshot:
+        total = merged.setdefault((metric, job, stage), {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0})
+        total['buckets'] = [a + b for a, b in zip(total['buckets'], histogram['buckets'])]
+        total['sum'] += histogram['sum']
+        total['count'] += histogram['count']
+
+
+def process_exited(pid):
+    ## True if no process has this pid
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+
+    return False
+
+
+def fold_exited(paths):
+    ## takes the paths of the per process metrics files
+    ## folds the files of exited processes into merged.json and removes them
+    ## returns the paths still in use
+    # files are named {pid}_{start time}.json
+    exited = [path for path in paths if process_exited(int(os.path.basename(path).split('_')[0].split('.')[0]))]
+
+    if not exited:
+        return paths
+
+    merged_path = os.path.join(hc.METRICS_DIR, MERGED_FILE_NAME)
+    merged = {}
+    for path in [merged_path] + exited:
+        add_snapshot(merged, path)
+
+    write_snapshot(merged_path, merged)
+
+    for path in exited:
+        os.remove(path)
+
+    logger.debug('folded %s exited process metrics files into %s', len(exited), merged_path)
+
+    return [path for path in paths if path not in exited]
+
+
+def load():
+    ## returns the histograms of every process merged - keyed as _histograms
+    ## exited processes' histograms are kept (in merged.json), so totals only ever go up
+    merged = {}
+
+    try:
+        os.makedirs(hc.METRICS_DIR, exist_ok=True)
+        lock_file = open(os.path.join(hc.METRICS_DIR, '.lock'), 'w')
+    except OSError as e:
+        logger.warning('metrics read exception: %s', e)
+        return merged
+
+    # one reader at a time - a fold between another reader's file reads would count some histograms twice
+    with lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        paths = [entry.path for entry in os.scandir(hc.METRICS_DIR)
+                 if entry.name.endswith('.json') and entry.name != MERGED_FILE_NAME]
+
+        try:
+            paths = fold_exited(paths)
+        except Exception as e:
+            logger.warning('metrics fold exception: %s', e)
+
+        for path in [os.path.join(hc.METRICS_DIR, MERGED_FILE_NAME)] + paths:
+            add_snapshot(merged, path)
+
+    return merged
+
+## ======================
+## prometheus text format
+## ======================
+
+METRIC_HELP = {
+    'hivekeepers_job_seconds': 'chart callback and database update duration',
+    'hivekeepers_stage_seconds': 'duration of each stage of a chart callback or database update',
+    'hivekeepers_request_seconds': 'chart callback request duration, including json serialization',
+}
+
+
+def get_labels(job, stage, **extra):
+    labels = {'task': job}
+
+    if stage is not None:
+        labels['stage'] = stage
+
+    labels.update(extra)
+
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels.items()) + '}'
+
+
+def get_prometheus_text(gauges=None):
+    ## returns the merged histograms of every process in Prometheus text format (version 0.0.4)
+    ## gauges: optional dict of extra gauge name -> (help, value), eg. sync lag
+    histograms = load()
+    lines = []
+
+    for metric, help_text in METRIC_HELP.items():
+        keys = sorted(key for key in histograms if key[0] == metric)
+
+        if not keys:
+            continue
+
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} histogram')
+
+        for key in keys:
+            _, job, stage = key
+            histogram = histograms[key]
+
+            for upper_bound, count in zip(BUCKETS, histogram['buckets']):
+                lines.append(f'{metric}_bucket{get_labels(job, stage, le=upper_bound)} {count}')
+
+            lines.append(f'{metric}_bucket{get_labels(job, stage, le="+Inf")} {histogram["count"]}')
+            lines.append(f'{metric}_sum{get_labels(job, stage)} {histogram["sum"]:.6f}')
+            lines.append(f'{metric}_count{get_labels(job, stage)} {histogram["count"]}')
+
+    for name, (help_text, value) in (gauges or {}).items():
+        if value is None:
+            continue
+
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name} {float(value)}')
+
+    return '\n'.join(lines) + '\n'
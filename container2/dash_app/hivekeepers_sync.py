@@ -0,0 +1,498 @@
+# HiveKeepers - container2 - dash_app/hivekeepers_sync.py
+# written by: Andrew McDonald
+# initial: 18/10/26
+# current: 18/10/26
+# version: 0.9
+
+## ==========================================================
+## local database sync from the remote MySQL server
+##
+##   cold_start() builds the local database from scratch, update() appends
+##   rows above the high water mark - both return the status message shown
+##   in the dashboard. startup_update_db.py and update_db.py are thin
+##   wrappers around them
+##
+##   the app runs them with start_background_sync(): one sync at a time
+##   across every gunicorn worker (file lock), progress written to a shared
+##   status file the dashboard polls with get_sync_status()
+##
+##   with SYNC_INTERVAL set, start_scheduler() also runs update() every
+##   interval (with jitter, backing off on failures) in one worker only,
+##   recording the remote/local id lag in a shared metrics file
+##
+##   both syncs are timed, stage by stage, in hivekeepers_metrics
+## ==========================================================
+
+import os
+import json
+import time
+import fcntl
+import random
+import tempfile
+import threading
+from datetime import datetime
+
+import pandas as pd
+import sqlalchemy as db
+
+import hivekeepers_helpers as hp
+import hivekeepers_cache as cache
+import hivekeepers_metrics as metrics
+import hivekeepers_executor as executor
+import hivekeepers_config as hc
+
+import logging
+
+## =================
+## Configure Logging
+## =================
+
+logger = logging.getLogger()
+
+## ======================
+## remote MySQL db engine
+## ======================
+
+_mysql_engine = None
+_mysql_engine_pid = None
+_mysql_lock = threading.Lock()
+
+
+def get_mysql_engine():
+    ## returns the process-wide pooled MySQL engine - (re)built on first use in each process,
+    ## so repeat updates in the app reuse pooled connections
+    global _mysql_engine, _mysql_engine_pid
+
+    if _mysql_engine is not None and _mysql_engine_pid == os.getpid():
+        return _mysql_engine
+
+    with _mysql_lock:
+        if _mysql_engine is None or _mysql_engine_pid != os.getpid():
+            credentials = {
+                'username': hc.MYSQL_USER,
+                'password': hc.MYSQL_PASS ,
+                'host': hc.MYSQL_HOST,
+                'database': hc.MYSQL_DB,
+            }
+
+            if 'missing' in credentials.values():
+                logger.critical('missing MySQL database credentials')
+
+            logger.debug('remote MySQL credentials: %s', credentials)
+
+            # build database connection url
+            connect_url = db.engine.url.URL.create(
+                drivername='mysql+pymysql',
+                username=credentials['username'],
+                password=credentials['password'],
+                host=credentials['host'],
+                database=credentials['database'])
+
+            logger.debug('remote MySQL url: %s', connect_url)
+
+            # create MySQL db engine - set pool config
+            logger.info('connecting to remote MySQL server...')
+            _mysql_engine = db.create_engine(connect_url, pool_size=10, max_overflow=10, pool_recycle=3600, pool_pre_ping=True, echo=hc.SQL_VERBOSE)
+            _mysql_engine_pid = os.getpid()
+
+    return _mysql_engine
+
+## =====================
+## sync functions
+## =====================
+
+@metrics.timed('sync_cold_start')
+def cold_start(progress=None):
+    logger.info('building local SQLite database from remote MySQL database')
+    ## builds the local database from every remote row
+    ##   the remote id range is split into partitions fetched concurrently over the
+    ##   pooled MySQL engine, each cleaned (temp_delta column, human-readable timestamp)
+    ##   and bulk inserted by a single writer - see hp.bulk_load
+    ## progress: optional function called with (rows_done, max_rows) as rows are committed
+    ## returns status message
+    engine = get_mysql_engine()
+    sql_lite_engine = hp.get_sqlite_engine()
+
+    # fetch remote partitions in parallel, bulk insert into a fresh table - options: workers, partition size
+    logger.info('updating local SQLite server with response data from MySQL server')
+    load_start_time = time.perf_counter()
+    rows_loaded = hp.bulk_load(engine, sql_lite_engine, workers=hc.SYNC_WORKERS,
+                               partition_size=hc.SYNC_CHUNK_SIZE, progress=progress)
+    load_seconds = time.perf_counter() - load_start_time
+    logger.info('loaded %s rows in %.1fs (%.0f rows/sec)', rows_loaded, load_seconds, rows_loaded / max(load_seconds, 1e-6))
+
+    # build indexes, hourly/daily rollup and apiary metadata tables from the new data
+    #   - indexes are built once after the load, not maintained row by row during it
+    with metrics.stage('derived_tables'), sql_lite_engine.begin() as conn:
+        logger.info('building indexes, rollup, metadata tables and sync high water mark on local SQLite server')
+        hp.create_indexes(conn)
+        hp.create_derived_tables(conn)
+        hp.update_derived_tables(conn)
+        hp.set_high_water_mark(conn)
+
+    # columnar copy of the raw data for the charts
+    if hp.parquet_enabled():
+        with metrics.stage('parquet_write'), sql_lite_engine.connect() as conn:
+            hp.rebuild_parquet_data(conn)
+
+    # drop any chart results cached from a previous database
+    cache.clear()
+
+    return f'database has been created! Rows added: {rows_loaded}'
+
+
+@metrics.timed('sync_update')
+def update(progress=None):
+    logger.info('updating local SQLite database from remote MySQL database')
+    ## appends remote rows above the local high water mark
+    ##   rows are streamed in id order and committed in chunks, each chunk moving
+    ##   the high water mark - an interrupted update keeps every committed chunk
+    ## progress: optional function called with (rows_done, max_rows) as rows are committed
+    ## returns status message
+    engine = get_mysql_engine()
+    sql_lite_engine = hp.get_sqlite_engine()
+
+    # build local indexes and derived tables if missing - eg. database created before they existed
+    #   - a database from before the unique id index has its duplicate ids removed first,
+    #     and everything derived from the raw rows is rebuilt
+    with sql_lite_engine.begin() as conn:
+        duplicates_removed = hp.create_indexes(conn)
+        if hp.create_derived_tables(conn) or duplicates_removed:
+            logger.info('building rollup and metadata tables on local SQLite server')
+            hp.update_derived_tables(conn)
+
+    # build the columnar copy of the raw data if missing - eg. parquet backend just turned on
+    if hp.parquet_enabled() and (duplicates_removed or not os.path.isdir(hc.PARQUET_DIR)):
+        with sql_lite_engine.connect() as conn:
+            hp.rebuild_parquet_data(conn)
+
+    if duplicates_removed:
+        cache.clear()
+
+    # highest remote id already synced - initialised from the local MAX(id) on first use
+    with sql_lite_engine.begin() as conn:
+        logger.info('get high water mark of local SQLite database')
+        high_water_mark = hp.get_high_water_mark(conn)
+
+    # construct SQL query - a primary key seek, not a count of the table
+    query1 = 'SELECT MAX(id) FROM sync_data'
+    logger.debug('MySQL query1 = %s', query1)
+
+    with engine.connect() as conn:
+        logger.info('get max index of remote MySQL database')
+        remote_max_id = conn.execute(db.text(query1)).scalar() or 0
+
+    logger.debug('MySQL max id: %s, SQLite high water mark: %s', remote_max_id, high_water_mark)
+
+    if not (remote_max_id > high_water_mark):
+        logger.info('No update necessary as the remote max index is not above the local high water mark')
+
+        # record the sync time, even with nothing new
+        with sql_lite_engine.begin() as conn:
+            hp.set_high_water_mark(conn, high_water_mark)
+
+        return 'database is already up to date...'
+
+    logger.info('starting update...')
+
+    # upper bound of new rows - remote ids may have gaps
+    max_new_rows = remote_max_id - high_water_mark
+    logger.debug('max_new_rows: %s', max_new_rows)
+
+    # construct SQL query for database updates - ordered by id so each committed chunk is a checkpoint
+    query2 = f'select {", ".join(str(column) for column in hc.SQLite_default_columns)} from sync_data WHERE id > :high_water_mark ORDER BY id'
+    logger.debug('MySQL query2 = %s', query2)
+
+    rows_added = 0
+    sync_start_time = time.perf_counter()
+
+    # open db connection with a server-side cursor, read it in chunks - only one chunk is held in memory
+    try:
+        with engine.connect().execution_options(stream_results=True) as conn:
+            logger.info('streaming new data from remote MySQL database in chunks of %s rows', hc.SYNC_CHUNK_SIZE)
+
+            fetch_start_time = time.perf_counter()
+
+            for update_data in pd.read_sql(db.text(query2), conn, params={'high_water_mark': high_water_mark}, chunksize=hc.SYNC_CHUNK_SIZE):
+                metrics.record_stage('mysql_fetch', time.perf_counter() - fetch_start_time)
+
+                # clean update data:
+                #   1. add temp_delta column
+                #   2. convert timestamp to human-readable
+                with metrics.stage('clean_data_db'):
+                    update_data = hp.clean_data_db(update_data)
+
+                # append chunk, re-aggregate rollup buckets from its earliest timestamp and move
+                # the high water mark - all or nothing, an interrupted sync keeps every earlier chunk
+                # (parquet files are written before the commit, a chunk synced again replaces its rows)
+                with sql_lite_engine.begin() as sqlite_conn:
+                    with metrics.stage('sqlite_insert'):
+                        update_data.to_sql(hc.SQLite_2d_table_name, sqlite_conn, if_exists='append', index = False)
+
+                    with metrics.stage('derived_tables'):
+                        hp.update_derived_tables(sqlite_conn, since=update_data['timestamp'].min())
+                        hp.set_high_water_mark(sqlite_conn, int(update_data['id'].max()))
+
+                    if hp.parquet_enabled():
+                        with metrics.stage('parquet_write'):
+                            hp.append_parquet_data(update_data)
+
+                rows_added += len(update_data)
+                rows_per_second = rows_added / (time.perf_counter() - sync_start_time)
+                logger.info('sync checkpoint: %s/%s rows, high water mark %s, %.0f rows/sec', rows_added, max_new_rows, update_data["id"].max(), rows_per_second)
+
+                if progress is not None:
+                    progress(rows_added, max_new_rows)
+
+                fetch_start_time = time.perf_counter()
+    finally:
+        # drop chart results cached before the new rows arrived - including on a partial update
+        if rows_added:
+            cache.clear()
+
+    sync_seconds = time.perf_counter() - sync_start_time
+    logger.info('synced %s rows in %.1fs', rows_added, sync_seconds)
+    logger.info('database update completed.')
+
+    return f'database has been updated! New rows added: {rows_added} ({rows_added / max(sync_seconds, 1e-6):.0f} rows/sec)'
+
+
+def sync(progress=None):
+    ## cold start if the local database has no data table (new, empty or never finished
+    ## building), otherwise update
+    ## returns status message
+    if not hp.has_data_table():
+        logger.debug('local database has no data table - building from scratch')
+        return cold_start(progress)
+
+    return update(progress)
+
+## ========================
+## single-flight sync runner
+## ========================
+
+_sync_thread = None
+_sync_thread_lock = threading.Lock()
+
+
+def acquire_sync_lock(blocking=True, lock_path=None):
+    ## takes the cross-process sync lock (or the lock at lock_path) - returns the open lock
+    ## file (release_sync_lock when done), or None if not blocking and another process holds it
+    lock_file = open(lock_path or hc.SYNC_LOCK_FILE, 'w')
+
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+
+    return lock_file
+
+
+def release_sync_lock(lock_file):
+    fcntl.flock(lock_file, fcntl.LOCK_UN)
+    lock_file.close()
+
+
+def is_sync_running():
+    ## True if any process holds the sync lock
+    lock_file = acquire_sync_lock(blocking=False)
+
+    if lock_file is None:
+        return True
+
+    release_sync_lock(lock_file)
+
+    return False
+
+
+def write_sync_status(**status):
+    ## replaces the shared status file - written to a temp file then renamed, so readers never see half of it
+    status['updated'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(hc.SYNC_STATUS_FILE), suffix='.tmp')
+    with os.fdopen(fd, 'w') as status_file:
+        json.dump(status, status_file)
+    os.replace(tmp_path, hc.SYNC_STATUS_FILE)
+
+
+def get_sync_status():
+    ## returns the last written sync status - state: idle, running, done or error
+    try:
+        with open(hc.SYNC_STATUS_FILE) as status_file:
+            status = json.load(status_file)
+    except (FileNotFoundError, ValueError):
+        return {'state': 'idle'}
+
+    # a worker that died mid sync never writes its final status
+    if status.get('state') == 'running' and not is_sync_running():
+        status = {'state': 'error', 'message': 'database update was interrupted, run it again to resume'}
+
+    return status
+
+
+def run_sync(lock_file):
+    ## sync thread body - holds the sync lock until finished
+    ## returns True if the sync succeeded
+    sync_start_time = time.perf_counter()
+
+    def progress(rows_done, max_rows):
+        write_sync_status(state='running', rows=rows_done, max_rows=max_rows,
+                          seconds=round(time.perf_counter() - sync_start_time, 1))
+
+    try:
+        message = sync(progress)
+        write_sync_status(state='done', message=message, seconds=round(time.perf_counter() - sync_start_time, 1))
+        return True
+    except Exception as e:
+        logger.error('database update error: %s', e)
+        write_sync_status(state='error', message=f'database update failed: {e}')
+        return False
+    finally:
+        release_sync_lock(lock_file)
+
+
+def start_background_sync():
+    ## starts a sync in a background thread of this process and returns True, or returns
+    ## False if a sync is already running here or in another worker - concurrent requests coalesce
+    global _sync_thread
+
+    with _sync_thread_lock:
+        if _sync_thread is not None and _sync_thread.is_alive():
+            logger.info('database update already running in this process')
+            return False
+
+        lock_file = acquire_sync_lock(blocking=False)
+
+        if lock_file is None:
+            logger.info('database update already running in another process')
+            return False
+
+        write_sync_status(state='running', rows=0, max_rows=None, seconds=0)
+
+        logger.info('starting background database update')
+        _sync_thread = executor.start_thread(run_sync, (lock_file,), 'hivekeepers-sync')
+
+    return True
+
+## ======================
+## scheduled sync
+## ======================
+
+_scheduler_thread = None
+
+
+def get_sync_lag():
+    ## returns remote max id, local high water mark and the lag between them (in ids)
+    with get_mysql_engine().connect() as conn:
+        remote_max_id = conn.execute(db.text('SELECT MAX(id) FROM sync_data')).scalar() or 0
+
+    with hp.get_sqlite_engine().begin() as conn:
+        local_max_id = hp.get_high_water_mark(conn)
+
+    return {'remote_max_id': int(remote_max_id), 'local_max_id': local_max_id,
+            'lag_ids': max(int(remote_max_id) - local_max_id, 0)}
+
+
+def write_sync_metrics(sync_metrics):
+    ## replaces the shared metrics file - same temp file and rename as the status file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(hc.SYNC_METRICS_FILE), suffix='.tmp')
+    with os.fdopen(fd, 'w') as metrics_file:
+        json.dump(sync_metrics, metrics_file)
+    os.replace(tmp_path, hc.SYNC_METRICS_FILE)
+
+
+def get_sync_metrics():
+    ## returns the last scheduled sync metrics - empty if the scheduler has not run
+    try:
+        with open(hc.SYNC_METRICS_FILE) as metrics_file:
+            return json.load(metrics_file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def get_next_wait(failures):
+    ## seconds until the next scheduled sync - the interval, doubled for each consecutive
+    ## failure up to SYNC_MAX_BACKOFF, then randomised by +/- SYNC_JITTER so workers and
+    ## containers restarted together don't all hit MySQL at once
+    wait = min(hc.SYNC_INTERVAL * 2 ** failures, max(hc.SYNC_MAX_BACKOFF, hc.SYNC_INTERVAL))
+
+    return wait * random.uniform(1 - hc.SYNC_JITTER, 1 + hc.SYNC_JITTER)
+
+
+def run_scheduler():
+    ## scheduler thread body - every worker runs one, only the holder of the scheduler lock
+    ## syncs, the others keep retrying the lock in case the holding worker exits
+    scheduler_lock_file = None
+    failures = 0
+    sync_metrics = get_sync_metrics()
+
+    while True:
+        wait = get_next_wait(failures)
+        logger.debug('next scheduled database update in %.0fs', wait)
+        time.sleep(wait)
+
+        if scheduler_lock_file is None:
+            scheduler_lock_file = acquire_sync_lock(blocking=False, lock_path=hc.SYNC_SCHEDULER_LOCK_FILE)
+
+            if scheduler_lock_file is None:
+                continue
+
+            logger.info('running scheduled database updates in this worker (pid %s)', os.getpid())
+
+        # an update started from the dashboard is running - it covers this round
+        lock_file = acquire_sync_lock(blocking=False)
+
+        if lock_file is None:
+            logger.info('database update already running, skipping scheduled update')
+            continue
+
+        logger.info('starting scheduled database update')
+        write_sync_status(state='running', rows=0, max_rows=None, seconds=0)
+        run_start_time = time.time()
+
+        succeeded = run_sync(lock_file)
+        failures = 0 if succeeded else failures + 1
+
+        sync_metrics.update({'last_run': run_start_time,
+                             'last_run_seconds': round(time.time() - run_start_time, 1),
+                             'last_run_succeeded': succeeded,
+                             'consecutive_failures': failures,
+                             'runs': sync_metrics.get('runs', 0) + 1,
+                             'failed_runs': sync_metrics.get('failed_runs', 0) + (not succeeded)})
+
+        if succeeded:
+            sync_metrics['last_success'] = time.time()
+
+        # remote vs local lag after the update - both max id lookups are index seeks
+        try:
+            sync_metrics.update(get_sync_lag())
+        except Exception as e:
+            logger.warning('sync lag check error: %s', e)
+
+        logger.info('scheduled database update finished: %s', sync_metrics)
+
+        try:
+            write_sync_metrics(sync_metrics)
+        except Exception as e:
+            logger.warning('sync metrics write error: %s', e)
+
+
+def start_scheduler():
+    ## starts the scheduled sync thread in this process if SYNC_INTERVAL is set
+    ## returns True if started
+    global _scheduler_thread
+
+    if hc.SYNC_INTERVAL <= 0:
+        logger.info('scheduled database updates are off (SYNC_INTERVAL=0)')
+        return False
+
+    with _sync_thread_lock:
+        if _scheduler_thread is not None and _scheduler_thread.is_alive():
+            return False
+
+        logger.info('starting scheduled database updates every %ss', hc.SYNC_INTERVAL)
+        _scheduler_thread = executor.start_thread(run_scheduler, name='hivekeepers-sync-scheduler')
+
+    return True
+
@@ -15,7 +15,8 @@ cores=$(nproc --all)
 workers="${APP_WORKERS:-$cores}"
 port="${APP_PORT:-8050}"
 
-threads_default=$(($cores - 1))
+# matches gunicorn_config.py
+threads_default=8
 threads="${APP_THREADS:-$threads_default}"
 
 log_level=${APP_LOG_LEVEL:-info}